@@ -7,20 +7,25 @@ This application contains the main() function for the DriveSystem GUI interface,
 which controls the motor within the ISS experiment at CERN. More information can
 be found on the `GitHub page <https://github.com/ISOLDESolenoidalSpectrometer/DriveSystemGUI>`
 """
+# Start timing the imports first if asked (the options cannot be parsed until they are imported)
+import sys
+import drivesystemstartupprofiler as dsprof
+PROFILER = dsprof.StartupProfiler.get_instance()
+if '--profile-startup' in sys.argv:
+    PROFILER.start()
+
 # Process options before everything else!
-import drivesystemoptions as dsopts
-dsopts.initialise_options()
-
-# Import the rest
-from filelock import Timeout
-from drivesystemlib import *
-import drivesystemcli as dscli
-import drivesystemgui as dsgui
-import drivesystemlock as dslock
-import drivesystemmotorinfo as dsmi
-import drivesystemguimotorinfo as dsgmi
-import resourcemonitor
-import wx
+with PROFILER.stage("Importing and reading options"):
+    import drivesystemoptions as dsopts
+    dsopts.initialise_options()
+
+# Import the rest - the GUI (wx, matplotlib...) and resource monitor (psutil) are only imported when used
+with PROFILER.stage("Importing the DriveSystem"):
+    from filelock import Timeout
+    from drivesystemlib import *
+    import drivesystemcli as dscli
+    import drivesystemlock as dslock
+    import drivesystemmotorinfo as dsmi
 
 ################################################################################
 ################################################################################
@@ -34,35 +39,51 @@ def main():
     able to open.
     """
     # Read encoder positions of everything
-    if not read_encoder_positions_of_elements( dsopts.OPTION_2D_LADDER_ENCODER_POSITION_MAP_PATH.get_value() ):
-        # We want this to fail because otherwise we cannot move anything with confidence!
-        return
+    with PROFILER.stage("Reading encoder positions of elements"):
+        if not read_encoder_positions_of_elements( dsopts.OPTION_2D_LADDER_ENCODER_POSITION_MAP_PATH.get_value() ):
+            # We want this to fail because otherwise we cannot move anything with confidence!
+            return
     
     # Store default axis mapping - this is set in the options file
-    dsmi.init_motor_properties()
-    if not dsmi.set_axis_mapping():
-        # We want this to fail because otherwise we don't know which axis goes where
-        return
+    with PROFILER.stage("Setting motor properties and axis mapping"):
+        dsmi.init_motor_properties()
+        if not dsmi.set_axis_mapping():
+            # We want this to fail because otherwise we don't know which axis goes where
+            return
     
+    # The simulated motor box registers its sim:// ports with serialinterface when it is imported
+    if dsopts.CMD_LINE_ARG_SERIAL_PORT.get_value().startswith('sim://'):
+        import MotorBoxSim
+
     # Initialise DriveSystem and DriveSystemThread
-    drive_system = DriveSystem()
-    drive_system_thread = DriveSystemThread()
-    drive_system_thread.start()
+    with PROFILER.stage("Creating the DriveSystem and starting threads"):
+        drive_system = DriveSystem()
+        drive_system_thread = DriveSystemThread()
+        drive_system_thread.start()
+        drive_system.duty_cycle_manager.start()
 
     # Resource monitoring
     if dsopts.CMD_LINE_ARG_MONITOR_RESOURCES.get_value():
+        import resourcemonitor
         monitor = resourcemonitor.ResourceMonitorThread()
         monitor.start()
    
     # Launch DriveSystemGUI if desired
     if dsopts.CMD_LINE_ARG_NO_GUI.get_value() == False:
+        with PROFILER.stage("Importing the GUI"):
+            import wx
+            import drivesystemgui as dsgui
+            import drivesystemguimotorinfo as dsgmi
+
         # Store graphics info about motors
         dsgmi.store_graphics_info_about_motors()
 
-        # Launch GUI
-        app = wx.App()
-        gui = dsgui.DriveSystemGUI(None, "ISS Drive System")
-        gui.Show()
+        # Launch GUI
+        with PROFILER.stage("Building the GUI"):
+            app = wx.App()
+            gui = dsgui.DriveSystemGUI(None, "ISS Drive System")
+            gui.Show()
+        PROFILER.print_report()
         
         # Run the loop with Ctrl + C exit capabilities
         try:
@@ -72,6 +93,7 @@ def main():
 
     # Old-fashioned loop if GUI not running - this automatically fails if the GUI is killed via Ctrl + C
     else:
+        PROFILER.print_report()
         dscli.cli_loop()
     
     # CLOSING DOWN PROCEDURE
@@ -83,6 +105,7 @@ def main():
         
     # Kill thread once main program complete
     drive_system_thread.kill_thread()
+    drive_system.duty_cycle_manager.kill_thread()
 
     # Kill resource monitor
     if dsopts.CMD_LINE_ARG_MONITOR_RESOURCES.get_value():
@@ -91,6 +114,7 @@ def main():
 
     # Ensure threads all rejoined
     drive_system_thread.join()
+    drive_system.duty_cycle_manager.join()
 
     # Goodbye message
     print("GOODBYE!")
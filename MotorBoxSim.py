@@ -1,86 +1,398 @@
 """
 Module for simulating the ISS motor box. Typically, a port will have to be opened using socat for using this.
+Alternatively, the DriveSystem can talk to a simulated motor box in the same process by using the port
+"sim://". Run with drivesystembenchmark.py --virtual-clock, the simulated box and the DriveSystem share a
+virtual clock, which runs faster than real time.
 """
 
 __version__ = 1.0
 
 import argparse as ap
 import numpy as np
+import os
+import random
 import re
+import selectors
+import serial
+import socket
 import threading
 import time
-import serial
+import urllib.parse
+from collections import deque
+from typing import Optional, Union
+
+import drivesystemclock as dsclock
 import serialinterface
 
-# Mock up of a motor so we can properly simulate things...
-class MotorSim( threading.Thread ):
+################################################################################
+# CONSTANTS
+SIM_URL_PREFIX = 'sim://' # Port alias for a simulated motor box in the same process
+MOTOR_NAMES = [ "Trolley", "Array", "TargetH", "FC", "TargetV", "BlockerH", "BlockerV" ]
+DEFAULT_ENCODER_POSITIONS = [ 19459, -40120, 12246, -12587, 0, 2066, 14926 ]
+BAUDRATE = 9600
+BITS_PER_CHARACTER = 10    # 7E1 is 1 start + 7 data + 1 parity + 1 stop bit
+PROCESSING_LATENCY = 0.005 # [s] Time the controller takes to act on a command
+CONSTANT_VELOCITY_DISTANCE = 1e12 # [steps] How far away the target is put for a constant velocity move
+COMMAND_PATTERN = re.compile( '(\\d+)(\\D\\D)(-?\\d*)\\r', re.IGNORECASE )
+UNKNOWN_COMMAND_REPLY = "00:! UNKNOWN COMMAND RECEIVED BY SIMULATION!"
+
+################################################################################
+def get_motor_names( number_of_axes : int = len(MOTOR_NAMES) ) -> list[str]:
     """
-    MotorSim is a thread that runs to simulate an individual motor. This can then be 
-    sent off to do something and sampled at will.
+    Gets the names of the motors in a box, using the ISS names for the first axes
+    and "AxisN" for any more
+
+    Parameters
+    ----------
+    number_of_axes : int
+        The number of axes in the box
+
+    Returns
+    -------
+    names : list[str]
+        The name of each motor (axis 1 first)
+    """
+    return [ MOTOR_NAMES[i] if i < len(MOTOR_NAMES) else f"Axis{i+1}" for i in range(number_of_axes) ]
+
+################################################################################
+def get_default_encoder_positions( number_of_axes : int = len(MOTOR_NAMES) ) -> list[int]:
+    """
+    Gets the starting encoder positions of the motors in a box, using the ISS
+    positions for the first axes and 0 for any more
+
+    Parameters
+    ----------
+    number_of_axes : int
+        The number of axes in the box
+
+    Returns
+    -------
+    encoder_list : list[int]
+        The encoder position of each motor (axis 1 first)
+    """
+    return [ DEFAULT_ENCODER_POSITIONS[i] if i < len(DEFAULT_ENCODER_POSITIONS) else 0 for i in range(number_of_axes) ]
+
+################################################################################
+################################################################################
+################################################################################
+class MotorSimEngine( threading.Thread ):
+    """
+    MotorSimEngine is a single thread that simulates every motor at once. The state
+    of the motors is held in NumPy arrays (one element per motor), so each tick
+    moves all of them together whatever the number of motors. Ticks are run on a
+    fixed grid of deadlines, and if a tick runs late the motors are moved on by
+    all of the time that has passed so they still move in real time. The motors
+    are also moved on whenever update() is called, so with a VirtualClock the
+    thread is not needed at all.
+
+    The motors follow the same trapezoidal profile as the Mclennan controller:
+    they accelerate up to the slew speed, decelerate down to the creep speed so
+    that they reach it "creep steps" before the target, and creep the rest of
+    the way. Each step is worked out exactly one phase of the profile at a time,
+    so the positions do not depend on how often the motors are moved on.
     """
     TIME_STEP = 0.1
+    MAX_PHASES_PER_STEP = 8 # Reverse, accelerate, cruise, decelerate, creep (+ spare)
+    TOLERANCE = 1e-6        # [steps] Allowed rounding error when finding the braking point
 
     ################################################################################
-    def __init__(self, axis : int, name : str) -> None:
+    def __init__(self, names : list[str], clock : Optional[dsclock.Clock] = None ) -> None:
         """
-        MotorSim: This sets up the simulation of the motor, sets some default parameters.
+        MotorSimEngine: sets up the arrays for the motors with default parameters
 
         Parameters
         ----------
-        axis : int
-            The number of the axis (for distinction from other motors)
-        name : str
-            The name of the motor (for distinction from other motors)
+        names : list[str]
+            The name of each motor (axis 1 first)
+        clock : Clock
+            The clock the motors move against (the shared clock if None)
         """
         # Thread bits
         self.is_running = True
+        self.event = dsclock.Event() # Used to kill the loop
+        self.lock = threading.Lock()   # Used to ensure the arrays are edited properly
         threading.Thread.__init__(self)
 
         # Motor properties
-        self.encoder = 0
-        self.target_encoder = 0
-        self.axis = axis
-        self.name = name
-        self.creep_speed = 100
-        self.slew_speed = 2000
-        self.is_aborted = False
-        self.status = "STATUS"
+        number_of_motors = len(names)
+        self.names = list(names)
+        self.encoder = np.zeros( number_of_motors, dtype=float )
+        self.target_encoder = np.zeros( number_of_motors, dtype=float )
+        self.velocity = np.zeros( number_of_motors, dtype=float )
+        self.creep_speed = np.full( number_of_motors, 100.0 )
+        self.slew_speed = np.full( number_of_motors, 2000.0 )
+        self.acceleration = np.full( number_of_motors, 1000.0 )
+        self.deceleration = np.full( number_of_motors, 1500.0 )
+        self.creep_steps = np.zeros( number_of_motors, dtype=float )
+        self.speed_limit = np.full( number_of_motors, np.inf ) # Lower than the slew speed for constant velocity moves
+        self.is_aborted = np.zeros( number_of_motors, dtype=bool )
+        self.status = [ "STATUS" ]*number_of_motors
+
+        # Time bits
+        self.clock = dsclock.get_clock() if clock is None else clock
+        self.last_update = self.clock.monotonic()
         return
-    
+
     ################################################################################
     def run(self) -> None:
         """
-        MotorSim: this function sets up the while loop for the thread
+        MotorSimEngine: this function sets up the while loop for the thread
         """
+        next_deadline = self.clock.monotonic() + self.TIME_STEP
         while self.is_running:
-            t0 = time.time()
-            
-            # Check if we need to move
-            if self.target_encoder != self.encoder and self.is_aborted == False:
-                # First set direction
-                if self.target_encoder < self.encoder:
-                    direction = -1
-                else:
-                    direction = 1
-                
-                # Calculate distance to move
-                dist_step = direction*self.TIME_STEP*self.slew_speed
-
-                # Move
-                if np.abs( self.encoder - self.target_encoder ) < dist_step:
-                    self.encoder = self.target_encoder
-                    self.status = 'Idle (TO BE CHECKED)'
-                else:
-                    self.encoder = direction*self.TIME_STEP*self.slew_speed + self.encoder
-            
-            # If motor aborted, stop moving
-            if self.is_aborted:
-                self.target_encoder = self.encoder
+            # Move everything on by the time since the last tick
+            self.update()
+            now = self.clock.monotonic()
 
-            time_elapsed = time.time() - t0
-            time.sleep( self.TIME_STEP - time_elapsed )
+            # Wait for the next deadline on the grid, skipping any that have been missed
+            if next_deadline <= now:
+                next_deadline += np.ceil( ( now - next_deadline )/self.TIME_STEP + 1e-9 )*self.TIME_STEP
+            self.clock.wait( self.event, next_deadline - self.clock.monotonic() )
+            next_deadline += self.TIME_STEP
         
         return
+
+    ################################################################################
+    def update(self, until : Optional[float] = None ) -> None:
+        """
+        MotorSimEngine: moves every motor on to the current time of the clock, or
+        to an earlier time (the motors are never moved back)
+
+        Parameters
+        ----------
+        until : float
+            The time of the clock to move on to (now if None)
+        """
+        with self.lock:
+            until = self.clock.monotonic() if until is None else until
+            if until > self.last_update:
+                self.step_no_lock( until - self.last_update )
+                self.last_update = until
+        return
+
+    ################################################################################
+    def step(self, dt : float ) -> None:
+        """
+        MotorSimEngine: moves every motor towards its target for a length of time
+
+        Parameters
+        ----------
+        dt : float
+            The time to move for in seconds
+        """
+        with self.lock:
+            self.step_no_lock(dt)
+        return
+
+    ################################################################################
+    def step_no_lock(self, dt : float ) -> None:
+        """
+        MotorSimEngine: moves every motor towards its target for a length of time
+        *without locking the arrays*
+
+        Parameters
+        ----------
+        dt : float
+            The time to move for in seconds
+        """
+        # If motor aborted, stop dead
+        self.target_encoder[self.is_aborted] = self.encoder[self.is_aborted]
+        self.velocity[self.is_aborted] = 0.0
+
+        time_left = np.full( len(self.names), float(dt) )
+        for phase in range(self.MAX_PHASES_PER_STEP):
+            is_active = ( time_left > 0 ) & ( ( self.target_encoder != self.encoder ) | ( self.velocity != 0 ) )
+            if not np.any(is_active):
+                return
+            index = np.nonzero(is_active)[0]
+            encoder = self.encoder[index]
+            target = self.target_encoder[index]
+            accel = np.maximum( self.acceleration[index], 1.0 )
+            decel = np.maximum( self.deceleration[index], 1.0 )
+            slew = np.maximum( np.minimum( self.slew_speed[index], self.speed_limit[index] ), 1.0 )
+            creep = np.minimum( np.maximum( self.creep_speed[index], 1.0 ), slew )
+            creep_steps = self.creep_steps[index]
+
+            # Work along the direction of the target, so speed towards it is positive
+            direction = np.where( target != encoder, np.sign( target - encoder ), -np.sign( self.velocity[index] ) )
+            remaining = np.abs( target - encoder )
+            speed = np.minimum( self.velocity[index]*direction, slew )
+            to_creep = remaining - creep_steps
+            braking = ( speed**2 - creep**2 )/( 2*decel )
+
+            # Which phase of the profile each motor is in
+            is_reversing = speed < 0
+            is_creeping = ~is_reversing & ( to_creep <= 0 )
+            is_decelerating = ~is_reversing & ~is_creeping & ( speed > creep ) & ( to_creep <= braking + self.TOLERANCE )
+            is_cruising = ~is_reversing & ~is_creeping & ~is_decelerating & ( speed >= slew )
+            is_accelerating = ~( is_reversing | is_creeping | is_decelerating | is_cruising )
+
+            # Acceleration towards the target, and the time and speed at the end of the phase
+            with np.errstate( divide='ignore', invalid='ignore' ):
+                speed = np.where( is_creeping, creep, speed )
+                required_decel = ( speed**2 - creep**2 )/( 2*to_creep )
+                peak_speed = np.sqrt( ( 2*accel*decel*to_creep + decel*speed**2 + accel*creep**2 )/( accel + decel ) )
+                accel_end_speed = np.where( peak_speed > creep, np.minimum( slew, peak_speed ), np.sqrt( speed**2 + 2*accel*np.maximum( to_creep, 0 ) ) )
+
+                acceleration = np.select(
+                    [ is_reversing, is_decelerating, is_accelerating ],
+                    [ decel, -required_decel, accel ],
+                    0.0
+                )
+                end_time = np.select(
+                    [ is_reversing, is_creeping, is_decelerating, is_cruising ],
+                    [ -speed/decel, remaining/creep, ( speed - creep )/required_decel, ( to_creep - braking )/speed ],
+                    ( accel_end_speed - speed )/accel
+                )
+                end_speed = np.select(
+                    [ is_reversing, is_decelerating, is_accelerating ],
+                    [ 0.0, creep, accel_end_speed ],
+                    speed
+                )
+            end_time = np.maximum( end_time, 0.0 )
+
+            # Move on to the end of the phase, or for as long as is left
+            step_time = np.minimum( end_time, time_left[index] )
+            is_phase_over = end_time <= time_left[index]
+            remaining -= speed*step_time + 0.5*acceleration*step_time**2
+            speed = np.where( is_phase_over, end_speed, speed + acceleration*step_time )
+
+            # Land exactly on the ends of the deceleration and creep
+            has_arrived = is_phase_over & ( is_creeping | ( is_decelerating & ( creep_steps <= 0 ) ) )
+            remaining = np.where( is_phase_over & is_decelerating, creep_steps, remaining )
+            remaining[has_arrived] = 0.0
+            speed[has_arrived] = 0.0
+
+            self.encoder[index] = target - direction*remaining
+            self.velocity[index] = direction*speed
+            time_left[index] -= step_time
+            for i in index[has_arrived]:
+                self.status[i] = 'Idle (TO BE CHECKED)'
+        return
+
+    ################################################################################
+    def kill_thread(self) -> None:
+        """
+        MotorSimEngine: kill the thread
+        """
+        self.is_running = False
+        self.event.set()
+        return
+
+
+################################################################################
+################################################################################
+################################################################################
+class MotorSim:
+    """
+    MotorSim is a view of one motor in a MotorSimEngine, so that a motor can be
+    sent off to do something and sampled at will.
+    """
+    ################################################################################
+    def __init__(self, engine : MotorSimEngine, axis : int ) -> None:
+        """
+        MotorSim: This sets up the view of the motor
+
+        Parameters
+        ----------
+        engine : MotorSimEngine
+            The engine simulating the motor
+        axis : int
+            The number of the axis (for distinction from other motors)
+        """
+        self.engine = engine
+        self.axis = axis
+        self.index = axis - 1
+        self.name = engine.names[self.index]
+
+        # State of the controller for this axis that the engine does not need
+        self.datum_mode = "00000000"    # See DM in the Mclennan manual
+        self.home_position = 0          # Set by SH
+        self.datum_index = 0            # Where the encoder index is (where HD finds the datum)
+        self.datum_position = None      # Position of the datum once it has been found
+        self.is_datum_search = False    # True while HD is still moving to the datum
+        self.is_constant_velocity = False
+        return
+
+    ################################################################################
+    @property
+    def encoder(self) -> int:
+        return int( round( self.engine.encoder[self.index] ) )
+
+    ################################################################################
+    @property
+    def target_encoder(self) -> int:
+        return int( round( self.engine.target_encoder[self.index] ) )
+
+    ################################################################################
+    @property
+    def slew_speed(self) -> int:
+        return int( self.engine.slew_speed[self.index] )
+
+    @slew_speed.setter
+    def slew_speed(self, value : int ) -> None:
+        with self.engine.lock:
+            self.engine.slew_speed[self.index] = value
+        return
+
+    ################################################################################
+    @property
+    def creep_speed(self) -> int:
+        return int( self.engine.creep_speed[self.index] )
+
+    @creep_speed.setter
+    def creep_speed(self, value : int ) -> None:
+        with self.engine.lock:
+            self.engine.creep_speed[self.index] = value
+        return
+
+    ################################################################################
+    @property
+    def creep_steps(self) -> int:
+        return int( self.engine.creep_steps[self.index] )
+
+    @creep_steps.setter
+    def creep_steps(self, value : int ) -> None:
+        with self.engine.lock:
+            self.engine.creep_steps[self.index] = value
+        return
+
+    ################################################################################
+    @property
+    def acceleration(self) -> int:
+        return int( self.engine.acceleration[self.index] )
+
+    @acceleration.setter
+    def acceleration(self, value : int ) -> None:
+        with self.engine.lock:
+            self.engine.acceleration[self.index] = value
+        return
+
+    ################################################################################
+    @property
+    def deceleration(self) -> int:
+        return int( self.engine.deceleration[self.index] )
+
+    @deceleration.setter
+    def deceleration(self, value : int ) -> None:
+        with self.engine.lock:
+            self.engine.deceleration[self.index] = value
+        return
+
+    ################################################################################
+    @property
+    def velocity(self) -> float:
+        return float( self.engine.velocity[self.index] )
+
+    ################################################################################
+    @property
+    def status(self) -> str:
+        return self.engine.status[self.index]
+
+    @status.setter
+    def status(self, value : str ) -> None:
+        self.engine.status[self.index] = value
+        return
     
     ################################################################################
     def move( self, new_encoder : int ) -> None:
@@ -92,10 +404,126 @@ class MotorSim( threading.Thread ):
         new_encoder : int
             The desired position for the motor
         """
-        self.target_encoder = new_encoder
-        self.status = f'{self.axis:02d}:! MOVING TO {new_encoder}'
+        with self.engine.lock:
+            self.engine.target_encoder[self.index] = new_encoder
+            self.engine.speed_limit[self.index] = np.inf
+            self.is_constant_velocity = False
+            self.is_datum_search = False
+            self.status = f'{self.axis:02d}:! MOVING TO {new_encoder}'
+        return
+
+    ################################################################################
+    def move_constant_velocity( self, velocity : int ) -> None:
+        """
+        MotorSim: this tells the motor to keep moving at a constant velocity (until
+        it is stopped or aborted)
+
+        Parameters
+        ----------
+        velocity : int
+            The velocity in steps per second (negative to move backwards)
+        """
+        with self.engine.lock:
+            direction = 1 if velocity >= 0 else -1
+            self.engine.target_encoder[self.index] = self.engine.encoder[self.index] + direction*CONSTANT_VELOCITY_DISTANCE
+            self.engine.speed_limit[self.index] = abs(velocity)
+            self.is_constant_velocity = True
+            self.is_datum_search = False
+            self.status = f'{self.axis:02d}:! CONSTANT VELOCITY {velocity}'
+        return
+
+    ################################################################################
+    def stop(self) -> None:
+        """
+        MotorSim: this tells the motor to decelerate to a stop
+        """
+        with self.engine.lock:
+            velocity = self.engine.velocity[self.index]
+            stopping_distance = velocity**2/( 2*max( self.engine.deceleration[self.index], 1.0 ) )
+            self.engine.target_encoder[self.index] = self.engine.encoder[self.index] + np.sign(velocity)*stopping_distance
+            self.is_constant_velocity = False
+            self.is_datum_search = False
+            self.status = f'{self.axis:02d}:! STOP'
+        return
+
+    ################################################################################
+    def search_for_datum(self) -> None:
+        """
+        MotorSim: this tells the motor to move to the encoder index (HD). The datum
+        is captured when it gets there (see finish_datum_search)
+        """
+        self.move(self.datum_index)
+        self.is_datum_search = True
+        self.status = f'{self.axis:02d}:! HOME TO DATUM'
+        return
+
+    ################################################################################
+    def finish_datum_search(self) -> None:
+        """
+        MotorSim: captures the datum if a datum search has reached the encoder
+        index, and sets the position to the home position if the datum mode says to
+        """
+        if not self.is_datum_search or self.is_moving():
+            return
+        self.is_datum_search = False
+        if self.encoder != round(self.datum_index):
+            return # Stopped or aborted before reaching the index
+        self.datum_position = self.encoder
+        if self.datum_mode[2] == '1':
+            self.redefine_position(self.home_position)
+            self.datum_position = self.home_position
+        return
+
+    ################################################################################
+    def redefine_position( self, encoder : int ) -> None:
+        """
+        MotorSim: this tells the motor where it is, moving the encoder index and
+        datum along with it (AP)
+
+        Parameters
+        ----------
+        encoder : int
+            The new position of the motor
+        """
+        shift = encoder - self.engine.encoder[self.index]
+        self.datum_index += shift
+        if self.datum_position is not None:
+            self.datum_position = int( round( self.datum_position + shift ) )
+        self.set_position(encoder)
         return
 
+    ################################################################################
+    def is_moving(self) -> bool:
+        """
+        MotorSim: this asks the motor if it is moving
+
+        Returns
+        -------
+        is_moving : bool
+            Whether the motor is moving or not
+        """
+        return bool( self.engine.velocity[self.index] != 0 or self.engine.target_encoder[self.index] != self.engine.encoder[self.index] )
+
+    ################################################################################
+    def get_current_operation(self) -> str:
+        """
+        MotorSim: gets what the motor is doing, as shown by CO
+
+        Returns
+        -------
+        operation : str
+            The current operation of the motor
+        """
+        if self.is_motor_aborted():
+            return "Aborted"
+        if not self.is_moving():
+            return "Idle"
+        if self.is_datum_search:
+            return "Home to datum"
+        if self.is_constant_velocity:
+            return "Constant velocity"
+        return f"Move to {self.target_encoder}"
+
     ################################################################################
     def set_position( self, encoder : int ) -> None:
         """
@@ -106,8 +534,12 @@ class MotorSim( threading.Thread ):
         encoder : int
             The actual position of the motor
         """
-        self.encoder = encoder
-        self.target_encoder = encoder
+        with self.engine.lock:
+            self.engine.encoder[self.index] = encoder
+            self.engine.target_encoder[self.index] = encoder
+            self.engine.velocity[self.index] = 0.0
+            self.engine.speed_limit[self.index] = np.inf
+            self.is_constant_velocity = False
         return
     
     ################################################################################
@@ -115,8 +547,12 @@ class MotorSim( threading.Thread ):
         """
         MotorSim: this tells the motor it's not allowed to move
         """
-        self.is_aborted = True
-        self.status = f'{self.axis:02d}:! COMMAND ABORT'
+        with self.engine.lock:
+            self.engine.is_aborted[self.index] = True
+            self.engine.target_encoder[self.index] = self.engine.encoder[self.index]
+            self.engine.velocity[self.index] = 0.0
+            self.is_constant_velocity = False
+            self.status = f'{self.axis:02d}:! COMMAND ABORT'
         return
     
     ################################################################################
@@ -124,11 +560,12 @@ class MotorSim( threading.Thread ):
         """
         MotorSim: this tells the motor it's allowed to move
         """
-        if self.is_aborted == False:
-            self.status = f'{self.axis:02d}:! NOT ABORTED'
-        else:
-            self.status = f'{self.axis:02d}: RESET'
-        self.is_aborted = False
+        with self.engine.lock:
+            if self.engine.is_aborted[self.index] == False:
+                self.status = f'{self.axis:02d}:! NOT ABORTED'
+            else:
+                self.status = f'{self.axis:02d}: RESET'
+            self.engine.is_aborted[self.index] = False
         return
     
     ################################################################################
@@ -138,249 +575,1283 @@ class MotorSim( threading.Thread ):
 
         Returns
         -------
-        self.is_aborted : bool
+        is_aborted : bool
             Whether the motor is aborted or not
         """
-        return self.is_aborted
+        return bool( self.engine.is_aborted[self.index] )
     
 
 ################################################################################
 ################################################################################
 ################################################################################
-class MotorBoxSim(serialinterface.SerialInterface):
+class FaultInjector:
     """
-    Simulation of the ISS motor box - all behaviour goes in the "process_command"
-    function
+    Injects the faults of a noisy serial line and a misbehaving controller into
+    the simulated motor box, so that timeouts, reconnecting and scan recovery can
+    be tested. Each fault happens with its own probability for each command (or
+    each reply), using a random number generator that can be seeded so that runs
+    can be repeated. Counters record every fault injected.
+
+    The faults are set with "name=value" pairs (see from_string and OPTIONS):
+      drop      : probability that a reply is never sent
+      truncate  : probability that a reply is cut short (losing its end of line)
+      garble    : probability that a character of a reply is corrupted
+      duplicate : probability that a reply is sent twice
+      delay     : probability that a reply is held back by up to max_delay
+      max_delay : the longest delay in seconds
+      abort     : probability that a moving axis aborts by itself
+      stuck     : axes (separated by ";") that ignore ma, mr and cv
+      seed      : seed for the random numbers
     """
+    OPTIONS = [ 'drop', 'truncate', 'garble', 'duplicate', 'delay', 'max_delay', 'abort', 'stuck', 'seed' ]
+
     ################################################################################
-    def __init__(self, portalias = None) -> None:
+    def __init__(self, drop : float = 0.0, truncate : float = 0.0, garble : float = 0.0, duplicate : float = 0.0, delay : float = 0.0, max_delay : float = 1.0, abort : float = 0.0, stuck : list[int] = [], seed : Optional[int] = None ) -> None:
         """
-        Initialises object, which only requires the (hard-coded) port alias
-
-        Parameters
-        ----------
-        portalias : str
-            The name of the port used for communication.
+        FaultInjector: sets the probability of each fault (see the class docstring)
         """
-        if portalias == None:
-            raise ValueError("Port alias must be given to proceed")
-        
-        super().__init__( portalias )
-        self.motor_list = {
-            1: MotorSim( 1, "Trolley" ),
-            2: MotorSim( 2, "Array" ),
-            3: MotorSim( 3, "TargetH" ),
-            4: MotorSim( 4, "FC" ),
-            5: MotorSim( 5, "TargetV" ),
-            6: MotorSim( 6, "BlockerH" ),
-            7: MotorSim( 7, "BlockerV" ),
-        }
-
-        # Start simulating motors
-        for motor in self.motor_list.values():
-            motor.start()
-        
+        self.drop = drop
+        self.truncate = truncate
+        self.garble = garble
+        self.duplicate = duplicate
+        self.delay = delay
+        self.max_delay = max_delay
+        self.abort = abort
+        self.stuck = list(stuck)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.reset_counters()
         return
+
     ################################################################################
-    def get_motor( self, axis : int ) -> MotorSim:
+    @classmethod
+    def from_string(cls, spec : str ) -> Optional['FaultInjector']:
         """
-        MotorBoxSim: getter for the motors
+        FaultInjector: creates a FaultInjector from comma-separated "name=value"
+        pairs, e.g. "drop=0.01,garble=0.005,stuck=3;4,seed=1"
 
-        Parameters
-        ----------
-        axis : int
-            The axis whose motor we wish to get
+        Returns
+        -------
+        fault_injector : FaultInjector
+            None if no faults are given
+        """
+        values = {}
+        for item in spec.split(','):
+            if item.strip() == "":
+                continue
+            key, _, value = item.partition('=')
+            values[key.strip()] = value.strip()
+        return cls.from_dict(values)
+
+    ################################################################################
+    @classmethod
+    def from_dict(cls, values : dict ) -> Optional['FaultInjector']:
+        """
+        FaultInjector: creates a FaultInjector from a dictionary of option names
+        (see OPTIONS) and their values as strings. Anything that cannot be read
+        is printed and ignored.
 
         Returns
         -------
-        motor : MotorSim
-            The requested motor from axis
+        fault_injector : FaultInjector
+            None if no faults are given
         """
-        return self.motor_list.get(axis)
-    
+        kwargs = {}
+        for key, value in values.items():
+            try:
+                if key == 'stuck':
+                    kwargs[key] = [ int(x) for x in value.split(';') if x.strip() != "" ]
+                elif key == 'seed':
+                    kwargs[key] = int(value)
+                elif key in cls.OPTIONS:
+                    kwargs[key] = float(value)
+                else:
+                    print(f"Unknown fault '{key}' ignored")
+            except ValueError:
+                print(f"Could not read fault {key}={value}, ignored")
+        if len(kwargs) == 0:
+            return None
+        return cls(**kwargs)
+
     ################################################################################
-    def set_initial_encoder_positions( self, encoder_list : list[int] ) -> None:
+    def __str__(self) -> str:
         """
-        MotorBoxSim: sets the initial encoder positions on all the motors
-        
-        Parameters
-        encoder_list : list[int]
-            List of integers denoting encoder positions for the motors. This list
-            must be the same length as the number of motors in the GUI!
+        FaultInjector: lists the faults being injected
         """
-        
-        if len(encoder_list) != len( self.motor_list.keys() ):
-            raise 
-            
-        for motor, encoder in zip( self.motor_list.values(), encoder_list ):
-            motor.set_position(encoder)
-        
+        return ",".join( [ f"{key}={getattr(self, key)}" for key in self.OPTIONS if key != 'stuck' ] + [ f"stuck={';'.join( [ str(x) for x in self.stuck ] )}" ] )
+
+    ################################################################################
+    def reset_counters(self) -> None:
+        """
+        FaultInjector: sets all the counters to zero
+        """
+        self.counters = { 'commands' : 0, 'dropped' : 0, 'truncated' : 0, 'garbled' : 0, 'duplicated' : 0, 'delayed' : 0, 'total_delay' : 0.0, 'aborted' : 0, 'ignored_moves' : 0 }
         return
 
     ################################################################################
-    # Overwritten from base class - timeout changed to make it speedier
-    def set_defaults( self ) -> None:
+    def is_stuck(self, axis : int ) -> bool:
         """
-        MotorBoxSim: Sets default options for the serial port, tailored to ISS
+        FaultInjector: says whether a move on an axis should be ignored (and
+        counts it)
         """
-        self.parity = serial.PARITY_EVEN
-        self.nbits = serial.SEVENBITS
-        self.baudrate = "9600"  # initial value
-        self.timeout = 0.1
+        if axis in self.stuck:
+            self.counters['ignored_moves'] += 1
+            return True
+        return False
 
     ################################################################################
-    def process_command(self, input : str) -> str:
+    def inject_abort(self, box : 'MotorBox' ) -> None:
+        """
+        FaultInjector: aborts a moving axis at random, as if its controller had
+        tripped by itself
+        """
+        if self.abort <= 0 or self.rng.random() >= self.abort:
+            return
+        moving_axes = [ axis for axis, motor in box.motor_list.items() if motor.velocity != 0 and not motor.is_motor_aborted() ]
+        if len(moving_axes) > 0:
+            box.get_motor( self.rng.choice(moving_axes) ).abort()
+            self.counters['aborted'] += 1
+        return
+
+    ################################################################################
+    def inject_into_reply(self, output : Union[str,list[str],None] ) -> tuple[Union[str,list[str],None],float]:
         """
-        MotorBoxSim: Processes an input and returns an output
+        FaultInjector: corrupts, drops, repeats or holds back a reply
 
         Parameters
         ----------
-        input : str
-            The input received from the serial port
+        output : str | list[str]
+            The reply from the motor box (each line of a list is treated separately)
 
         Returns
         -------
-        output : str
-            The data to be sent over the serial port (this function does not send this!)
+        output : str | list[str]
+            The reply actually sent (None if dropped)
+        delay : float
+            How much longer than usual to wait before sending it in seconds
         """
-        if input == None or input == "":
+        self.counters['commands'] += 1
+        delay = 0.0
+        if self.delay > 0 and self.rng.random() < self.delay:
+            delay = self.rng.uniform( 0.0, self.max_delay )
+            self.counters['delayed'] += 1
+            self.counters['total_delay'] += delay
+
+        if output is None:
+            return output, delay
+        if type(output) == list:
+            output = [ self.inject_into_line(x) for x in output ]
+            return [ x for x in output if x is not None ], delay
+        return self.inject_into_line(output), delay
+
+    ################################################################################
+    def inject_into_line(self, line : str ) -> Optional[str]:
+        """
+        FaultInjector: corrupts, drops or repeats a single line of a reply
+        """
+        if line is None or line == "":
+            return line
+        if self.drop > 0 and self.rng.random() < self.drop:
+            self.counters['dropped'] += 1
             return None
-        
-        # PATTERN-MATCH COMMON COMMANDS
-        pattern = re.match('(\d*)(\D\D)(-?\d*)\\r', input, re.IGNORECASE)
-        cmd_ret = "00:! UNKNOWN COMMAND RECEIVED BY SIMULATION!"
-        if pattern != None:
-            if len(pattern.groups()) == 3:
-                axis = int(pattern.group(1))
-                cmd = pattern.group(2)
-                arg = pattern.group(3)
-                motor = self.get_motor(axis)
-            
-                # OUTPUT ACTUAL POSITION (OA)
-                if cmd == 'oa':
-                    cmd_ret = f'{axis:02d}:{int(motor.encoder)}' + ' '*( 12 - len(str(motor.encoder)))
-                
-                # MOVE ABSOLUTE (MA)
-                elif cmd == 'ma':
-                    if motor.is_motor_aborted():
-                        cmd_ret = motor.status
-                    else:
-                        cmd_ret = motor.status
-                        motor.move(int(arg))
-                
-                # MOVE RELATIVE (MR)
-                elif cmd == 'mr':
-                    if motor.is_motor_aborted():
-                        cmd_ret = motor.status
-                    else:
-                        cmd_ret = motor.status
-                        motor.move( int(arg) + motor.encoder)
-                
-                # ABSOLUTE POSITION (AP)
-                elif cmd == 'ap':
-                    motor.set_position(int(arg))
-                    cmd_ret = f'{axis:02d}:! OK'
-                
-                # ABORT (AB)
-                elif cmd == 'ab':
-                    motor.abort()
-                    cmd_ret = motor.status
-
-                # RESET (RS)
-                elif cmd == 'rs':
-                    motor.reset()
-                    cmd_ret = motor.status
-                
-                # QUERY ALL (QA)
-                elif cmd == 'qa':
-                    query_all_list = [
-                        f"{axis:02d}qa\rMclennan Digiloop Motor Controller V1.04   Servo mode\r\n",
-                        f"Input command: {axis}qa\r\n",
-                        f"Address = {axis}                          Privilege level = 8\r\n",
-                        f"Mode = {motor.status}\r\n",
-                        f"Kf = ?         Kp = ????      Ks = ???       Kv = ??        Kx = ?\r\n",
-                        f"Deadband = 0                         \r\n",
-                        f"Slew speed = {motor.slew_speed}                     Limit decel = 20000000\r\n",
-                        f"Acceleration = 1000                  Deceleration = 1500\r\n",
-                        f"Creep speed = {motor.creep_speed}                    Creep steps = 0\r\n",
-                        f"Jog speed = 500                      Fast jog speed = 1000\r\n",
-                        f"Joystick speed = 10000               Jog Velocity Timeout = 2000\r\n",
-                        f"Settling time = 100                  Backoff steps = 0\r\n",
-                        f"Window = 4                           Threshold = 50 %\r\n",
-                        f"Tracking = 4000                      Timeout = 8000\r\n",
-                        f"Lower soft limit = -113933           Upper soft limit = 10000000\r\n",
-                        f"Lower hard limit on                  Upper hard limit on\r\n",
-                        f"Jog enabled                          Joystick disabled\r\n",
-                        f"Gearbox ratio =     1/1              Encoder ratio = -1/1\r\n",
-                        f"Display ratio =     1/1              Display Decimal Point = 0\r\n",
-                        f"Command pos = 0                      Actual pos = 0\r\n",
-                        f"Input pos = 0                        Home pos = 0\r\n",
-                        f"Pos error = 0                        Datum pos = None\r\n",
-                        f"Valid sequences: none (Autoexec disabled)\r\n",
-                        f"Valid cams: none\r\n",
-                        f"Valid profiles: none\r\n",
-                        f"Read port: 00000000                  Last write: 00000000\r\n",
-                    ]
-                    return query_all_list
-                
-                # LIST SEQUENCE
-                elif cmd == 'ls':
-                    list_sequence_list = [
-                        f"{axis:02d}ls\r{axis:02d}:Sequence {arg}:\r\n",
-                        f"X1\t####\r\n",
-                        f"X2\t####\r\n",
-                        f"X3\t####\r\n",
-                        f"X4\t####\r\n"
-                    ]
-                    return list_sequence_list
-
-
-
-
-
-        # TODO - more patterns to match based on motor box commands...
-        return input + cmd_ret + "\r\n"
-    
+        if self.garble > 0 and self.rng.random() < self.garble:
+            index = self.rng.randrange( len(line) )
+            line = line[:index] + chr( self.rng.randint( 0x21, 0x7e ) ) + line[index+1:]
+            self.counters['garbled'] += 1
+        if self.truncate > 0 and self.rng.random() < self.truncate:
+            line = line[:self.rng.randrange( len(line) )]
+            self.counters['truncated'] += 1
+        if self.duplicate > 0 and self.rng.random() < self.duplicate:
+            line = line + line
+            self.counters['duplicated'] += 1
+        return line
+
     ################################################################################
-    def kill(self) -> None:
+    def print_counters(self) -> None:
         """
-        MotorBoxSim: Kills all the motors so that they effectively pop out of existence
+        FaultInjector: prints the counters to the console
         """
-        for motor in self.motor_list.values():
-            motor.is_running = False
+        print(f"Faults injected ({self})")
+        print(f"Commands processed  : {self.counters['commands']}")
+        print(f"Replies dropped     : {self.counters['dropped']}")
+        print(f"Replies truncated   : {self.counters['truncated']}")
+        print(f"Replies garbled     : {self.counters['garbled']}")
+        print(f"Replies duplicated  : {self.counters['duplicated']}")
+        print(f"Replies delayed     : {self.counters['delayed']} ({self.counters['total_delay']:.3f} s in total)")
+        print(f"Spontaneous aborts  : {self.counters['aborted']}")
+        print(f"Moves ignored       : {self.counters['ignored_moves']}")
+        return
 
 
 ################################################################################
 ################################################################################
 ################################################################################
-def parse_command_line_arguments() -> None:
+class MotorBox:
     """
-    Returns port number and adds a bit of structure to the script for options 
-    (help and version number)
+    Simulation of the ISS motor box without a serial port - all behaviour goes in
+    the "process_command" function. The box also knows how long it takes to act
+    on a command (processing_latency) and how long each character takes over the
+    serial line (character_time), so that whatever connects it to the DriveSystem
+    can reply at the same pace as the real motor box.
+    """
+    ################################################################################
+    def __init__(self, clock : Optional[dsclock.Clock] = None, run_engine_thread : Optional[bool] = None, baudrate : int = BAUDRATE, processing_latency : float = PROCESSING_LATENCY, fault_injector : Optional[FaultInjector] = None, number_of_axes : int = len(MOTOR_NAMES) ) -> None:
+        """
+        MotorBox: creates the motors and starts simulating them
+
+        Parameters
+        ----------
+        clock : Clock
+            The clock the motors move against (the shared clock if None)
+        run_engine_thread : bool
+            Whether the motors are moved on by their own thread, rather than only
+            when a command is processed (by default, only on the real clock)
+        baudrate : int
+            The baud rate of the serial line (0 for replies that take no time)
+        processing_latency : float
+            The time in seconds the controller takes to act on a command
+        fault_injector : FaultInjector
+            The faults injected into the commands and replies (None for no faults)
+        number_of_axes : int
+            The number of motors in the box
+        """
+        self.engine = MotorSimEngine( get_motor_names(number_of_axes), clock )
+        self.motor_list = { axis : MotorSim( self.engine, axis ) for axis in range( 1, len(self.engine.names) + 1 ) }
+        self.character_time = BITS_PER_CHARACTER/baudrate if baudrate > 0 else 0.0
+        self.processing_latency = max( processing_latency, 0.0 )
+        self.fault_injector = fault_injector
+        self.reply_delay = 0.0 # Extra time before the reply to the last command is sent
+        self.datum_searches = set() # Axes still moving to their datum
+
+        # Mnemonic -> handler(motor, arg) for every command the box understands
+        self.command_handlers = {
+            'oa' : self.output_actual_position,
+            'oc' : self.output_command_position,
+            'co' : self.current_operation,
+            'ma' : self.move_absolute,
+            'mr' : self.move_relative,
+            'cv' : self.constant_velocity,
+            'hd' : self.home_to_datum,
+            'md' : self.move_to_datum,
+            'dm' : self.datum_mode,
+            'sh' : self.set_home,
+            'ap' : self.absolute_position,
+            'sv' : self.set_velocity,
+            'sa' : self.set_acceleration,
+            'sd' : self.set_deceleration,
+            'sc' : self.set_creep_speed,
+            'cr' : self.set_creep_steps,
+            'st' : self.stop,
+            'ab' : self.abort,
+            'rs' : self.reset,
+            'id' : self.identify,
+            'qa' : self.query_all,
+            'ls' : self.list_sequence,
+        }
+
+        # Start simulating motors (not needed with a virtual clock as they are moved on when asked)
+        if run_engine_thread is None:
+            run_engine_thread = not isinstance( self.engine.clock, dsclock.VirtualClock )
+        if run_engine_thread:
+            self.engine.start()
+        
+        return
+
+    ################################################################################
+    def get_transmission_time( self, text : Union[str,list[str],None] ) -> float:
+        """
+        MotorBox: gets the time taken to send some text over the serial line
+
+        Parameters
+        ----------
+        text : str | list[str]
+            The text to send (a list is sent one after the other)
+
+        Returns
+        -------
+        transmission_time : float
+            The time in seconds
+        """
+        if text is None:
+            return 0.0
+        if type(text) == list:
+            return sum( [ self.get_transmission_time(x) for x in text ] )
+        return len(text)*self.character_time
+
+    ################################################################################
+    def get_motor( self, axis : int ) -> MotorSim:
+        """
+        MotorBox: getter for the motors
+
+        Parameters
+        ----------
+        axis : int
+            The axis whose motor we wish to get
+
+        Returns
+        -------
+        motor : MotorSim
+            The requested motor from axis
+        """
+        return self.motor_list.get(axis)
+    
+    ################################################################################
+    def set_initial_encoder_positions( self, encoder_list : list[int] ) -> None:
+        """
+        MotorBox: sets the initial encoder positions on all the motors
+        
+        Parameters
+        ----------
+        encoder_list : list[int]
+            List of integers denoting encoder positions for the motors. This list
+            must be the same length as the number of motors in the box!
+        """
+        
+        if len(encoder_list) != len( self.motor_list.keys() ):
+            raise ValueError(f"{len(encoder_list)} encoder positions given for {len( self.motor_list.keys() )} motors")
+            
+        for motor, encoder in zip( self.motor_list.values(), encoder_list ):
+            motor.set_position(encoder)
+        
+        return
+
+    ################################################################################
+    def process_command(self, input : str, time : Optional[float] = None ) -> Union[str,list[str],None]:
+        """
+        MotorBox: Processes an input and returns an output, with any faults from
+        the fault injector. If the reply should be held back, reply_delay is set
+        to the extra time to wait before it is sent.
+
+        Parameters
+        ----------
+        input : str
+            The input received from the serial port
+        time : float
+            The time of the clock at which the command is acted on (now if None)
+
+        Returns
+        -------
+        output : str | list[str]
+            The data to be sent over the serial port (this function does not send this!)
+        """
+        output = self.process_command_without_faults( input, time )
+        self.reply_delay = 0.0
+        if self.fault_injector is None or input == None or input == "":
+            return output
+        self.fault_injector.inject_abort(self)
+        output, self.reply_delay = self.fault_injector.inject_into_reply(output)
+        return output
+
+    ################################################################################
+    def process_command_without_faults(self, input : str, time : Optional[float] = None ) -> Union[str,list[str],None]:
+        """
+        MotorBox: Processes an input and returns an output. The command is looked
+        up in command_handlers, which has a handler for each mnemonic.
+
+        Parameters
+        ----------
+        input : str
+            The input received from the serial port
+        time : float
+            The time of the clock at which the command is acted on (now if None)
+
+        Returns
+        -------
+        output : str | list[str]
+            The data to be sent over the serial port (this function does not send this!)
+        """
+        if input == None or input == "":
+            return None
+
+        # Bring the motors up to date
+        self.engine.update(time)
+        for axis in list(self.datum_searches):
+            motor = self.get_motor(axis)
+            motor.finish_datum_search()
+            if not motor.is_datum_search:
+                self.datum_searches.discard(axis)
+
+        # Find the handler for the command
+        pattern = COMMAND_PATTERN.match(input)
+        if pattern is None:
+            return input + UNKNOWN_COMMAND_REPLY + "\r\n"
+        axis = int(pattern.group(1))
+        handler = self.command_handlers.get( pattern.group(2).lower() )
+        if handler is None:
+            return input + UNKNOWN_COMMAND_REPLY + "\r\n"
+        motor = self.get_motor(axis)
+        if motor is None:
+            return None # Nothing is listening at this address
+
+        try:
+            cmd_ret = handler( motor, pattern.group(3) )
+        except ValueError:
+            cmd_ret = f'{axis:02d}:! INVALID PARAMETER'
+        if type(cmd_ret) == list:
+            return cmd_ret
+        return input + cmd_ret + "\r\n"
+
+    ################################################################################
+    # COMMAND HANDLERS - each takes the motor and the number after the mnemonic (as
+    # a string, which may be empty) and returns the reply. A list is sent as it is,
+    # otherwise the command is echoed before the reply.
+    ################################################################################
+    def output_actual_position(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: OA - output actual position
+        """
+        return f'{motor.axis:02d}:{int(motor.encoder)}' + ' '*( 12 - len(str(motor.encoder)))
+
+    ################################################################################
+    def output_command_position(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: OC - output command position (the target)
+        """
+        return f'{motor.axis:02d}:{motor.target_encoder}'
+
+    ################################################################################
+    def current_operation(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: CO - display current operation
+        """
+        return f'{motor.axis:02d}:{motor.get_current_operation()}'
+
+    ################################################################################
+    def move_absolute(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: MA - move absolute (replies with the status before the move)
+        """
+        cmd_ret = motor.status
+        if not motor.is_motor_aborted() and not ( self.fault_injector is not None and self.fault_injector.is_stuck(motor.axis) ):
+            motor.move( int(arg) )
+        return cmd_ret
+
+    ################################################################################
+    def move_relative(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: MR - move relative (replies with the status before the move)
+        """
+        cmd_ret = motor.status
+        if not motor.is_motor_aborted() and not ( self.fault_injector is not None and self.fault_injector.is_stuck(motor.axis) ):
+            motor.move( int(arg) + motor.encoder )
+        return cmd_ret
+
+    ################################################################################
+    def constant_velocity(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: CV - constant velocity move (at the slew speed if no velocity given)
+        """
+        cmd_ret = motor.status
+        if not motor.is_motor_aborted() and not ( self.fault_injector is not None and self.fault_injector.is_stuck(motor.axis) ):
+            motor.move_constant_velocity( int(arg) if arg != "" else motor.slew_speed )
+        return cmd_ret
+
+    ################################################################################
+    def home_to_datum(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: HD - search for the datum (the encoder index)
+        """
+        if motor.is_motor_aborted():
+            return motor.status
+        motor.search_for_datum()
+        self.datum_searches.add(motor.axis)
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def move_to_datum(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: MD - move to the datum found by the last datum search
+        """
+        if motor.is_motor_aborted():
+            return motor.status
+        if motor.datum_position is None:
+            return f'{motor.axis:02d}:! DATUM NOT FOUND'
+        motor.move(motor.datum_position)
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def datum_mode(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: DM - set the datum mode (eight 0/1 flags)
+        """
+        if len(arg) != 8 or arg.strip('01') != "":
+            raise ValueError(arg)
+        motor.datum_mode = arg
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def set_home(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: SH - set the home position (the current position if none given)
+        """
+        motor.home_position = int(arg) if arg != "" else motor.encoder
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def absolute_position(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: AP - set the current position
+        """
+        motor.redefine_position( int(arg) )
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def set_velocity(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: SV - set the slew speed
+        """
+        motor.slew_speed = int(arg)
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def set_acceleration(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: SA - set the acceleration
+        """
+        motor.acceleration = int(arg)
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def set_deceleration(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: SD - set the deceleration
+        """
+        motor.deceleration = int(arg)
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def set_creep_speed(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: SC - set the creep speed
+        """
+        motor.creep_speed = int(arg)
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def set_creep_steps(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: CR - set the number of creep steps
+        """
+        motor.creep_steps = int(arg)
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def stop(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: ST - decelerate to a stop
+        """
+        motor.stop()
+        return f'{motor.axis:02d}:! OK'
+
+    ################################################################################
+    def abort(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: AB - stop dead and refuse to move until reset
+        """
+        motor.abort()
+        return motor.status
+
+    ################################################################################
+    def reset(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: RS - reset after an abort
+        """
+        motor.reset()
+        return motor.status
+
+    ################################################################################
+    def identify(self, motor : MotorSim, arg : str ) -> str:
+        """
+        MotorBox: ID - identify the controller
+        """
+        return f'{motor.axis:02d}:Mclennan Digiloop Motor Controller V1.04'
+
+    ################################################################################
+    def query_all(self, motor : MotorSim, arg : str ) -> list[str]:
+        """
+        MotorBox: QA - query all the settings of the controller
+        """
+        axis = motor.axis
+        query_all_list = [
+            f"{axis:02d}qa\rMclennan Digiloop Motor Controller V1.04   Servo mode\r\n",
+            f"Input command: {axis}qa\r\n",
+            f"Address = {axis}                          Privilege level = 8\r\n",
+            f"Mode = {motor.status}\r\n",
+            f"Kf = ?         Kp = ????      Ks = ???       Kv = ??        Kx = ?\r\n",
+            f"Deadband = 0                         \r\n",
+            f"Slew speed = {motor.slew_speed}                     Limit decel = 20000000\r\n",
+            f"{f'Acceleration = {motor.acceleration}':37s}Deceleration = {motor.deceleration}\r\n",
+            f"{f'Creep speed = {motor.creep_speed}':37s}Creep steps = {motor.creep_steps}\r\n",
+            f"Jog speed = 500                      Fast jog speed = 1000\r\n",
+            f"Joystick speed = 10000               Jog Velocity Timeout = 2000\r\n",
+            f"Settling time = 100                  Backoff steps = 0\r\n",
+            f"Window = 4                           Threshold = 50 %\r\n",
+            f"Tracking = 4000                      Timeout = 8000\r\n",
+            f"Lower soft limit = -113933           Upper soft limit = 10000000\r\n",
+            f"Lower hard limit on                  Upper hard limit on\r\n",
+            f"Jog enabled                          Joystick disabled\r\n",
+            f"Gearbox ratio =     1/1              Encoder ratio = -1/1\r\n",
+            f"Display ratio =     1/1              Display Decimal Point = 0\r\n",
+            f"{f'Command pos = {motor.target_encoder}':37s}Actual pos = {motor.encoder}\r\n",
+            f"Input pos = 0                        Home pos = {motor.home_position}\r\n",
+            f"Pos error = 0                        Datum pos = {motor.datum_position}\r\n",
+            f"Valid sequences: none (Autoexec disabled)\r\n",
+            f"Valid cams: none\r\n",
+            f"Valid profiles: none\r\n",
+            f"Read port: 00000000                  Last write: 00000000\r\n",
+        ]
+        return query_all_list
+
+    ################################################################################
+    def list_sequence(self, motor : MotorSim, arg : str ) -> list[str]:
+        """
+        MotorBox: LS - list a stored sequence
+        """
+        axis = motor.axis
+        list_sequence_list = [
+            f"{axis:02d}ls\r{axis:02d}:Sequence {arg}:\r\n",
+            f"X1\t####\r\n",
+            f"X2\t####\r\n",
+            f"X3\t####\r\n",
+            f"X4\t####\r\n"
+        ]
+        return list_sequence_list
+    
+    ################################################################################
+    def kill(self) -> None:
+        """
+        MotorBox: Kills all the motors so that they effectively pop out of existence
+        """
+        self.engine.kill_thread()
+
+
+################################################################################
+################################################################################
+################################################################################
+class MotorBoxSim(serialinterface.SerialInterface):
+    """
+    Simulation of the ISS motor box connected to a serial port - all behaviour
+    goes in MotorBox.process_command
+    """
+    ################################################################################
+    def __init__(self, portalias = None, baudrate : int = BAUDRATE, processing_latency : float = PROCESSING_LATENCY, fault_injector : Optional[FaultInjector] = None, number_of_axes : int = len(MOTOR_NAMES) ) -> None:
+        """
+        Initialises object, which only requires the (hard-coded) port alias
+
+        Parameters
+        ----------
+        portalias : str
+            The name of the port used for communication.
+        baudrate : int
+            The baud rate used to pace the replies (0 to reply at once)
+        processing_latency : float
+            The time in seconds the controller takes to act on a command
+        fault_injector : FaultInjector
+            The faults injected into the commands and replies (None for no faults)
+        number_of_axes : int
+            The number of motors in the box
+        """
+        if portalias == None:
+            raise ValueError("Port alias must be given to proceed")
+        
+        super().__init__( portalias )
+        self.box = MotorBox( baudrate=baudrate, processing_latency=processing_latency, fault_injector=fault_injector, number_of_axes=number_of_axes )
+        return
+
+    ################################################################################
+    def get_motor( self, axis : int ) -> MotorSim:
+        """
+        MotorBoxSim: getter for the motors
+        """
+        return self.box.get_motor(axis)
+
+    ################################################################################
+    def set_initial_encoder_positions( self, encoder_list : list[int] ) -> None:
+        """
+        MotorBoxSim: sets the initial encoder positions on all the motors
+        """
+        self.box.set_initial_encoder_positions(encoder_list)
+        return
+
+    ################################################################################
+    # Overwritten from base class - timeout changed to make it speedier
+    def set_defaults( self ) -> None:
+        """
+        MotorBoxSim: Sets default options for the serial port, tailored to ISS
+        """
+        self.parity = serial.PARITY_EVEN
+        self.nbits = serial.SEVENBITS
+        self.baudrate = "9600"  # initial value
+        self.timeout = 0.1
+
+    ################################################################################
+    def process_command(self, input : str) -> str:
+        """
+        MotorBoxSim: Processes an input and returns an output (see
+        MotorBox.process_command). A virtual serial port passes the characters on
+        at once, so this waits for as long as the command would take to arrive and
+        be acted on, and for the reply to be sent, before returning.
+        """
+        clock = self.box.engine.clock
+        clock.sleep( self.box.get_transmission_time(input) + self.box.processing_latency )
+        output = self.box.process_command(input)
+        clock.sleep( self.box.reply_delay + self.box.get_transmission_time(output) )
+        return output
+
+    ################################################################################
+    def kill(self) -> None:
+        """
+        MotorBoxSim: Kills all the motors so that they effectively pop out of existence
+        """
+        self.box.kill()
+        if self.box.fault_injector is not None:
+            self.box.fault_injector.print_counters()
+
+
+################################################################################
+################################################################################
+################################################################################
+class LoopbackSerialPort:
+    """
+    Stands in for a serial.Serial connected to a simulated motor box in the same
+    process (used for the "sim://" port). The timing of the real serial line is
+    modelled: each character takes BITS_PER_CHARACTER/baudrate to send in either
+    direction, the controller acts on one command at a time PROCESSING_LATENCY
+    after the whole command has arrived, and readline() waits (on the clock) for
+    a whole line of the reply or for the timeout, like pyserial does. Commands
+    are acted on at exactly the time they would be by the real controller, as
+    the motors are brought up to that time first.
+
+    The timing and the number of axes can be changed in the port name, e.g.
+    "sim://?baudrate=9600&latency=0.005&axes=7" (baudrate=0 replies at once), and faults
+    can be injected in the same way, e.g. "sim://?drop=0.01&stuck=3&seed=1" (see
+    FaultInjector).
+    """
+    ################################################################################
+    def __init__(self, portalias : str = SIM_URL_PREFIX, timeout : Optional[float] = 3.0, clock : Optional[dsclock.Clock] = None, number_of_axes : int = len(MOTOR_NAMES), fault_injector : Optional[FaultInjector] = None ) -> None:
+        """
+        LoopbackSerialPort: creates the simulated motor box behind the port
+
+        Parameters
+        ----------
+        portalias : str
+            The name of the port (sim://, optionally with baudrate and latency)
+        timeout : float
+            How long readline() waits for a line in seconds (None waits forever)
+        clock : Clock
+            The clock used for all of the timing (the shared clock if None)
+        number_of_axes : int
+            The number of motors in the box (unless given in the port name)
+        fault_injector : FaultInjector
+            The faults to inject (unless given in the port name)
+        """
+        self.portalias = portalias
+        self.timeout = timeout
+        self.clock = dsclock.get_clock() if clock is None else clock
+
+        # Timing and fault options in the port name
+        baudrate = BAUDRATE
+        processing_latency = PROCESSING_LATENCY
+        faults = {}
+        for key, values in urllib.parse.parse_qs( urllib.parse.urlsplit(portalias).query ).items():
+            try:
+                if key == 'baudrate':
+                    baudrate = int( values[-1] )
+                elif key == 'latency':
+                    processing_latency = float( values[-1] )
+                elif key == 'axes':
+                    number_of_axes = int( values[-1] )
+                elif key in FaultInjector.OPTIONS:
+                    faults[key] = values[-1]
+                else:
+                    print(f"Unknown option '{key}' in {portalias} ignored")
+            except ValueError:
+                print(f"Could not read {key}={values[-1]} in {portalias}, using default")
+
+        # The motors are moved on whenever a command is acted on, so no thread is needed
+        if len(faults) > 0:
+            fault_injector = FaultInjector.from_dict(faults)
+        self.box = MotorBox( self.clock, run_engine_thread=False, baudrate=baudrate, processing_latency=processing_latency, fault_injector=fault_injector, number_of_axes=number_of_axes )
+        self.box.set_initial_encoder_positions( get_default_encoder_positions(number_of_axes) )
+        self.is_open = True
+        self.lock = threading.Lock()
+
+        # The serial line
+        self.input_buffer = ""              # Written but not yet a whole command (no carriage return yet)
+        self.pending_commands = deque()     # (time acted on, command) for commands not yet acted on
+        self.replies = deque()              # [time first character arrives, text] for replies not yet read
+        self.write_free_time = 0.0          # When the last character written has been sent
+        self.read_free_time = 0.0           # When the last character of the replies has been sent
+        self.controller_free_time = 0.0     # When the controller has finished the last command
+        self.command_log = None             # Set to a list to record (time written, command) for every command
+        return
+
+    ################################################################################
+    def open(self) -> None:
+        self.is_open = True
+        return
+
+    ################################################################################
+    def close(self) -> None:
+        self.is_open = False
+        return
+
+    ################################################################################
+    def write(self, data : bytes ) -> int:
+        """
+        LoopbackSerialPort: sends data to the simulated motor box, working out when
+        each complete command will be acted on
+
+        Returns
+        -------
+        number_of_bytes : int
+            The number of bytes written
+        """
+        character_time = self.box.character_time
+        with self.lock:
+            now = self.clock.monotonic()
+            self.update_no_lock(now)
+            text = data.decode('utf8')
+            start_time = max( now, self.write_free_time )
+            self.write_free_time = start_time + len(text)*character_time
+
+            position = 0
+            index = text.find( '\r', position )
+            while index >= 0:
+                command = self.input_buffer + text[position:index+1]
+                self.input_buffer = ""
+                received_time = start_time + ( index + 1 )*character_time
+                if self.command_log is not None:
+                    self.command_log.append( ( now, command ) )
+                self.controller_free_time = max( received_time, self.controller_free_time ) + self.box.processing_latency
+                self.pending_commands.append( ( self.controller_free_time, command ) )
+                position = index + 1
+                index = text.find( '\r', position )
+            self.input_buffer += text[position:]
+
+            # Act on anything that takes no time at all
+            self.update_no_lock(now)
+        return len(data)
+
+    ################################################################################
+    def update_no_lock(self, now : float ) -> None:
+        """
+        LoopbackSerialPort: acts on every command that the controller would have
+        got to by now, in order, and queues up the replies *without locking*
+        """
+        while len(self.pending_commands) > 0 and self.pending_commands[0][0] <= now:
+            command_time, command = self.pending_commands.popleft()
+            output = self.box.process_command( command, command_time )
+            if type(output) == list:
+                output = "".join(output)
+            if output is not None and output != "":
+                start_time = max( command_time + self.box.reply_delay, self.read_free_time )
+                self.read_free_time = start_time + len(output)*self.box.character_time
+                self.replies.append( [ start_time, output ] )
+        return
+
+    ################################################################################
+    def get_arrived_no_lock(self, now : float ) -> str:
+        """
+        LoopbackSerialPort: gets the characters of the replies that have arrived by
+        now and have not been read *without locking*
+        """
+        character_time = self.box.character_time
+        arrived = ""
+        for start_time, text in self.replies:
+            if start_time > now:
+                break
+            if character_time == 0:
+                arrived += text
+                continue
+            number_arrived = min( len(text), int( ( now - start_time )/character_time + 1e-6 ) )
+            arrived += text[:number_arrived]
+            if number_arrived < len(text):
+                break
+        return arrived
+
+    ################################################################################
+    def get_next_line_time_no_lock(self) -> float:
+        """
+        LoopbackSerialPort: gets the time that the next line of the replies will
+        have arrived (or that the next command is acted on, after which the replies
+        may have changed) *without locking*
+        """
+        for start_time, text in self.replies:
+            index = text.find('\n')
+            if index >= 0:
+                next_time = start_time + ( index + 1 )*self.box.character_time
+                break
+        else:
+            next_time = float('inf')
+        if len(self.pending_commands) > 0:
+            next_time = min( next_time, self.pending_commands[0][0] )
+        return next_time
+
+    ################################################################################
+    def remove_read_no_lock(self, number_read : int ) -> None:
+        """
+        LoopbackSerialPort: removes characters that have been read from the front
+        of the replies *without locking*
+        """
+        while number_read > 0 and len(self.replies) > 0:
+            start_time, text = self.replies[0]
+            if number_read >= len(text):
+                self.replies.popleft()
+                number_read -= len(text)
+            else:
+                self.replies[0] = [ start_time + number_read*self.box.character_time, text[number_read:] ]
+                number_read = 0
+        return
+
+    ################################################################################
+    def readline(self) -> bytes:
+        """
+        LoopbackSerialPort: waits for the next line of the replies and reads it. If
+        there is no complete line before the timeout, whatever has arrived is read,
+        like a serial port timing out.
+        """
+        start_time = self.clock.monotonic()
+        deadline = float('inf') if self.timeout is None else start_time + self.timeout
+        while True:
+            with self.lock:
+                now = self.clock.monotonic()
+                self.update_no_lock(now)
+                arrived = self.get_arrived_no_lock(now)
+                index = arrived.find('\n')
+                if index >= 0 or now >= deadline:
+                    line = arrived if index < 0 else arrived[:index+1]
+                    self.remove_read_no_lock( len(line) )
+                    return line.encode('utf8')
+                wake_up_time = min( self.get_next_line_time_no_lock(), deadline )
+            self.clock.sleep( wake_up_time - now )
+
+    ################################################################################
+    def read(self, size : int = 1 ) -> bytes:
+        """
+        LoopbackSerialPort: reads up to size characters of the replies that have
+        arrived, without waiting
+        """
+        with self.lock:
+            now = self.clock.monotonic()
+            self.update_no_lock(now)
+            text = self.get_arrived_no_lock(now)[:size]
+            self.remove_read_no_lock( len(text) )
+        return text.encode('utf8')
+
+    ################################################################################
+    def get_next_event_time(self) -> float:
+        """
+        LoopbackSerialPort: gets the time that the next command is acted on or the
+        next reply has finished arriving, whichever is first (inf if neither)
+        """
+        with self.lock:
+            next_time = float('inf')
+            if len(self.replies) > 0:
+                start_time, text = self.replies[0]
+                next_time = start_time + len(text)*self.box.character_time
+            if len(self.pending_commands) > 0:
+                next_time = min( next_time, self.pending_commands[0][0] )
+        return next_time
+
+    ################################################################################
+    @property
+    def in_waiting(self) -> int:
+        with self.lock:
+            now = self.clock.monotonic()
+            self.update_no_lock(now)
+            return len( self.get_arrived_no_lock(now) )
+
+# The DriveSystem opens sim:// ports through serialinterface, which does not know about the simulator
+serialinterface.register_url_handler( SIM_URL_PREFIX, LoopbackSerialPort )
+
+
+################################################################################
+################################################################################
+################################################################################
+class MotorBoxServer:
+    """
+    Serves several simulated motor boxes from one process, each on its own
+    pseudo-terminal (which the DriveSystem opens like a serial port) or TCP
+    socket (opened with "-p socket://host:port"). Each box is a
+    LoopbackSerialPort, so replies keep the timing of the real serial line, and
+    a single thread passes the data between all of them with a selector. This is
+    used to load test the DriveSystem with many more axes and boxes than ISS has.
+    """
+    ################################################################################
+    def __init__(self, number_of_boxes : int = 1, number_of_axes : int = len(MOTOR_NAMES), first_port : Optional[int] = None, host : str = 'localhost', baudrate : int = BAUDRATE, processing_latency : float = PROCESSING_LATENCY, faults : str = "" ) -> None:
+        """
+        MotorBoxServer: creates the boxes and opens a pty or socket for each
+
+        Parameters
+        ----------
+        number_of_boxes : int
+            The number of motor boxes to serve
+        number_of_axes : int
+            The number of motors in each box
+        first_port : int
+            Serve the boxes on TCP ports first_port, first_port + 1, ... (ptys are
+            used if None)
+        host : str
+            The address to listen on for TCP ports
+        baudrate : int
+            The baud rate used to pace the replies (0 to reply at once)
+        processing_latency : float
+            The time in seconds the controller takes to act on a command
+        faults : str
+            The faults to inject (see FaultInjector.from_string). Each box gets
+            its own seed (seed, seed + 1, ...) so they do not all fail together
+        """
+        self.selector = selectors.DefaultSelector()
+        self.ports = []       # LoopbackSerialPort for each box
+        self.names = []       # What to connect to for each box
+        self.connections = [] # File descriptor (pty) or socket the replies are sent to for each box (None if nothing connected)
+        self.secondary_fds = [] # Other ends of the ptys, kept open so reading never fails before something connects
+        self.is_running = True
+
+        for box_index in range(number_of_boxes):
+            fault_injector = FaultInjector.from_string(faults)
+            if fault_injector is not None and fault_injector.seed is not None:
+                fault_injector.seed += box_index
+                fault_injector.rng.seed(fault_injector.seed)
+            port = LoopbackSerialPort( f"{SIM_URL_PREFIX}?baudrate={baudrate}&latency={processing_latency}", timeout=0.0, number_of_axes=number_of_axes, fault_injector=fault_injector )
+            self.ports.append(port)
+
+            if first_port is None:
+                self.open_pty(box_index)
+            else:
+                self.open_socket( box_index, host, first_port + box_index )
+        return
+
+    ################################################################################
+    def open_pty(self, box_index : int ) -> None:
+        """
+        MotorBoxServer: opens a pseudo-terminal for a box, in raw mode so that
+        carriage returns are passed on as they are
+        """
+        import tty # Only on Unix, so only imported if ptys are used
+        main_fd, secondary_fd = os.openpty()
+        tty.setraw(secondary_fd)
+        os.set_blocking( main_fd, False )
+        self.names.append( os.ttyname(secondary_fd) )
+        self.connections.append(main_fd)
+        self.secondary_fds.append(secondary_fd)
+        self.selector.register( main_fd, selectors.EVENT_READ, ( 'pty', box_index ) )
+        return
+
+    ################################################################################
+    def open_socket(self, box_index : int, host : str, port_number : int ) -> None:
+        """
+        MotorBoxServer: listens on a TCP port for a box (one client at a time)
+        """
+        listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        listener.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+        listener.bind( ( host, port_number ) )
+        listener.listen(1)
+        listener.setblocking(False)
+        self.names.append( f"socket://{host}:{port_number}" )
+        self.connections.append(None)
+        self.selector.register( listener, selectors.EVENT_READ, ( 'listener', box_index ) )
+        return
+
+    ################################################################################
+    def receive(self, key : selectors.SelectorKey ) -> None:
+        """
+        MotorBoxServer: passes data that has arrived on to its box, or accepts a
+        new connection
+        """
+        kind, box_index = key.data
+        if kind == 'listener':
+            connection, address = key.fileobj.accept()
+            connection.setblocking(False)
+            connection.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+            if self.connections[box_index] is not None:
+                self.close_connection(box_index)
+            self.connections[box_index] = connection
+            self.selector.register( connection, selectors.EVENT_READ, ( 'socket', box_index ) )
+            print(f"Box {box_index+1}: connection from {address[0]}:{address[1]}")
+            return
+
+        try:
+            data = os.read( key.fileobj, 4096 ) if kind == 'pty' else key.fileobj.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if data == b"" and kind == 'socket':
+            self.close_connection(box_index)
+            return
+        self.ports[box_index].write(data)
+        return
+
+    ################################################################################
+    def send_replies(self) -> float:
+        """
+        MotorBoxServer: sends every reply that has arrived to whatever is connected
+
+        Returns
+        -------
+        next_time : float
+            The time of the clock when there will next be something to do
+        """
+        next_time = float('inf')
+        for box_index, port in enumerate(self.ports):
+            number_waiting = port.in_waiting
+            if number_waiting > 0:
+                data = port.read(number_waiting)
+                connection = self.connections[box_index]
+                try:
+                    if type(connection) == int:
+                        os.write( connection, data )
+                    elif connection is not None:
+                        connection.sendall(data)
+                except OSError:
+                    pass # Nobody is listening, so the reply is lost like on a real line
+            next_time = min( next_time, port.get_next_event_time() )
+        return next_time
+
+    ################################################################################
+    def close_connection(self, box_index : int ) -> None:
+        """
+        MotorBoxServer: closes the socket connected to a box
+        """
+        connection = self.connections[box_index]
+        if connection is not None and type(connection) != int:
+            self.selector.unregister(connection)
+            connection.close()
+            self.connections[box_index] = None
+        return
+
+    ################################################################################
+    def serve_forever(self) -> None:
+        """
+        MotorBoxServer: passes commands and replies between the boxes and whatever
+        is connected to them until stop() is called
+        """
+        clock = dsclock.get_clock()
+        next_time = float('inf')
+        while self.is_running:
+            timeout = min( max( next_time - clock.monotonic(), 0.0 ), 0.1 )
+            for key, mask in self.selector.select(timeout):
+                self.receive(key)
+            next_time = self.send_replies()
+        return
+
+    ################################################################################
+    def stop(self) -> None:
+        """
+        MotorBoxServer: stops serving and closes everything
+        """
+        self.is_running = False
+        for box_index in range( len(self.ports) ):
+            self.close_connection(box_index)
+        for key in list( self.selector.get_map().values() ):
+            self.selector.unregister(key.fileobj)
+            if type(key.fileobj) == int:
+                os.close(key.fileobj)
+            else:
+                key.fileobj.close()
+        for fd in self.secondary_fds:
+            os.close(fd)
+        self.selector.close()
+        for port in self.ports:
+            if port.box.fault_injector is not None:
+                port.box.fault_injector.print_counters()
+        return
+
+
+################################################################################
+################################################################################
+################################################################################
+def time_engine_ticks( number_of_axes : int, number_of_ticks : int ) -> float:
+    """
+    Times the ticks of a MotorSimEngine with every motor moving, without the
+    thread or any serial traffic
+
+    Parameters
+    ----------
+    number_of_axes : int
+        The number of motors in the engine
+    number_of_ticks : int
+        The number of ticks to time
 
     Returns
     -------
-    port : str
+    tick_time : float
+        The mean time a tick takes in seconds
+    """
+    engine = MotorSimEngine( get_motor_names(number_of_axes) )
+    # Far enough away that no motor reaches its target, half of them going backwards
+    engine.target_encoder[:] = np.where( np.arange(number_of_axes) % 2 == 0, 1e9, -1e9 )
+
+    start = time.perf_counter()
+    for tick in range(number_of_ticks):
+        engine.step( engine.TIME_STEP )
+    return ( time.perf_counter() - start )/number_of_ticks
+
+################################################################################
+def parse_command_line_arguments() -> ap.Namespace:
+    """
+    Returns port number and adds a bit of structure to the script for options 
+    (help and version number)
+
+    Returns
+    -------
+    args : argparse.Namespace
         The port that will be opened with which the simulation will communicate
+        (or the ptys/sockets to serve several boxes on), the number of axes, the
+        baud rate and latency used to pace the replies, and the faults to inject
     """
     parser = ap.ArgumentParser(prog='MotorBoxSim.py', description='Simulation of ISS motor box packaged up as a convenient python script', epilog='Could be more sophisticated...')
     parser.add_argument('--version', action='version', version=f'%(prog)s version {__version__}')
-    parser.add_argument('port', nargs=1, type=str, help='This is a port address, usually something like /dev/ttyXXX', metavar='port')
+    parser.add_argument('port', nargs='?', type=str, default=None, help='This is a port address, usually something like /dev/ttyXXX (leave out to serve on ptys or --socket)', metavar='port')
+    parser.add_argument('--axes', type=int, default=len(MOTOR_NAMES), help=f'number of axes in each box (default {len(MOTOR_NAMES)})', metavar='n')
+    parser.add_argument('--boxes', type=int, default=1, help='number of boxes to serve, each on its own pty or socket (default 1)', metavar='n')
+    parser.add_argument('--socket', type=int, default=None, help='serve the boxes on TCP ports starting at this one instead of on ptys (connect with -p socket://host:port)', metavar='port')
+    parser.add_argument('--host', type=str, default='localhost', help='address to listen on with --socket (default localhost)', metavar='host')
+    parser.add_argument('--baudrate', type=int, default=BAUDRATE, help=f'baud rate used to pace the replies, 0 to reply at once (default {BAUDRATE})', metavar='baud')
+    parser.add_argument('--latency', type=float, default=PROCESSING_LATENCY, help=f'time the controller takes to act on a command in seconds (default {PROCESSING_LATENCY})', metavar='s')
+    parser.add_argument('--time-ticks', type=int, default=None, help='time this many ticks of the simulated motors (all moving) in one box of --axes axes and exit', metavar='n')
+    parser.add_argument('--faults', type=str, default="", help='faults to inject as comma-separated name=value pairs, e.g. drop=0.01,garble=0.005,delay=0.02,max_delay=2,duplicate=0.01,truncate=0.01,abort=0.001,stuck=3;4,seed=1', metavar='spec')
     args = parser.parse_args()
 
-    return args.port[0]
+    if args.port is not None and ( args.boxes != 1 or args.socket is not None ):
+        parser.error("a port can only be given for a single box - leave it out to serve several boxes on ptys or sockets")
+    if args.axes < 1 or args.boxes < 1:
+        parser.error("there must be at least one box with at least one axis")
+
+    return args
 ################################################################################
 def main():
     """
     Simulates the ISS motor box by just opening a serial port and sending replies
-    when it receives anything
+    when it receives anything, or serves several boxes on ptys or sockets
     """
 
-    port = parse_command_line_arguments()
+    args = parse_command_line_arguments()
+
+    # Cost of moving the motors on, which is paid every tick whatever the traffic
+    if args.time_ticks is not None:
+        tick_time = time_engine_ticks( args.axes, args.time_ticks )
+        print(f"{args.axes} axes: {tick_time*1e6:.1f} us per tick (mean of {args.time_ticks} ticks)")
+        return
+
+    # Several boxes (or one without a port) served from this process
+    if args.port is None:
+        server = MotorBoxServer( args.boxes, args.axes, args.socket, args.host, args.baudrate, args.latency, args.faults )
+        for box_index, name in enumerate(server.names):
+            print(f"Box {box_index+1} ({args.axes} axes): {name}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("")
+        server.stop()
+        print("BYE")
+        return
 
     try:
-        m = MotorBoxSim(port)
-        m.set_initial_encoder_positions([  19459,-40120, 12246,-12587,     0,  2066, 14926 ])
+        m = MotorBoxSim( args.port, args.baudrate, args.latency, FaultInjector.from_string(args.faults), args.axes )
+        m.set_initial_encoder_positions( get_default_encoder_positions(args.axes) )
 
         while True:
             m.serial_port_read_write()
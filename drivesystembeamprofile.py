@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+DriveSystem Beam Profile
+========================
+
+Offline reconstruction of the beam profile from a slit scan. This takes the
+scan result file written by the DriveSystem (see drivesystemscanlog.py) and a
+detector-rate file recorded at the same time, lines up the two in time, and
+bins the detector rate against the offset of the target ladder from the centre
+of the slit. The centroid and FWHM of the profile are printed and a plot is
+saved.
+
+The detector-rate file is a CSV file with two columns: the time in seconds
+since the epoch (i.e. the same clock as time.time() on the DriveSystem
+computer) and the rate. Lines beginning with '#' and a single header line are
+ignored. The file is read in chunks so that long runs do not need to fit in
+memory. The scan result file only has one row per point (step scans) or per
+encoder sample (fly scans), so it is read in one go.
+"""
+
+__version__ = 1.0
+
+import argparse as ap
+import itertools
+import os
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+import drivesystemoptions as dsopts
+import drivesystemlib as dslib
+import drivesystemscanlog as dsscanlog
+
+################################################################################
+# CONSTANTS
+CHUNK_ROWS = 100000 # Number of lines of the rate file processed at once
+SLIT_AXIS_INDEX = { 'vert_slit' : 0, 'horz_slit' : 1 } # Index in AXIS_POSITION_DICT of the scanned axis
+
+################################################################################
+################################################################################
+################################################################################
+def read_rate_file_in_chunks( path : str, chunk_rows : int = CHUNK_ROWS, time_offset : float = 0.0 ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Reads the detector-rate file a chunk at a time
+
+    Parameters
+    ----------
+    path : str
+        The path to the detector-rate file
+    chunk_rows : int
+        The maximum number of lines read at once
+    time_offset : float
+        Added to every timestamp (to correct for a difference between the clock
+        of the detector and the DriveSystem computer)
+
+    Yields
+    ------
+    times : np.ndarray
+        The times of the readings in seconds since the epoch
+    rates : np.ndarray
+        The detector rates
+    """
+    with open( path, 'r' ) as file:
+        # Skip a header line if there is one
+        first_line = file.readline()
+        try:
+            float( first_line.split(',')[0] )
+            lines = itertools.chain( [first_line], file )
+        except ValueError:
+            lines = file
+
+        while True:
+            chunk = list( itertools.islice( lines, chunk_rows ) )
+            if len(chunk) == 0:
+                return
+            data = np.loadtxt( chunk, delimiter=',', comments='#', usecols=(0,1), ndmin=2 )
+            if len(data) > 0:
+                yield data[:,0] + time_offset, data[:,1]
+
+################################################################################
+def get_slit_centre( slit : str, metadata : dict, position_map : Optional[str] ) -> int:
+    """
+    Gets the encoder position of the centre of the slit along the scanned axis
+    from AXIS_POSITION_DICT. This is read from the position map if one is given,
+    otherwise the positions recorded in the scan file are used.
+
+    Parameters
+    ----------
+    slit : str
+        'vert_slit' or 'horz_slit'
+    metadata : dict
+        The header of the scan file
+    position_map : str
+        Path to a file mapping in-beam elements to encoder positions (see
+        drivesystemlib.read_encoder_positions_of_elements), or None
+
+    Returns
+    -------
+    centre : int
+        The encoder position of the slit centre
+    """
+    axis_index = SLIT_AXIS_INDEX[slit]
+    if position_map is None or not dslib.read_encoder_positions_of_elements( position_map ):
+        position = [0, 0]
+        position[axis_index] = int( metadata['slit_centre_encoder'] )
+        position[(axis_index + 1) % 2] = int( metadata.get('fixed_axis_encoder', 0) )
+        dsopts.AXIS_POSITION_DICT[slit] = position
+
+    return dsopts.AXIS_POSITION_DICT[slit][axis_index]
+
+################################################################################
+################################################################################
+################################################################################
+class BeamProfileBuilder:
+    """
+    Accumulates the detector rate in bins of offset from the slit centre. Chunks
+    of the detector-rate file are added one at a time, so only the bin totals
+    are kept in memory.
+    """
+    ################################################################################
+    def __init__(self, columns : dict, axis : int, centre_encoder : int, bin_width_in_mm : float ) -> None:
+        """
+        BeamProfileBuilder: works out where the target ladder was at each point
+        in time and sets up the bins
+
+        Parameters
+        ----------
+        columns : dict
+            The scan file, as read by drivesystemscanlog.read_columns
+        axis : int
+            The scanned axis
+        centre_encoder : int
+            The encoder position of the slit centre on the scanned axis
+        bin_width_in_mm : float
+            The width of the bins
+        """
+        is_axis = columns['axis'] == axis
+        is_point = is_axis & ( columns['record'] == dsscanlog.RECORD_POINT )
+        is_sample = is_axis & ( columns['record'] == dsscanlog.RECORD_SAMPLE )
+
+        # Step scans: the ladder sits at one position between arrival and departure
+        order = np.argsort( columns['arrival_wall'][is_point] )
+        self.point_start = columns['arrival_wall'][is_point][order]
+        self.point_end = columns['departure_wall'][is_point][order]
+        self.point_offset = ( columns['measured_encoder'][is_point][order] - centre_encoder )*dslib.STEP_TO_MM
+
+        # Fly scans: the ladder position is interpolated between samples
+        order = np.argsort( columns['arrival_wall'][is_sample] )
+        self.sample_time = columns['arrival_wall'][is_sample][order]
+        self.sample_offset = ( columns['measured_encoder'][is_sample][order] - centre_encoder )*dslib.STEP_TO_MM
+
+        all_offsets = np.concatenate( [ self.point_offset, self.sample_offset ] )
+        if len(all_offsets) == 0:
+            raise ValueError(f'No points or samples found for axis {axis} in the scan file')
+
+        # Bins are centred on whole multiples of the bin width
+        self.bin_width = bin_width_in_mm
+        self.lower_edge = ( np.floor( np.min(all_offsets)/bin_width_in_mm + 0.5 ) - 0.5 )*bin_width_in_mm
+        self.number_of_bins = int( np.floor( ( np.max(all_offsets) - self.lower_edge )/bin_width_in_mm ) ) + 1
+        self.rate_sum = np.zeros( self.number_of_bins )
+        self.counts = np.zeros( self.number_of_bins, dtype=int )
+        return
+
+    ################################################################################
+    def get_offsets(self, times : np.ndarray ) -> np.ndarray:
+        """
+        BeamProfileBuilder: gets the offset of the ladder from the slit centre
+        at the given times, which is NaN if the ladder was not at a scan point
+        or between two samples
+
+        Parameters
+        ----------
+        times : np.ndarray
+            Times in seconds since the epoch
+
+        Returns
+        -------
+        offsets : np.ndarray
+            Offsets in mm
+        """
+        offsets = np.full( len(times), np.nan )
+
+        if len(self.point_start) > 0:
+            index = np.searchsorted( self.point_start, times, side='right' ) - 1
+            is_valid = index >= 0
+            is_valid[is_valid] = times[is_valid] <= self.point_end[index[is_valid]]
+            offsets[is_valid] = self.point_offset[index[is_valid]]
+
+        if len(self.sample_time) > 1:
+            is_valid = ( times >= self.sample_time[0] ) & ( times <= self.sample_time[-1] )
+            offsets[is_valid] = np.interp( times[is_valid], self.sample_time, self.sample_offset )
+
+        return offsets
+
+    ################################################################################
+    def add(self, times : np.ndarray, rates : np.ndarray ) -> int:
+        """
+        BeamProfileBuilder: adds a chunk of detector readings to the bins
+
+        Parameters
+        ----------
+        times : np.ndarray
+            Times of the readings in seconds since the epoch
+        rates : np.ndarray
+            The detector rates
+
+        Returns
+        -------
+        number_used : int
+            The number of readings that fell inside the scan
+        """
+        bins = np.floor( ( self.get_offsets(times) - self.lower_edge )/self.bin_width )
+        is_valid = np.isfinite(bins) & ( bins >= 0 ) & ( bins < self.number_of_bins )
+        bins = bins[is_valid].astype(int)
+
+        self.rate_sum += np.bincount( bins, weights=rates[is_valid], minlength=self.number_of_bins )
+        self.counts += np.bincount( bins, minlength=self.number_of_bins )
+        return int( np.sum(is_valid) )
+
+    ################################################################################
+    def get_profile(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BeamProfileBuilder: gets the mean rate in each bin
+
+        Returns
+        -------
+        offsets : np.ndarray
+            The centre of each bin in mm
+        intensity : np.ndarray
+            The mean rate in each bin (NaN if there were no readings)
+        """
+        offsets = self.lower_edge + ( np.arange(self.number_of_bins) + 0.5 )*self.bin_width
+        with np.errstate( invalid='ignore', divide='ignore' ):
+            intensity = np.where( self.counts > 0, self.rate_sum/self.counts, np.nan )
+        return offsets, intensity
+
+
+################################################################################
+################################################################################
+################################################################################
+def get_centroid( offsets : np.ndarray, intensity : np.ndarray ) -> float:
+    """
+    Gets the intensity-weighted mean offset of the profile
+
+    Parameters
+    ----------
+    offsets : np.ndarray
+        Bin centres in mm
+    intensity : np.ndarray
+        Intensity in each bin (NaN bins are ignored)
+
+    Returns
+    -------
+    centroid : float
+        The centroid in mm (NaN if there is no intensity)
+    """
+    is_valid = np.isfinite(intensity)
+    weights = np.clip( intensity[is_valid], 0, None )
+    if np.sum(weights) <= 0:
+        return np.nan
+    return float( np.sum( offsets[is_valid]*weights )/np.sum(weights) )
+
+################################################################################
+def get_fwhm( offsets : np.ndarray, intensity : np.ndarray ) -> float:
+    """
+    Gets the full width at half maximum of the profile, interpolating linearly
+    between bins at the half-maximum crossings on either side of the peak
+
+    Parameters
+    ----------
+    offsets : np.ndarray
+        Bin centres in mm
+    intensity : np.ndarray
+        Intensity in each bin (NaN bins are ignored)
+
+    Returns
+    -------
+    fwhm : float
+        The FWHM in mm (NaN if the profile does not fall below half maximum on
+        both sides of the peak)
+    """
+    is_valid = np.isfinite(intensity)
+    x = offsets[is_valid]
+    y = intensity[is_valid]
+    if len(y) < 3:
+        return np.nan
+
+    peak = np.argmax(y)
+    half_max = 0.5*y[peak]
+
+    below_left = np.nonzero( y[:peak] < half_max )[0]
+    below_right = np.nonzero( y[peak:] < half_max )[0]
+    if len(below_left) == 0 or len(below_right) == 0:
+        return np.nan
+
+    i = below_left[-1]
+    left = np.interp( half_max, [ y[i], y[i+1] ], [ x[i], x[i+1] ] )
+    j = peak + below_right[0]
+    right = np.interp( half_max, [ y[j], y[j-1] ], [ x[j], x[j-1] ] )
+    return float( right - left )
+
+################################################################################
+def plot_profile( path : str, offsets : np.ndarray, intensity : np.ndarray, centroid : float, fwhm : float, title : str ) -> None:
+    """
+    Saves a plot of the beam profile
+
+    Parameters
+    ----------
+    path : str
+        Where to save the plot
+    offsets : np.ndarray
+        Bin centres in mm
+    intensity : np.ndarray
+        Intensity in each bin
+    centroid : float
+        The centroid in mm
+    fwhm : float
+        The FWHM in mm
+    title : str
+        The title of the plot
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+
+    fig, ax = plt.subplots()
+    ax.step( offsets, intensity, where='mid', color='tab:blue' )
+    if np.isfinite(centroid):
+        ax.axvline( centroid, color='tab:red', linestyle='--', label=f'Centroid = {centroid:.3f} mm' )
+    if np.isfinite(fwhm):
+        ax.axvspan( centroid - 0.5*fwhm, centroid + 0.5*fwhm, color='tab:red', alpha=0.15, label=f'FWHM = {fwhm:.3f} mm' )
+    ax.set_xlabel('Offset from slit centre [mm]')
+    ax.set_ylabel('Mean detector rate')
+    ax.set_title(title)
+    ax.legend()
+    fig.savefig(path)
+    plt.close(fig)
+    return
+
+################################################################################
+################################################################################
+################################################################################
+def parse_command_line_arguments() -> ap.Namespace:
+    """
+    Parses the command line arguments for the beam profile tool
+    """
+    parser = ap.ArgumentParser(prog='drivesystembeamprofile.py', description='Reconstructs the beam profile from a slit-scan result file and a detector-rate file (CSV of time since the epoch in seconds, rate)')
+    parser.add_argument('--version', action='version', version=f'%(prog)s version {__version__}')
+    parser.add_argument('scan_file', type=str, help='the .csv scan result file written by the DriveSystem')
+    parser.add_argument('rate_file', type=str, help='the detector-rate file')
+    parser.add_argument('--slit', type=str, choices=list(SLIT_AXIS_INDEX.keys()), default=None, help='the slit that was scanned (read from the scan file by default)')
+    parser.add_argument('--position-map', type=str, default=None, metavar='file', help='file of in-beam element encoder positions used for the slit centre (the centre recorded in the scan file is used by default)')
+    parser.add_argument('--bin-width', type=float, default=None, metavar='mm', help='width of the offset bins (the step size in the scan file by default)')
+    parser.add_argument('--time-offset', type=float, default=0.0, metavar='s', help='added to the detector timestamps to line them up with the DriveSystem clock')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, metavar='n', help='number of lines of the rate file to process at once')
+    parser.add_argument('-o', '--output', type=str, default=None, metavar='file', help='where to save the plot (defaults to the scan file with _profile.png)')
+    return parser.parse_args()
+
+################################################################################
+def main():
+    """
+    Reconstructs the beam profile from the files given on the command line
+    """
+    args = parse_command_line_arguments()
+
+    metadata = dsscanlog.read_header( args.scan_file )
+    slit = args.slit if args.slit is not None else metadata.get('slit', None)
+    if slit not in SLIT_AXIS_INDEX:
+        print(f"Cannot tell which slit was scanned from {args.scan_file}. Please use --slit.")
+        return
+    axis = 3 if SLIT_AXIS_INDEX[slit] == 0 else 5
+    centre = get_slit_centre( slit, metadata, args.position_map )
+
+    bin_width = args.bin_width
+    if bin_width is None:
+        bin_width = float( metadata.get('step_size_in_mm', 0.1) )
+
+    builder = BeamProfileBuilder( dsscanlog.read_columns(args.scan_file), axis, centre, bin_width )
+    number_read = 0
+    number_used = 0
+    for times, rates in read_rate_file_in_chunks( args.rate_file, args.chunk_rows, args.time_offset ):
+        number_read += len(times)
+        number_used += builder.add( times, rates )
+
+    if number_used == 0:
+        print(f"None of the {number_read} detector readings were taken during the scan. Check the clocks (see --time-offset).")
+        return
+
+    offsets, intensity = builder.get_profile()
+    centroid = get_centroid( offsets, intensity )
+    fwhm = get_fwhm( offsets, intensity )
+
+    print(f"Used {number_used} of {number_read} detector readings")
+    print(f"Slit centre = {centre} (axis {axis})")
+    print(f"Centroid    = {centroid:.3f} mm")
+    print(f"FWHM        = {fwhm:.3f} mm")
+
+    output = args.output if args.output is not None else os.path.splitext(args.scan_file)[0] + '_profile.png'
+    plot_profile( output, offsets, intensity, centroid, fwhm, f"{slit} scan ({metadata.get('started', '')})" )
+    np.savetxt( os.path.splitext(output)[0] + '.csv', np.column_stack( [ offsets, intensity, builder.counts ] ), delimiter=',', fmt='%.6g', header='offset_in_mm,mean_rate,readings' )
+    print(f"Saved profile to {output}")
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+DriveSystem Benchmark
+=====================
+
+Drives the DriveSystem through standard workloads against the simulated motor
+box, so that changes to the polling, pipelining, scans and aborts can be
+measured and compared between commits. The simulated box models the serial line
+(9600 baud 7E1) and the latency of the controller, so the timings predict what
+happens with the real motor box. The box is either in the same process (sim://)
+or served on a pseudo-terminal, so that the real serial port code is used too.
+
+The workloads are
+  idle        : the DriveSystemThread polling the positions once a second
+  sweeps      : reading the position of all seven axes one after the other
+  group_moves : moving several axes together with move_group and waiting
+  slit_scan   : a short step-mode slit scan across the vertical slit
+  abort_storm : aborting everything at random times while the positions are
+                being read as fast as possible
+
+For each, the commands per second, the CPU time and memory used are reported,
+along with the sweep period, the latency of each command (from asking the
+DriveSystem to getting the answer), and the time from asking for an abort to it
+being written to the serial port. The results are written to a JSON file, and a
+previous file can be given to compare against. On the virtual clock, the same
+seed always gives the same times, which --check-determinism checks by running
+everything a second time.
+"""
+
+__version__ = 1.0
+
+import argparse as ap
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+import drivesystemclock as dsclock
+import drivesystemoptions as dsopts
+import MotorBoxSim
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+################################################################################
+# CONSTANTS
+WORKLOADS = [ 'idle', 'sweeps', 'group_moves', 'slit_scan', 'abort_storm' ]
+TRANSPORTS = [ 'sim', 'pty' ]
+DEFAULT_OUTPUT_FILE = "benchmark_results.json"
+NUMBER_OF_AXES = 7
+GROUP_MOVE_AXES = [3, 5, 6, 7]  # Target ladder and beam blocker
+GROUP_MOVE_DISTANCE = 2000      # [steps] How far each axis moves in a group move
+SLIT_SCAN_OPTIONS = {           # A short scan so the benchmark does not take all day
+    'OFFSET_IN_MM' : 0.5,
+    'STEP_SIZE_IN_MM' : 0.25,
+    'WAIT_TIME_IN_SECONDS' : 0.2,
+    'SCAN_MODE' : 'step',
+}
+MACHINE_METRICS = [ 'wall_s', 'cpu_s', 'cpu_percent', 'rss_mb' ] # Depend on the computer rather than the clock
+
+################################################################################
+################################################################################
+################################################################################
+def summarise_times( times : list[float] ) -> dict:
+    """
+    Summarises a list of times in seconds as milliseconds
+
+    Parameters
+    ----------
+    times : list[float]
+        The times in seconds
+
+    Returns
+    -------
+    summary : dict
+        count, and mean, p50, p99 and max in ms (None if there are no times)
+    """
+    if len(times) == 0:
+        return { 'count' : 0, 'mean_ms' : None, 'p50_ms' : None, 'p99_ms' : None, 'max_ms' : None }
+    times = 1000.0*np.array(times)
+    return {
+        'count' : len(times),
+        'mean_ms' : float( np.mean(times) ),
+        'p50_ms' : float( np.percentile( times, 50 ) ),
+        'p99_ms' : float( np.percentile( times, 99 ) ),
+        'max_ms' : float( np.max(times) ),
+    }
+
+################################################################################
+def get_rss_in_mb() -> float:
+    """
+    Gets the memory used by this process in MB (the peak if psutil is not
+    installed)
+    """
+    if psutil is not None:
+        return psutil.Process( os.getpid() ).memory_info().rss/1024/1024
+    import resource # Only on Unix
+    return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss/1024
+
+################################################################################
+def get_git_commit() -> Optional[str]:
+    """
+    Gets the git commit of the source directory (None if it is not known)
+    """
+    try:
+        return subprocess.run( ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname( os.path.abspath(__file__) ), capture_output=True, text=True, check=True ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+################################################################################
+################################################################################
+################################################################################
+class Benchmark:
+    """
+    Sets up the DriveSystem against a simulated motor box and runs the
+    workloads, keeping the results of each
+    """
+    ################################################################################
+    def __init__(self, transport : str = 'sim', virtual_clock : bool = False, baudrate : int = MotorBoxSim.BAUDRATE, processing_latency : float = MotorBoxSim.PROCESSING_LATENCY, faults : str = "", seed : int = 1, verbose : bool = False ) -> None:
+        """
+        Benchmark: starts the simulated motor box and the DriveSystem
+
+        Parameters
+        ----------
+        transport : str
+            'sim' for a box in the same process, or 'pty' for a box served on a
+            pseudo-terminal
+        virtual_clock : bool
+            Run on a VirtualClock (only with 'sim'), so the times are those the
+            real box would take but the benchmark runs as fast as possible
+        baudrate : int
+            The baud rate of the simulated serial line
+        processing_latency : float
+            The time in seconds the simulated controller takes to act on a command
+        faults : str
+            Faults to inject (see MotorBoxSim.FaultInjector.from_string)
+        seed : int
+            Seed for the random times in the abort storm
+        verbose : bool
+            Print everything the DriveSystem prints while the workloads run
+        """
+        self.transport = transport
+        self.verbose = verbose
+        self.rng = random.Random(seed)
+        self.server = None
+        self.results = {}
+        self.temporary_directory = tempfile.TemporaryDirectory()
+
+        if virtual_clock:
+            if transport != 'sim':
+                print("The virtual clock can only be used with the sim transport. Using the real clock.")
+            else:
+                dsclock.set_clock( dsclock.VirtualClock() )
+        self.clock = dsclock.get_clock()
+        self.is_virtual_clock = isinstance( self.clock, dsclock.VirtualClock )
+
+        # The simulated motor box
+        if transport == 'pty':
+            self.server = MotorBoxSim.MotorBoxServer( 1, NUMBER_OF_AXES, baudrate=baudrate, processing_latency=processing_latency, faults=faults )
+            self.server_thread = threading.Thread( target=self.server.serve_forever, daemon=True )
+            self.server_thread.start()
+            port_name = self.server.names[0]
+        else:
+            port_name = f"{MotorBoxSim.SIM_URL_PREFIX}?baudrate={baudrate}&latency={processing_latency}"
+            if faults != "":
+                port_name += "&" + faults.replace(',', '&')
+        dsopts.CMD_LINE_ARG_SERIAL_PORT.set_value(port_name)
+        dsopts.OPTION_SCAN_RESULTS_DIRECTORY.set_value( self.temporary_directory.name )
+
+        # The DriveSystem (imported here as it reads the options when imported)
+        import drivesystemlib as dslib
+        import drivesystemmotorinfo as dsmi
+        self.dslib = dslib
+        with self.quiet():
+            dslib.populate_dictionary_with_default_elements()
+            dsmi.init_motor_properties()
+            dsmi.set_axis_mapping()
+            self.drive_system = dslib.DriveSystem()
+            self.drive_system_thread = dslib.DriveSystemThread()
+            self.drive_system_thread.pause_thread()
+            self.clock.start_thread( self.drive_system_thread )
+
+        # Record every command as it is written to the simulated box
+        self.sim_port = self.server.ports[0] if self.server is not None else self.drive_system.serial_port
+        self.sim_port.command_log = []
+        return
+
+    ################################################################################
+    def quiet(self):
+        """
+        Benchmark: hides what the DriveSystem prints (unless verbose)
+        """
+        return contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout( io.StringIO() )
+
+    ################################################################################
+    def run_workload(self, name : str, workload : Callable[[], dict] ) -> dict:
+        """
+        Benchmark: runs a workload, adding the commands per second, elapsed time,
+        CPU and memory to the metrics it returns
+
+        Parameters
+        ----------
+        name : str
+            The name of the workload
+        workload : Callable
+            Runs the workload and returns its metrics
+
+        Returns
+        -------
+        metrics : dict
+            The metrics of the workload
+        """
+        self.drive_system.rate_limiter.reset_counters()
+        self.sim_port.command_log.clear()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        clock_start = self.clock.monotonic()
+
+        with self.quiet():
+            metrics = workload()
+
+        elapsed_time = self.clock.monotonic() - clock_start
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.process_time() - cpu_start
+        number_of_commands = len(self.sim_port.command_log)
+        metrics.update( {
+            'elapsed_s' : elapsed_time,
+            'wall_s' : wall_time,
+            'commands' : number_of_commands,
+            'commands_per_s' : number_of_commands/elapsed_time if elapsed_time > 0 else None,
+            'cpu_s' : cpu_time,
+            'cpu_percent' : 100.0*cpu_time/wall_time if wall_time > 0 else None,
+            'rss_mb' : get_rss_in_mb(),
+        } )
+        self.results[name] = metrics
+        return metrics
+
+    ################################################################################
+    def get_sweep_periods(self) -> list[float]:
+        """
+        Benchmark: gets the time between successive reads of axis 1 in the command
+        log, i.e. the period of the sweeps over all the axes
+        """
+        times = [ t for t, command in self.sim_port.command_log if command == "1oa\r" ]
+        return list( np.diff(times) )
+
+    ################################################################################
+    def idle(self, duration : float ) -> dict:
+        """
+        Benchmark: leaves the DriveSystemThread polling the positions
+        """
+        self.drive_system_thread.resume_thread()
+        self.clock.sleep(duration)
+        self.drive_system_thread.pause_thread()
+        return { 'sweep_period' : summarise_times( self.get_sweep_periods() ) }
+
+    ################################################################################
+    def sweeps(self, number_of_sweeps : int ) -> dict:
+        """
+        Benchmark: reads the positions of all the axes, one command at a time, as
+        fast as possible
+        """
+        latencies = []
+        sweep_periods = []
+        for i in range(number_of_sweeps):
+            sweep_start = self.clock.monotonic()
+            for axis in range( 1, NUMBER_OF_AXES + 1 ):
+                t = self.clock.monotonic()
+                self.drive_system.check_encoder_pos_axis(axis)
+                latencies.append( self.clock.monotonic() - t )
+            sweep_periods.append( self.clock.monotonic() - sweep_start )
+        return { 'sweep_period' : summarise_times(sweep_periods), 'command_latency' : summarise_times(latencies) }
+
+    ################################################################################
+    def group_moves(self, number_of_moves : int ) -> dict:
+        """
+        Benchmark: moves the target ladder and beam blocker axes together, back and
+        forth, waiting for each move to finish (with the positions being polled)
+        """
+        self.drive_system_thread.resume_thread()
+        start_positions = { axis : int( self.drive_system.positions[axis-1] ) for axis in GROUP_MOVE_AXES }
+        send_times = []
+        move_times = []
+        failed_moves = 0
+        for i in range(number_of_moves):
+            offset = GROUP_MOVE_DISTANCE if i % 2 == 0 else 0
+            targets = { axis : position + offset for axis, position in start_positions.items() }
+            t = self.clock.monotonic()
+            group = self.drive_system.move_group( targets, False )
+            send_times.append( self.clock.monotonic() - t )
+            if group is None or not group.wait( timeout=60 ):
+                failed_moves += 1
+            move_times.append( self.clock.monotonic() - t )
+        self.drive_system_thread.pause_thread()
+        return { 'failed_moves' : failed_moves, 'send_time' : summarise_times(send_times), 'move_time' : summarise_times(move_times) }
+
+    ################################################################################
+    def slit_scan(self) -> dict:
+        """
+        Benchmark: runs a short step-mode slit scan across the vertical slit, which
+        is put where the target ladder is now
+        """
+        options_path = os.path.join( self.temporary_directory.name, "slit_scan_options.txt" )
+        with open( options_path, 'w' ) as f:
+            for key, value in SLIT_SCAN_OPTIONS.items():
+                f.write(f"{key} : {value}\n")
+        dsopts.OPTION_SLIT_SCAN_PARAMETER_FILE.set_value(options_path)
+
+        self.drive_system.check_encoder_pos_batch()
+        dsopts.AXIS_POSITION_DICT['vert_slit'] = [ int( self.drive_system.positions[2] ), int( self.drive_system.positions[4] ) ]
+        number_of_points = int( round( 2*SLIT_SCAN_OPTIONS['OFFSET_IN_MM']/SLIT_SCAN_OPTIONS['STEP_SIZE_IN_MM'] ) ) + 1
+
+        t = self.clock.monotonic()
+        self.drive_system.slit_scan_launch_threads(True)
+        scan_time = self.clock.monotonic() - t
+        self.drive_system_thread.pause_thread() # The scan resumes it when it finishes
+        self.drive_system.reset_all()
+        return {
+            'points' : number_of_points,
+            'scan_s' : scan_time,
+            'time_per_point_s' : scan_time/number_of_points,
+            'overhead_per_point_s' : scan_time/number_of_points - SLIT_SCAN_OPTIONS['WAIT_TIME_IN_SECONDS'],
+        }
+
+    ################################################################################
+    def abort_storm(self, number_of_aborts : int, mean_interval : float ) -> dict:
+        """
+        Benchmark: aborts everything at random times while another thread reads the
+        positions as fast as it can, and measures how long each abort takes to get
+        to the serial port
+        """
+        is_polling = threading.Event()
+        is_polling.set()
+        def poll():
+            while is_polling.is_set():
+                self.drive_system.check_encoder_pos_batch()
+        poll_thread = threading.Thread( target=poll, daemon=True )
+        self.clock.start_thread( poll_thread )
+
+        request_times = []
+        for i in range(number_of_aborts):
+            self.clock.sleep( self.rng.expovariate( 1.0/mean_interval ) )
+            request_times.append( self.clock.monotonic() )
+            self.drive_system.abort_all()
+            self.drive_system.reset_all()
+
+        is_polling.clear()
+        self.clock.join_thread( poll_thread )
+
+        # First abort written after each request
+        abort_times = [ t for t, command in list(self.sim_port.command_log) if command.endswith("ab\r") ]
+        latencies = []
+        for request_time in request_times:
+            later_aborts = [ t for t in abort_times if t >= request_time ]
+            if len(later_aborts) > 0:
+                latencies.append( later_aborts[0] - request_time )
+        return { 'aborts' : number_of_aborts, 'abort_to_wire' : summarise_times(latencies) }
+
+    ################################################################################
+    def close(self) -> None:
+        """
+        Benchmark: stops the threads and the simulated box
+        """
+        with self.quiet():
+            self.drive_system.abort_all()
+        self.drive_system_thread.kill_thread()
+        self.clock.join_thread( self.drive_system_thread )
+        if self.server is not None:
+            self.server.stop()
+        self.temporary_directory.cleanup()
+        return
+
+
+################################################################################
+################################################################################
+################################################################################
+def flatten_metrics( metrics : dict, prefix : str = "" ) -> dict:
+    """
+    Flattens nested metrics into "a.b.c" -> number, keeping only numbers
+    """
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance( value, dict ):
+            flat.update( flatten_metrics( value, f"{prefix}{key}." ) )
+        elif isinstance( value, (int, float) ) and not isinstance( value, bool ):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+################################################################################
+def get_clock_metrics( results : dict ) -> dict:
+    """
+    Gets the flattened metrics of each workload that are measured on the clock,
+    leaving out those of the computer (MACHINE_METRICS)
+    """
+    return { key : value for key, value in flatten_metrics( results['workloads'] ).items() if key.split('.')[-1] not in MACHINE_METRICS }
+
+################################################################################
+def check_determinism( results : dict, output : str ) -> bool:
+    """
+    Runs the benchmark again in a new process, with the same seed and settings,
+    and checks that every metric measured on the virtual clock is the same
+
+    Parameters
+    ----------
+    results : dict
+        The results of this run (as written to the JSON file)
+    output : str
+        The file the results of the second run are written to
+
+    Returns
+    -------
+    is_deterministic : bool
+        True if the two runs gave the same metrics
+    """
+    arguments = [ x for x in sys.argv[1:] if x != '--check-determinism' ] + [ '-o', output ]
+    run = subprocess.run( [ sys.executable, os.path.abspath(__file__) ] + arguments, capture_output=True, text=True )
+    try:
+        with open( output, 'r' ) as f:
+            second = json.load(f)
+    except (OSError, ValueError):
+        print(f"DETERMINISM CHECK FAILED: the second run did not write its results (exit code {run.returncode})")
+        print(run.stderr)
+        return False
+
+    first, second = get_clock_metrics(results), get_clock_metrics(second)
+    differences = [ key for key in sorted( set(first) | set(second) ) if first.get(key) != second.get(key) ]
+    for key in differences:
+        print(f"DETERMINISM CHECK FAILED: {key} = {first.get(key)} then {second.get(key)}")
+    if len(differences) == 0:
+        print(f"Determinism check passed: all {len(first)} metrics on the virtual clock were the same in a second run with seed {results['settings']['seed']}")
+    return len(differences) == 0
+
+################################################################################
+def print_results( results : dict, previous : Optional[dict] = None ) -> None:
+    """
+    Prints the metrics of each workload, and the change from a previous run if
+    given
+
+    Parameters
+    ----------
+    results : dict
+        The results of this run (as written to the JSON file)
+    previous : dict
+        The results of a previous run to compare against
+    """
+    new = flatten_metrics( results['workloads'] )
+    old = flatten_metrics( previous['workloads'] ) if previous is not None else {}
+    if previous is not None:
+        print(f"Compared with {previous.get('commit')} ({previous.get('time')})")
+        for key in ['transport', 'clock', 'settings']:
+            if previous.get(key) != results.get(key):
+                print(f"WARNING: the {key} is different ({previous.get(key)} before, {results.get(key)} now)")
+    for key, value in new.items():
+        line = f"{key:<40} : {value:>12.3f}"
+        if key in old and old[key] != 0:
+            line += f"   ({100.0*(value - old[key])/abs(old[key]):+.1f} %)"
+        print(line)
+    return
+
+################################################################################
+def parse_command_line_arguments() -> ap.Namespace:
+    """
+    Reads the command-line arguments
+    """
+    parser = ap.ArgumentParser(prog='drivesystembenchmark.py', description='Runs standard workloads through the DriveSystem against the simulated motor box and writes the results to a JSON file')
+    parser.add_argument('--version', action='version', version=f'%(prog)s version {__version__}')
+    parser.add_argument('--transport', type=str, choices=TRANSPORTS, default='sim', help='simulated box in the same process (sim) or served on a pseudo-terminal (pty)')
+    parser.add_argument('--virtual-clock', action='store_true', help='run on a virtual clock (sim only) - times are those of the real box, but the run is much faster')
+    parser.add_argument('--workloads', type=str, default=",".join(WORKLOADS), help=f'comma-separated workloads to run (default {",".join(WORKLOADS)})', metavar='list')
+    parser.add_argument('--duration', type=float, default=10.0, help='how long to leave the idle workload polling in seconds', metavar='s')
+    parser.add_argument('--sweeps', type=int, default=10, help='number of sweeps of all the axes', metavar='n')
+    parser.add_argument('--moves', type=int, default=4, help='number of group moves', metavar='n')
+    parser.add_argument('--aborts', type=int, default=20, help='number of aborts in the abort storm', metavar='n')
+    parser.add_argument('--abort-interval', type=float, default=0.3, help='average time between aborts in seconds', metavar='s')
+    parser.add_argument('--baudrate', type=int, default=MotorBoxSim.BAUDRATE, help='baud rate of the simulated serial line', metavar='baud')
+    parser.add_argument('--latency', type=float, default=MotorBoxSim.PROCESSING_LATENCY, help='time the simulated controller takes to act on a command in seconds', metavar='s')
+    parser.add_argument('--faults', type=str, default="", help='faults to inject into the simulated box (see MotorBoxSim.py --help)', metavar='spec')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the times of the aborts')
+    parser.add_argument('--check-determinism', action='store_true', help='run everything again with the same seed and check the times on the virtual clock are the same (needs --virtual-clock)')
+    parser.add_argument('--compare', type=str, default=None, help='results file from a previous run to compare against', metavar='file')
+    parser.add_argument('-o', '--output', type=str, default=DEFAULT_OUTPUT_FILE, help=f'file to write the results to (default {DEFAULT_OUTPUT_FILE})', metavar='file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print everything the DriveSystem prints')
+    args = parser.parse_args()
+
+    args.workloads = [ x.strip() for x in args.workloads.split(',') if x.strip() != "" ]
+    for workload in args.workloads:
+        if workload not in WORKLOADS:
+            parser.error(f"unknown workload {workload} - should be one of {', '.join(WORKLOADS)}")
+    if args.check_determinism and not ( args.virtual_clock and args.transport == 'sim' ):
+        parser.error("--check-determinism needs --virtual-clock and the sim transport, as times on the real clock are never the same twice")
+    return args
+
+################################################################################
+def main():
+    """
+    Runs the workloads given on the command line and writes the results
+    """
+    args = parse_command_line_arguments()
+
+    previous = None
+    if args.compare is not None:
+        try:
+            with open( args.compare, 'r' ) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            print(f"Could not read previous results from {args.compare}")
+
+    benchmark = Benchmark( args.transport, args.virtual_clock, args.baudrate, args.latency, args.faults, args.seed, args.verbose )
+    workloads = {
+        'idle' : lambda : benchmark.idle(args.duration),
+        'sweeps' : lambda : benchmark.sweeps(args.sweeps),
+        'group_moves' : lambda : benchmark.group_moves(args.moves),
+        'slit_scan' : lambda : benchmark.slit_scan(),
+        'abort_storm' : lambda : benchmark.abort_storm( args.aborts, args.abort_interval ),
+    }
+    try:
+        for name in args.workloads:
+            print(f"Running {name}...")
+            benchmark.run_workload( name, workloads[name] )
+    finally:
+        benchmark.close()
+
+    results = {
+        'benchmark_version' : __version__,
+        'commit' : get_git_commit(),
+        'time' : datetime.datetime.now().isoformat( ' ', 'seconds' ),
+        'python' : platform.python_version(),
+        'transport' : args.transport,
+        'clock' : 'virtual' if benchmark.is_virtual_clock else 'real',
+        'settings' : { 'baudrate' : args.baudrate, 'latency' : args.latency, 'faults' : args.faults, 'seed' : args.seed },
+        'workloads' : benchmark.results,
+    }
+    with open( args.output, 'w' ) as f:
+        json.dump( results, f, indent=2 )
+
+    print_results( results, previous )
+    print(f"Results written to {args.output}")
+
+    if args.check_determinism:
+        root, extension = os.path.splitext( args.output )
+        if not check_determinism( results, f"{root}_repeat{extension}" ):
+            sys.exit(1)
+    return
+
+if __name__ == '__main__':
+    main()
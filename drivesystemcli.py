@@ -1,8 +1,16 @@
 import drivesystemlib as dslib
+import drivesystemevents as dsevents
+import drivesystemsequence as dsseq
 
 # TODO MAKE MORE SOPHISTICATED WITH CURSES?
 def cli_loop():
     drivesystem = dslib.DriveSystem.get_instance()
+
+    # Say straight away if the motor box is disconnected or a scan starts or stops
+    subscriptions = [
+        drivesystem.events.subscribe( lambda event : print(f"Motor box {'connected' if event.is_connected else 'DISCONNECTED'}"), dsevents.ConnectionEvent, replay=False ),
+        drivesystem.events.subscribe( lambda event : print(f"Scan {'started' if event.is_scanning else 'stopped'}"), dsevents.ScanEvent, replay=False ),
+    ]
     
     try:
         while True:
@@ -13,10 +21,32 @@ def cli_loop():
             if cmd == "quit" or cmd == "q":
                 break
             
+            # Print how often commands have been held back by the rate limiter
+            if cmd.lower() == "ratelimit":
+                drivesystem.rate_limiter.print_counters()
+                continue
+
+            # Print the faults injected by a simulated motor box (sim://)
+            if cmd.lower() == "faults":
+                box = getattr( drivesystem.serial_port, 'box', None )
+                if box is None or box.fault_injector is None:
+                    print("No faults are being injected")
+                else:
+                    box.fault_injector.print_counters()
+                continue
+
+            # Run a sequence file
+            if cmd.lower().startswith("run "):
+                dsseq.run_sequence_file( drivesystem, cmd[4:].strip() )
+                continue
+            
             # Send command
             output = drivesystem.execute_command( f"{cmd}\r" )
             
             # Print return value
             print(output)
     except KeyboardInterrupt:
-        print("")
\ No newline at end of file
+        print("")
+    finally:
+        for subscription in subscriptions:
+            drivesystem.events.unsubscribe( subscription )
@@ -0,0 +1,425 @@
+"""
+DriveSystem Clock
+=================
+
+Clocks that can be passed to anything that needs to know the time or wait for a
+while, so that the same code can run in real time on the beamline or against a
+VirtualClock in tests, where time only moves when it is told to and long cycles
+can be replayed much faster than real time.
+
+The clock used by the DriveSystem and the simulated motor box is got with
+get_clock(). It is the real clock unless set_clock() is called first (e.g. by
+drivesystembenchmark.py --virtual-clock), so everything that waits or polls
+shares the same time.
+Threads, events and locks used while waiting on the clock should be started
+with start_thread() and be Event and Lock from here, so that a VirtualClock
+knows when every thread is waiting.
+"""
+
+import itertools
+import math
+import threading
+import time
+from typing import Optional
+
+################################################################################
+################################################################################
+################################################################################
+class Clock:
+    """
+    The real clock, using time.monotonic()
+    """
+    ################################################################################
+    def monotonic(self) -> float:
+        """
+        Clock: gets the current time in seconds
+        """
+        return time.monotonic()
+
+    ################################################################################
+    def time(self) -> float:
+        """
+        Clock: gets the current time in seconds since the epoch
+        """
+        return time.time()
+
+    ################################################################################
+    def sleep(self, seconds : float ) -> None:
+        """
+        Clock: waits for a number of seconds (negative times do not wait)
+        """
+        if seconds > 0:
+            time.sleep(seconds)
+        return
+
+    ################################################################################
+    def wait(self, event : threading.Event, timeout : float ) -> bool:
+        """
+        Clock: waits for an event to be set, or for the timeout to pass
+
+        Returns
+        -------
+        is_set : bool
+            True if the event was set
+        """
+        return event.wait( max( timeout, 0.0 ) )
+
+    ################################################################################
+    def start_thread(self, thread : threading.Thread ) -> None:
+        """
+        Clock: starts a thread that uses the clock
+        """
+        thread.start()
+        return
+
+    ################################################################################
+    def join_thread(self, thread : threading.Thread ) -> None:
+        """
+        Clock: waits for a thread started with start_thread() to finish
+        """
+        thread.join()
+        return
+
+    ################################################################################
+    def acquire(self, lock : 'Lock' ) -> bool:
+        """
+        Clock: waits for a Lock (use Lock.acquire() rather than calling this)
+        """
+        return lock.lock.acquire()
+
+    ################################################################################
+    def notify(self, key ) -> None:
+        """
+        Clock: wakes the threads waiting on an Event, Lock or thread (nothing to do
+        for the real clock)
+        """
+        return
+
+
+################################################################################
+################################################################################
+################################################################################
+class VirtualClock(Clock):
+    """
+    A clock that only moves forward when it is advanced, or when none of the
+    threads using it can run until it does. The threads take turns: only one of
+    them runs at a time, until it waits on the clock (sleep(), wait(), a Lock
+    or join_thread()), and then the next one is woken in a fixed order (the
+    earliest wake-up time first, then the order in which they started to wait).
+    The clock jumps straight to the next wake-up time once every thread is
+    waiting, so time runs as fast as the CPU allows rather than in real time,
+    and the same threads doing the same things always give the same times.
+
+    Every thread taking part must be started with start_thread(), or be the
+    thread that created the clock, and must only block on the clock. A thread
+    blocked on anything else (e.g. input(), Thread.join() or a threading.Lock
+    held by a thread waiting on the clock) stops every thread. Threads waiting
+    on a plain threading.Event are only woken at their timeout - use Event so
+    that they are woken as soon as it is set.
+    """
+    ################################################################################
+    def __init__(self, start : float = 0.0 ) -> None:
+        """
+        VirtualClock: sets the starting time. The thread creating the clock is
+        the one running.
+
+        Parameters
+        ----------
+        start : float
+            The time to start at in seconds
+        """
+        self.now = start
+        self.epoch = time.time() - start # So time() starts at the real time
+        self.condition = threading.Condition()
+        self.threads = { threading.current_thread() } # Threads taking turns on the clock
+        self.running = threading.current_thread()     # The thread whose turn it is (None if nobody can run)
+        self.waiters = {}                # Thread -> [wake-up time, order, Event/Lock/thread it is waiting on]
+        self.counter = itertools.count() # Gives the order in which threads started waiting
+        return
+
+    ################################################################################
+    def monotonic(self) -> float:
+        """
+        VirtualClock: gets the current virtual time in seconds
+        """
+        return self.now
+
+    ################################################################################
+    def time(self) -> float:
+        """
+        VirtualClock: gets the current virtual time in seconds since the epoch
+        """
+        return self.epoch + self.now
+
+    ################################################################################
+    def advance(self, seconds : float ) -> None:
+        """
+        VirtualClock: moves the time forward by a number of seconds
+        """
+        with self.condition:
+            self.now += max( seconds, 0.0 )
+            if self.running is None:
+                self.run_next_no_lock()
+        return
+
+    ################################################################################
+    def advance_to(self, new_time : float ) -> None:
+        """
+        VirtualClock: moves the time forward to a given time (it never goes back)
+        """
+        with self.condition:
+            self.now = max( self.now, new_time )
+            if self.running is None:
+                self.run_next_no_lock()
+        return
+
+    ################################################################################
+    def run_next_no_lock(self) -> None:
+        """
+        VirtualClock: gives the turn to the waiting thread with the earliest
+        wake-up time, moving the clock on to it. Must be called with the condition
+        held, and only when nobody is running.
+        """
+        if len(self.waiters) == 0:
+            return
+        thread, ( wake_up_time, order, key ) = min( self.waiters.items(), key=lambda item : item[1][:2] )
+        if wake_up_time == math.inf:
+            print("VIRTUAL CLOCK WARNING: every thread is waiting for another thread. Nothing can run.")
+            return
+        del self.waiters[thread]
+        self.now = max( self.now, wake_up_time )
+        self.running = thread
+        self.condition.notify_all()
+        return
+
+    ################################################################################
+    def wait_for_turn_no_lock(self, wake_up_time : float, key = None ) -> None:
+        """
+        VirtualClock: hands the turn on and waits until it is given back, which is
+        no earlier than wake_up_time, unless notify() is called with the key first.
+        Must be called with the condition held.
+        """
+        thread = threading.current_thread()
+        self.threads.add(thread)
+        self.waiters[thread] = [ wake_up_time, next(self.counter), key ]
+        if self.running is thread or self.running is None:
+            self.running = None
+            self.run_next_no_lock()
+        while self.running is not thread:
+            self.condition.wait()
+        return
+
+    ################################################################################
+    def notify_no_lock(self, key ) -> None:
+        """
+        VirtualClock: makes the threads waiting on an Event, Lock or thread ready
+        to run now, in the order they started waiting. Must be called with the
+        condition held.
+        """
+        for entry in sorted( self.waiters.values(), key=lambda entry : entry[1] ):
+            if entry[2] is key:
+                entry[0] = min( entry[0], self.now )
+                entry[1] = next(self.counter)
+        if self.running is None:
+            self.run_next_no_lock()
+        return
+
+    ################################################################################
+    def notify(self, key ) -> None:
+        """
+        VirtualClock: wakes the threads waiting on an Event, Lock or thread (called
+        by Event.set() and Lock.release())
+        """
+        with self.condition:
+            self.notify_no_lock(key)
+        return
+
+    ################################################################################
+    def wait_until(self, wake_up_time : float, event : Optional[threading.Event] = None ) -> bool:
+        """
+        VirtualClock: waits until the clock reaches a time, or until an event is
+        set. The other threads get a turn even if the time has already passed.
+
+        Parameters
+        ----------
+        wake_up_time : float
+            The virtual time to wait until
+        event : threading.Event
+            Stop waiting early if this is set
+
+        Returns
+        -------
+        is_set : bool
+            True if the event was set (always True if there is no event)
+        """
+        with self.condition:
+            if isinstance( event, Event ):
+                event.clocks.add(self)
+            while not ( event is not None and event.is_set() ):
+                self.wait_for_turn_no_lock( wake_up_time, event )
+                if self.now >= wake_up_time:
+                    break
+        return True if event is None else event.is_set()
+
+    ################################################################################
+    def sleep(self, seconds : float ) -> None:
+        """
+        VirtualClock: waits for a number of virtual seconds
+        """
+        self.wait_until( self.now + max( seconds, 0.0 ) )
+        return
+
+    ################################################################################
+    def wait(self, event : threading.Event, timeout : float ) -> bool:
+        """
+        VirtualClock: waits for an event to be set, or for a number of virtual
+        seconds to pass
+        """
+        return self.wait_until( self.now + max( timeout, 0.0 ), event )
+
+    ################################################################################
+    def start_thread(self, thread : threading.Thread ) -> None:
+        """
+        VirtualClock: starts a thread that takes turns with the others. It first
+        runs when the thread starting it next waits on the clock.
+        """
+        run = thread.run
+        def run_in_turn():
+            with self.condition:
+                while self.running is not thread:
+                    self.condition.wait()
+            try:
+                run()
+            finally:
+                with self.condition:
+                    self.threads.discard(thread)
+                    self.waiters.pop( thread, None )
+                    if self.running is thread:
+                        self.running = None
+                    self.notify_no_lock(thread)
+        thread.run = run_in_turn
+
+        with self.condition:
+            self.threads.add(thread)
+            self.waiters[thread] = [ self.now, next(self.counter), None ]
+        thread.start()
+        return
+
+    ################################################################################
+    def join_thread(self, thread : threading.Thread ) -> None:
+        """
+        VirtualClock: waits for a thread started with start_thread() to finish,
+        letting the others run
+        """
+        with self.condition:
+            while thread in self.threads:
+                self.wait_for_turn_no_lock( math.inf, thread )
+        thread.join()
+        return
+
+    ################################################################################
+    def acquire(self, lock : 'Lock' ) -> bool:
+        """
+        VirtualClock: waits for a Lock, letting the others run. Threads get the
+        lock in the order they asked for it.
+        """
+        thread = threading.current_thread()
+        with self.condition:
+            # Take turns in the order the lock was asked for, so that a thread
+            # releasing it cannot take it straight back from those waiting
+            if len(lock.queue) == 0 and lock.lock.acquire( blocking=False ):
+                return True
+            lock.clocks.add(self)
+            lock.queue.append(thread)
+            while not ( lock.queue[0] is thread and lock.lock.acquire( blocking=False ) ):
+                self.wait_for_turn_no_lock( math.inf, lock )
+            lock.queue.pop(0)
+        return True
+
+
+################################################################################
+################################################################################
+################################################################################
+class Event(threading.Event):
+    """
+    A threading.Event that wakes the threads waiting for it on a VirtualClock as
+    soon as it is set
+    """
+    ################################################################################
+    def __init__(self) -> None:
+        """
+        Event: creates an event that is not set
+        """
+        super().__init__()
+        self.clocks = set() # VirtualClocks that have been waited on for the event
+        return
+
+    ################################################################################
+    def set(self) -> None:
+        """
+        Event: sets the event and wakes everyone waiting for it
+        """
+        super().set()
+        for clock in list(self.clocks):
+            clock.notify(self)
+        return
+
+
+################################################################################
+################################################################################
+################################################################################
+class Lock:
+    """
+    A lock that can be held while waiting on the clock (e.g. while waiting for a
+    reply from the serial port). Threads waiting for it on a VirtualClock let the
+    others run, rather than stopping them all.
+    """
+    ################################################################################
+    def __init__(self) -> None:
+        """
+        Lock: creates an unlocked lock
+        """
+        self.lock = threading.Lock()
+        self.clocks = set() # VirtualClocks that have been waited on for the lock
+        self.queue = []     # Threads waiting for the lock on a VirtualClock, first in first out
+        return
+
+    ################################################################################
+    def acquire(self) -> bool:
+        """
+        Lock: waits for the lock and takes it
+        """
+        return get_clock().acquire(self)
+
+    ################################################################################
+    def release(self) -> None:
+        """
+        Lock: releases the lock and wakes everyone waiting for it
+        """
+        self.lock.release()
+        for clock in list(self.clocks):
+            clock.notify(self)
+        return
+
+
+################################################################################
+# The clock used unless another one is given
+REAL_CLOCK = Clock()
+CLOCK = REAL_CLOCK
+
+################################################################################
+def get_clock() -> Clock:
+    """
+    Gets the clock shared by the DriveSystem and the simulated motor box
+    """
+    return CLOCK
+
+################################################################################
+def set_clock( clock : Clock ) -> None:
+    """
+    Sets the clock shared by the DriveSystem and the simulated motor box. This
+    must be called before anything is created.
+    """
+    global CLOCK
+    CLOCK = clock
+    return
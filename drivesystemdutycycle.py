@@ -1,11 +1,20 @@
 """
-TODO
+DriveSystem Duty Cycle
+======================
+
+Keeps track of how long each HR4 motor has been moving over its duty cycle, so
+that it can be paused before it overheats. The DutyCycleManager looks after all
+of the axes in one thread, pausing an axis (through DriveSystem.paused_axes) when
+it has been on for too long and resuming it once it has rested.
 """
 
 from collections import deque
-import datetime as dt
+import heapq
 import threading
-from typing import Tuple, Optional
+from typing import Callable, Tuple, Optional
+
+import drivesystemclock as dsclock
+import drivesystemoptions as dsopts
 
 ################################################################################
 ################################################################################
@@ -15,11 +24,11 @@ class DutyCycleTimestamp:
     TODO
     """
     ################################################################################
-    def __init__(self, mytime : dt.datetime, value : bool ) -> None:
+    def __init__(self, mytime : float, value : bool ) -> None:
         """
         TODO
         """
-        self.time = mytime
+        self.time = mytime # From Clock.monotonic()
         self.value = value # This records what we change to at the specified time!
         return
     
@@ -28,7 +37,7 @@ class DutyCycleTimestamp:
         """
         TODO
         """
-        return f"{self.time.strftime('%H:%M:%S.%f')} : {self.value}"
+        return f"{self.time:.3f} : {self.value}"
 
     
 
@@ -63,14 +72,24 @@ class DutyCycle(threading.Thread):
     }
 
     ################################################################################
-    def __init__(self, force : float, environment : str) -> None:
+    def __init__(self, force : float, environment : str, clock : Optional[dsclock.Clock] = None ) -> None:
         """
-        TODO
+        DutyCycle: sets up the duty cycle for a motor from the HR4 table
+
+        Parameters
+        ----------
+        force : float
+            The force applied by the motor in N
+        environment : str
+            'air' or 'vacuum'
+        clock : Clock
+            The clock used to time the motor (the shared clock if None)
         """
+        self.clock = dsclock.get_clock() if clock is None else clock
+        self.print_output = True # Print when the motor is paused and resumed
         # Fundamental properties of the duty cycle
         self.infinite_run_time = False
         self.time_allowed_on, self.total_cycle_length = self.get_duty_cycle_from_force_and_environment(force, environment)  # seconds
-        print(self.time_allowed_on, self.total_cycle_length)
         if self.time_allowed_on < 0 or self.total_cycle_length < 0:
             self.infinite_run_time = True
 
@@ -78,6 +97,7 @@ class DutyCycle(threading.Thread):
 
         # Data management
         self.list_of_timestamps = deque()                 # Container for timestamps and status changes
+        self.time_on_between_timestamps = 0.0             # Time on between the first and last timestamps in the deque
         self.mav = 0.0                                    # The moving average of the motor's movement
         self.is_motor_moving_now = False                  # This is status of motor's movement right now
         self.motor_was_moving_at_cycle_beginning = False  # This is status one duty cycle's worth ago
@@ -85,7 +105,7 @@ class DutyCycle(threading.Thread):
         self.is_motor_resting = False                     # Indicates if the motor is resting
 
         # Other
-        self.event = threading.Event() # Used for timeouts that can be cancelled
+        self.event = dsclock.Event() # Used for timeouts that can be cancelled
         self.lock = threading.Lock()   # Used to ensure data edited properly
 
         # Initialise
@@ -101,90 +121,155 @@ class DutyCycle(threading.Thread):
             return
         self.is_running = True
         ctr = 0
-        rounding_digits = 2
-        factor = float(10**rounding_digits)
 
         # Generate initial timestamp
         self.stop_motor_moving()
 
         # Start loop
         while self.is_running:
-            # Get current time
-            start_loop_time = dt.datetime.now()
+            start_loop_time = self.clock.monotonic()
+            self.tick()
 
-            # GET THE LOCK FOR EDITING DATA
-            self.lock.acquire() 
-            
-            # Update MAV if we have timestamps in play
-            if len(self.list_of_timestamps) > 0:
-                # Remove times from queue if needed
-                if ( start_loop_time - self.list_of_timestamps[0].time ).total_seconds() > self.total_cycle_length:
-                    self.motor_was_moving_at_cycle_beginning = self.list_of_timestamps[0].value
-                    self.list_of_timestamps.popleft()
-
-            # Calculate MAV
-            if len(self.list_of_timestamps) > 0:
-                self.mav = 0.0
-                # Calculate in-between bits
-                for i in range(0,len(self.list_of_timestamps) - 1):
-                    if self.list_of_timestamps[i].value:
-                        self.mav += ( self.list_of_timestamps[i+1].time - self.list_of_timestamps[i].time ).total_seconds()
-                
-                # Add to mav if we're currently moving
-                if self.list_of_timestamps[-1].value:
-                    self.mav += ( start_loop_time - self.list_of_timestamps[-1].time ).total_seconds()
+            # Sleep a bit
+            ctr += 1
+            if ctr % 25 == 0:
+                print(self.is_motor_movement_requested, self.is_motor_moving_now, self.mav, f"{start_loop_time:.3f}", f"{len(self.list_of_timestamps)} timestamps in cycle")
+            end_loop_time = self.clock.monotonic()
+            self.clock.wait( self.event, self.time_step - ( end_loop_time - start_loop_time ) )
+        
+        return
+    
+    ################################################################################
+    def tick(self) -> None:
+        """
+        DutyCycle: updates the moving average, then pauses the motor if it has been
+        on for too long or resumes it if it has rested for long enough
+        """
+        rounding_digits = 2
+        factor = float(10**rounding_digits)
 
-                # Add to mav if previous status was TRUE
-                if self.motor_was_moving_at_cycle_beginning:
-                    self.mav += self.total_cycle_length - ( start_loop_time - self.list_of_timestamps[0].time ).total_seconds()
+        # Get current time
+        start_loop_time = self.clock.monotonic()
 
-                # Round
-                self.mav = int( self.mav*factor + 0.5 )/factor
-            else:
-                # Set MAV based on status - motor running 100%
-                if self.motor_was_moving_at_cycle_beginning == True and self.is_motor_moving_now == True:
-                    self.mav = self.total_cycle_length
-                
-                # Motor running 0%
-                elif self.motor_was_moving_at_cycle_beginning == False and self.is_motor_moving_now == False:
-                    self.mav = 0.0
-                
-                # Should not encounter this
-                else:
-                    raise ValueError("This value should not be possible. Examine code carefully!")
+        # GET THE LOCK FOR EDITING DATA
+        self.lock.acquire() 
 
-            # RELEASE THE LOCK AS WE'RE DONE EDITING
-            self.lock.release()
+        # Update MAV
+        self.update_mav( start_loop_time )
+        self.mav = int( self.mav*factor + 0.5 )/factor
 
-            # Now check if mav exceeds limits - pause if so
-            if self.mav >= self.time_allowed_on and self.is_motor_resting == False:
-                self.is_motor_resting = True
-                self.stop_motor_moving()
+        # RELEASE THE LOCK AS WE'RE DONE EDITING
+        self.lock.release()
+
+        # Now check if mav exceeds limits - pause if so
+        if self.mav >= self.time_allowed_on and self.is_motor_resting == False:
+            self.is_motor_resting = True
+            self.stop_motor_moving()
+            if self.print_output:
                 print("Threshold exceeded. Pausing motor")
-            
-            # Check if we need to resume
-            if self.mav <= self.time_allowed_on - self.resume_cycle_after and self.is_motor_resting:
-                self.is_motor_resting = False
-                if self.is_motor_movement_requested:
-                    self.start_motor_moving()
+        
+        # Check if we need to resume
+        if self.mav <= self.time_allowed_on - self.resume_cycle_after and self.is_motor_resting:
+            self.is_motor_resting = False
+            if self.is_motor_movement_requested:
+                self.start_motor_moving()
+                if self.print_output:
                     print("Resuming movement")
-                else:
-                    print("Rest over, but not moving")
+            elif self.print_output:
+                print("Rest over, but not moving")
+        return
 
-            # Sleep a bit
-            ctr += 1
-            if ctr % 25 == 0:
-                print(self.is_motor_movement_requested, self.is_motor_moving_now, self.mav, start_loop_time.strftime('%H:%M:%S.%f'), ", ".join( [str(x) for x in self.list_of_timestamps] ))
-            end_loop_time = dt.datetime.now()
-
-            try:
-                self.event.wait( timeout = self.time_step - (1e-6)*( end_loop_time - start_loop_time ).microseconds )
-            except ValueError:
-                print( f"Requesting sleep for negative time not allowed (time difference is {self.time_step} - {(1e-6)*( end_loop_time - start_loop_time ).microseconds})" )
-                break
-        
+    ################################################################################
+    def get_time_to_next_check(self, now : float, is_resting : bool ) -> float:
+        """
+        DutyCycle: works out how long it will be before the motor could need to be
+        paused or resumed. The moving average changes by at most one second per
+        second, so nothing can happen before it could reach the next threshold, or
+        before the oldest status change leaves the cycle. update_mav(now) must have
+        just been called with the lock held.
+
+        Parameters
+        ----------
+        now : float
+            The current time from Clock.monotonic()
+        is_resting : bool
+            Whether the motor is currently paused
+
+        Returns
+        -------
+        wait : float
+            Time in seconds until the next check (inf if nothing can happen until
+            the motor starts moving)
+        """
+        if is_resting:
+            wait = self.mav - ( self.time_allowed_on - self.resume_cycle_after )
+        elif self.is_motor_moving_now:
+            wait = self.time_allowed_on - self.mav
+        else:
+            wait = float('inf')
+        if len(self.list_of_timestamps) > 0:
+            wait = min( wait, self.list_of_timestamps[0].time + self.total_cycle_length - now )
+        return wait
+
+    ################################################################################
+    def add_timestamp(self, timestamp : DutyCycleTimestamp ) -> None:
+        """
+        DutyCycle: adds a status change to the end of the cycle, adding the time
+        since the last change if the motor was moving. The lock must be held.
+        """
+        if len(self.list_of_timestamps) > 0 and self.list_of_timestamps[-1].value:
+            self.time_on_between_timestamps += timestamp.time - self.list_of_timestamps[-1].time
+        self.list_of_timestamps.append(timestamp)
         return
-    
+
+    ################################################################################
+    def update_mav(self, now : float ) -> None:
+        """
+        DutyCycle: retires status changes that have left the cycle and updates
+        the moving average without going through the whole cycle, so this costs
+        the same however many times the motor has started and stopped. The lock
+        must be held.
+
+        Parameters
+        ----------
+        now : float
+            The current time from Clock.monotonic()
+        """
+        # Remove times from queue if needed, taking off the time on up to the next change
+        while len(self.list_of_timestamps) > 0 and now - self.list_of_timestamps[0].time > self.total_cycle_length:
+            oldest = self.list_of_timestamps.popleft()
+            self.motor_was_moving_at_cycle_beginning = oldest.value
+            if oldest.value and len(self.list_of_timestamps) > 0:
+                self.time_on_between_timestamps -= self.list_of_timestamps[0].time - oldest.time
+
+        # Reset the sum when it is empty so rounding errors cannot build up
+        if len(self.list_of_timestamps) < 2:
+            self.time_on_between_timestamps = 0.0
+
+        if len(self.list_of_timestamps) > 0:
+            self.mav = self.time_on_between_timestamps
+
+            # Add to mav if we're currently moving
+            if self.list_of_timestamps[-1].value:
+                self.mav += now - self.list_of_timestamps[-1].time
+
+            # Add to mav if previous status was TRUE
+            if self.motor_was_moving_at_cycle_beginning:
+                self.mav += self.total_cycle_length - ( now - self.list_of_timestamps[0].time )
+        else:
+            # Set MAV based on status - motor running 100%
+            if self.motor_was_moving_at_cycle_beginning == True and self.is_motor_moving_now == True:
+                self.mav = self.total_cycle_length
+            
+            # Motor running 0%
+            elif self.motor_was_moving_at_cycle_beginning == False and self.is_motor_moving_now == False:
+                self.mav = 0.0
+            
+            # Should not encounter this
+            else:
+                raise ValueError("This value should not be possible. Examine code carefully!")
+        return
+
     ################################################################################
     def start_motor_moving(self) -> None:
         """
@@ -200,7 +285,8 @@ class DutyCycle(threading.Thread):
         
         # Check if motor is currently paused
         if self.is_motor_resting == True:
-            print("Motor movement has been requested, but motor currently paused. Will start when motor ready")
+            if self.print_output:
+                print("Motor movement has been requested, but motor currently paused. Will start when motor ready")
             return
 
         # Prevent editing by others
@@ -208,7 +294,7 @@ class DutyCycle(threading.Thread):
 
         # Start moving motor
         self.is_motor_moving_now = True
-        self.list_of_timestamps.append( DutyCycleTimestamp( dt.datetime.now(), True ) )
+        self.add_timestamp( DutyCycleTimestamp( self.clock.monotonic(), True ) )
         
         # Allow editing by others
         self.lock.release()
@@ -228,12 +314,32 @@ class DutyCycle(threading.Thread):
 
         # Stop moving motor
         self.is_motor_moving_now = False
-        self.list_of_timestamps.append( DutyCycleTimestamp( dt.datetime.now(), False ) )
+        self.add_timestamp( DutyCycleTimestamp( self.clock.monotonic(), False ) )
 
         # Allow editing by others
         self.lock.release()
         return
 
+    ################################################################################
+    def set_motor_moving(self, is_moving : bool, now : float ) -> None:
+        """
+        DutyCycle: records that the motor has been seen to start or stop moving
+        (used by the DutyCycleManager instead of requesting movement)
+
+        Parameters
+        ----------
+        is_moving : bool
+            Whether the motor is moving now
+        now : float
+            The time the motor was seen from Clock.monotonic()
+        """
+        with self.lock:
+            if is_moving == self.is_motor_moving_now:
+                return
+            self.is_motor_moving_now = is_moving
+            self.add_timestamp( DutyCycleTimestamp( now, is_moving ) )
+        return
+
     ################################################################################
     def request_motor_movement(self) -> None:
         self.is_motor_movement_requested = True
@@ -271,7 +377,6 @@ class DutyCycle(threading.Thread):
         # Now get parameters
         for value in DutyCycle.DUTY_CYCLE_HR4_DICT.values():
             if force <= value[0]:
-                print(value[index])
                 return value[index]
         
         # Return error
@@ -279,6 +384,263 @@ class DutyCycle(threading.Thread):
         return [0, float('inf')]
         
 
+################################################################################
+################################################################################
+################################################################################
+class DutyCycleManager(threading.Thread):
+    """
+    Looks after the duty cycles of all of the axes in a single thread. Whether an
+    axis is moving is worked out from the changes in its encoder position, which
+    are passed in by the DriveSystem every time the positions are read. Rather
+    than checking every axis at a fixed rate, each axis is only checked at the
+    next time its moving average could cross a threshold or a status change
+    could leave the cycle, using a queue of deadlines ordered by time.
+
+    When an axis has been on for too long it is aborted and added to
+    DriveSystem.paused_axes (so no movement commands can be sent to it), and the
+    pause callbacks are told. Once it has rested it is removed from paused_axes
+    and, if it was moving to a known target, it is reset and sent there again.
+    """
+    MINIMUM_TIME_STEP = 0.01 # [s] the soonest an axis is checked again
+    MAXIMUM_WAIT = 1.0       # [s] the longest the thread sleeps without checking it is still running
+
+    ################################################################################
+    def __init__(self, drive_system, forces : list, environment : str, clock : Optional[dsclock.Clock] = None ) -> None:
+        """
+        DutyCycleManager: creates a duty cycle for each axis that needs one
+
+        Parameters
+        ----------
+        drive_system : DriveSystem
+            The DriveSystem whose paused_axes are controlled
+        forces : list
+            The force in N applied by the motor on each axis (axis 1 first). An
+            empty list means no duty cycles are used
+        environment : str
+            'air' or 'vacuum'
+        clock : Clock
+            The clock used to time the motors (the shared clock if None)
+        """
+        self.drive_system = drive_system
+        self.clock = dsclock.get_clock() if clock is None else clock
+        self.duty_cycles = {}
+        if len(forces) > 0 and len(forces) != len(drive_system.positions):
+            print(f"DUTY CYCLE ERROR: {len(forces)} forces given for {len(drive_system.positions)} axes. Duty cycles will not be used!")
+            forces = []
+        for i in range(0,len(forces)):
+            duty_cycle = DutyCycle( forces[i], environment, self.clock )
+            if not duty_cycle.infinite_run_time:
+                self.duty_cycles[i+1] = duty_cycle
+
+        self.last_positions = {}          # Last position seen for each axis
+        self.resume_targets = {}          # Where to send each paused axis once it has rested
+        self.pause_callbacks = []         # Functions f(axis, is_paused) told when an axis is paused or resumed
+        self.deadlines = []               # Heap of (time, axis) to check next
+        self.next_deadline = {}           # The current deadline for each axis (older ones in the heap are ignored)
+        self.lock = threading.Lock()
+        self.event = dsclock.Event()    # Set to wake the thread early
+        self.is_running = True
+
+        super().__init__()
+        return
+
+    ################################################################################
+    @classmethod
+    def from_options(cls, drive_system ) -> 'DutyCycleManager':
+        """
+        DutyCycleManager: creates a manager from the DutyCycleForces and
+        DutyCycleEnvironment options
+        """
+        return cls( drive_system, dsopts.OPTION_DUTY_CYCLE_FORCES.get_value(), dsopts.OPTION_DUTY_CYCLE_ENVIRONMENT.get_value() )
+
+    ################################################################################
+    def add_pause_callback(self, callback : Callable[[int,bool],None] ) -> None:
+        """
+        DutyCycleManager: registers a function f(axis, is_paused) to be called when
+        an axis is paused or resumed (e.g. DriveSystem.publish_axis_paused)
+        """
+        self.pause_callbacks.append(callback)
+        return
+
+    ################################################################################
+    def remove_pause_callback(self, callback : Callable[[int,bool],None] ) -> None:
+        """
+        DutyCycleManager: stops calling a function registered with add_pause_callback
+        """
+        if callback in self.pause_callbacks:
+            self.pause_callbacks.remove(callback)
+        return
+
+    ################################################################################
+    def observe_positions(self, axes : list[int], positions : list[int] ) -> None:
+        """
+        DutyCycleManager: tells the manager the encoder positions that have just
+        been read. An axis whose position has changed since it was last read is
+        moving, and one whose position has not changed has stopped.
+
+        Parameters
+        ----------
+        axes : list[int]
+            The axes that were read
+        positions : list[int]
+            The encoder position of each of those axes
+        """
+        now = self.clock.monotonic()
+        with self.lock:
+            for axis, position in zip(axes, positions):
+                if axis not in self.duty_cycles:
+                    continue
+                if axis in self.last_positions:
+                    self.duty_cycles[axis].set_motor_moving( position != self.last_positions[axis], now )
+                self.last_positions[axis] = position
+                self.schedule( axis, now )
+        self.event.set()
+        return
+
+    ################################################################################
+    def forget_resume_targets(self, axes : Optional[list[int]] = None ) -> None:
+        """
+        DutyCycleManager: stops paused axes from being sent back to their targets
+        when they resume (e.g. after an abort)
+
+        Parameters
+        ----------
+        axes : list[int]
+            The axes to forget (all of them if None)
+        """
+        with self.lock:
+            if axes is None:
+                self.resume_targets.clear()
+            else:
+                for axis in axes:
+                    self.resume_targets.pop( axis, None )
+        return
+
+    ################################################################################
+    def schedule(self, axis : int, now : float ) -> None:
+        """
+        DutyCycleManager: works out the next time an axis needs to be checked and
+        adds it to the queue. The lock must be held.
+        """
+        duty_cycle = self.duty_cycles[axis]
+        with duty_cycle.lock:
+            duty_cycle.update_mav(now)
+            wait = duty_cycle.get_time_to_next_check( now, axis in self.drive_system.paused_axes )
+
+        if wait == float('inf'):
+            self.next_deadline.pop( axis, None )
+            return
+        deadline = now + max( wait, self.MINIMUM_TIME_STEP )
+        self.next_deadline[axis] = deadline
+        heapq.heappush( self.deadlines, (deadline, axis) )
+        return
+
+    ################################################################################
+    def run(self) -> None:
+        """
+        DutyCycleManager: this is called by Thread.start(). Sleeps until the next
+        deadline, then checks the axes that are due.
+        """
+        while self.is_running:
+            now = self.clock.monotonic()
+            to_pause = []
+            to_resume = []
+            with self.lock:
+                # Check every axis that is due
+                while len(self.deadlines) > 0 and self.deadlines[0][0] <= now:
+                    deadline, axis = heapq.heappop(self.deadlines)
+                    if self.next_deadline.get(axis) != deadline:
+                        continue
+                    del self.next_deadline[axis]
+
+                    duty_cycle = self.duty_cycles[axis]
+                    with duty_cycle.lock:
+                        duty_cycle.update_mav(now)
+                    is_paused = axis in self.drive_system.paused_axes
+                    if not is_paused and duty_cycle.mav >= duty_cycle.time_allowed_on:
+                        to_pause.append(axis)
+                    elif is_paused and duty_cycle.mav <= duty_cycle.time_allowed_on - duty_cycle.resume_cycle_after:
+                        to_resume.append(axis)
+                    else:
+                        self.schedule( axis, now )
+                
+                # Work out how long to sleep
+                timeout = self.MAXIMUM_WAIT
+                if len(self.deadlines) > 0:
+                    timeout = min( timeout, max( self.deadlines[0][0] - now, 0.0 ) )
+
+            # Talk to the motor box without holding the lock
+            for axis in to_pause:
+                self.pause_axis(axis)
+            for axis in to_resume:
+                self.resume_axis(axis)
+            if len(to_pause) > 0 or len(to_resume) > 0:
+                continue
+
+            self.clock.wait( self.event, timeout )
+            self.event.clear()
+        return
+
+    ################################################################################
+    def pause_axis(self, axis : int ) -> None:
+        """
+        DutyCycleManager: stops an axis that has been on for too long, and
+        remembers where it was going
+        """
+        target = self.drive_system.last_move_targets.get(axis)
+        if axis not in self.drive_system.paused_axes:
+            self.drive_system.paused_axes.append(axis)
+        self.drive_system.abort_axis(axis)
+        print(f"Duty cycle exceeded on axis {axis}. Pausing axis until it has rested")
+
+        now = self.clock.monotonic()
+        with self.lock:
+            if target is not None:
+                self.resume_targets[axis] = target
+            self.duty_cycles[axis].set_motor_moving( False, now )
+            self.schedule( axis, now )
+        self.tell_callbacks( axis, True )
+        return
+
+    ################################################################################
+    def resume_axis(self, axis : int ) -> None:
+        """
+        DutyCycleManager: allows an axis to move again once it has rested, and
+        sends it back to its target if it did not get there
+        """
+        with self.lock:
+            target = self.resume_targets.pop( axis, None )
+        if axis in self.drive_system.paused_axes:
+            self.drive_system.paused_axes.remove(axis)
+        self.tell_callbacks( axis, False )
+
+        if target is not None and target != self.drive_system.positions[axis-1]:
+            print(f"Rest over on axis {axis}. Resuming movement to {target}")
+            self.drive_system.reset_axis(axis)
+            self.drive_system.move_absolute( axis, target )
+        else:
+            print(f"Rest over on axis {axis}")
+        return
+
+    ################################################################################
+    def tell_callbacks(self, axis : int, is_paused : bool ) -> None:
+        """
+        DutyCycleManager: calls every pause callback
+        """
+        for callback in list(self.pause_callbacks):
+            callback( axis, is_paused )
+        return
+
+    ################################################################################
+    def kill_thread(self) -> None:
+        """
+        DutyCycleManager: kill the thread
+        """
+        self.is_running = False
+        self.event.set()
+        return
+
+
 
 
 def main():
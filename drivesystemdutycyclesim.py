@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+DriveSystem Duty Cycle Simulator
+================================
+
+Replays timelines of movement requests through a DutyCycle running on a
+VirtualClock, so that hours of motion can be checked in a fraction of a second.
+The clock only ticks (at DutyCycle.time_step) while something could happen, and
+jumps ahead to the next request or the next time the motor could be paused or
+resumed otherwise.
+
+Afterwards the motion that was allowed is checked against the HR4 table: the
+time on within any window of one cycle must never exceed the time allowed on,
+the motor must only be paused once it has reached that limit, it must be resumed
+once it has rested for long enough, and it must never move unless movement was
+requested and it was not paused. The CPU time spent per tick is also reported.
+
+A timeline can be generated randomly or read from a file with one change per
+line, written as
+
+    time_in_seconds, 1 (movement requested) or 0 (stop requested)
+
+Lines beginning with '#' are ignored.
+"""
+
+__version__ = 1.0
+
+import argparse as ap
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+import drivesystemclock as dsclock
+import drivesystemdutycycle as dsdc
+
+################################################################################
+# CONSTANTS
+ENVIRONMENTS = ['air', 'vacuum']
+
+################################################################################
+################################################################################
+################################################################################
+def generate_timeline( duration : float, mean_move_time : float, mean_stop_time : float, seed : Optional[int] = None ) -> np.ndarray:
+    """
+    Generates a random timeline of movement requests, with exponentially
+    distributed times spent moving and stopped
+
+    Parameters
+    ----------
+    duration : float
+        Length of the timeline in seconds
+    mean_move_time : float
+        Average time each movement is requested for in seconds
+    mean_stop_time : float
+        Average time between movements in seconds
+    seed : int
+        Seed for the random number generator
+
+    Returns
+    -------
+    timeline : np.ndarray
+        (N, 2) array of (time, is_movement_requested)
+    """
+    rng = np.random.default_rng(seed)
+
+    # Draw plenty of intervals at once, alternating stopped then moving
+    number = int( 2*duration/( mean_move_time + mean_stop_time ) ) + 10
+    intervals = np.empty( 2*number )
+    intervals[0::2] = rng.exponential( mean_stop_time, number )
+    intervals[1::2] = rng.exponential( mean_move_time, number )
+    times = np.cumsum(intervals)
+    values = np.tile( [1.0, 0.0], number )
+    is_inside = times < duration
+    return np.column_stack( [ times[is_inside], values[is_inside] ] )
+
+################################################################################
+def read_timeline( path : str ) -> np.ndarray:
+    """
+    Reads a timeline of movement requests from a file (see the top of this file)
+
+    Returns
+    -------
+    timeline : np.ndarray
+        (N, 2) array of (time, is_movement_requested), sorted by time
+    """
+    timeline = np.loadtxt( path, delimiter=',', comments='#', ndmin=2 )
+    return timeline[ np.argsort( timeline[:,0], kind='stable' ) ]
+
+################################################################################
+################################################################################
+################################################################################
+class ReplayResult:
+    """
+    The record of a replay: every change in the state of the motor, and how long
+    the ticks took.
+
+    Attributes
+    ----------
+    times : np.ndarray
+        The times of each change of state (the first is the start)
+    is_moving : np.ndarray
+        Whether the motor moved from each time onwards
+    is_resting : np.ndarray
+        Whether the motor was paused from each time onwards
+    is_requested : np.ndarray
+        Whether movement was requested from each time onwards
+    end_time : float
+        When the replay finished
+    number_of_ticks : int
+        The number of times DutyCycle.tick was called
+    tick_cpu_time : float
+        The CPU time spent in DutyCycle.tick in seconds
+    """
+    ################################################################################
+    def __init__(self, times : list, is_moving : list, is_resting : list, is_requested : list, end_time : float, number_of_ticks : int, tick_cpu_time : float ) -> None:
+        """
+        ReplayResult: stores the record of a replay
+        """
+        self.times = np.array( times, dtype=float )
+        self.is_moving = np.array( is_moving, dtype=bool )
+        self.is_resting = np.array( is_resting, dtype=bool )
+        self.is_requested = np.array( is_requested, dtype=bool )
+        self.end_time = end_time
+        self.number_of_ticks = number_of_ticks
+        self.tick_cpu_time = tick_cpu_time
+        return
+
+    ################################################################################
+    def get_time_on_in_window(self, t : np.ndarray, window : float ) -> np.ndarray:
+        """
+        ReplayResult: calculates how long the motor was moving between t - window
+        and t for each time in t
+        """
+        time_on = np.concatenate( [ [0.0], np.cumsum( np.diff( np.append( self.times, self.end_time ) )*self.is_moving ) ] )
+        edges = np.append( self.times, self.end_time )
+        return np.interp( t, edges, time_on ) - np.interp( t - window, edges, time_on, left=0.0 )
+
+    ################################################################################
+    def get_pause_and_resume_times(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        ReplayResult: gets the times the motor was paused and resumed
+        """
+        change = np.diff( self.is_resting.astype(int) )
+        return self.times[1:][change > 0], self.times[1:][change < 0]
+
+
+################################################################################
+################################################################################
+################################################################################
+def replay_timeline( duty_cycle : 'dsdc.DutyCycle', timeline : np.ndarray, duration : float ) -> ReplayResult:
+    """
+    Replays a timeline of movement requests through a duty cycle. The duty cycle
+    must use a VirtualClock, which is moved on to each tick.
+
+    Parameters
+    ----------
+    duty_cycle : DutyCycle
+        The duty cycle (not started as a thread)
+    timeline : np.ndarray
+        (N, 2) array of (time, is_movement_requested), sorted by time and
+        relative to the start of the replay
+    duration : float
+        How long to replay for in seconds
+
+    Returns
+    -------
+    result : ReplayResult
+        What the motor did
+    """
+    clock = duty_cycle.clock
+    start = clock.monotonic()
+    end = start + duration
+    time_step = duty_cycle.time_step
+    event_times = timeline[:,0] + start
+    next_event = 0
+    number_of_ticks = 0
+    tick_cpu_time = 0.0
+
+    times = [start]
+    is_moving = [duty_cycle.is_motor_moving_now]
+    is_resting = [duty_cycle.is_motor_resting]
+    is_requested = [duty_cycle.is_motor_movement_requested]
+
+    now = start
+    while now < end:
+        # Apply any requests that are due
+        while next_event < len(event_times) and event_times[next_event] <= now:
+            if timeline[next_event,1]:
+                duty_cycle.request_motor_movement()
+            else:
+                duty_cycle.tell_motor_to_stop()
+            next_event += 1
+
+        # Tick
+        cpu_start = time.process_time()
+        duty_cycle.tick()
+        tick_cpu_time += time.process_time() - cpu_start
+        number_of_ticks += 1
+
+        # Record any change
+        state = ( duty_cycle.is_motor_moving_now, duty_cycle.is_motor_resting, duty_cycle.is_motor_movement_requested )
+        if state != ( is_moving[-1], is_resting[-1], is_requested[-1] ):
+            times.append(now)
+            is_moving.append(state[0])
+            is_resting.append(state[1])
+            is_requested.append(state[2])
+
+        # Jump to the next tick where something could happen
+        with duty_cycle.lock:
+            duty_cycle.update_mav(now)
+            wait = duty_cycle.get_time_to_next_check( now, duty_cycle.is_motor_resting )
+        next_time = now + max( wait, time_step )
+        if next_event < len(event_times):
+            next_time = min( next_time, event_times[next_event] )
+        next_time = start + np.ceil( ( next_time - start )/time_step - 1e-9 )*time_step
+        next_time = min( max( next_time, now + time_step ), end )
+        clock.advance_to(next_time)
+        now = clock.monotonic()
+
+    return ReplayResult( np.array(times) - start, is_moving, is_resting, is_requested, end - start, number_of_ticks, tick_cpu_time )
+
+################################################################################
+def check_replay( result : ReplayResult, duty_cycle : 'dsdc.DutyCycle' ) -> list[str]:
+    """
+    Checks the motion allowed in a replay against the duty cycle from the HR4
+    table. Times are only known to a tick (and the moving average is rounded to
+    0.01 s), so small differences are allowed.
+
+    Parameters
+    ----------
+    result : ReplayResult
+        The replay to check
+    duty_cycle : DutyCycle
+        The duty cycle used in the replay
+
+    Returns
+    -------
+    problems : list[str]
+        A description of everything that went wrong (empty if nothing did)
+    """
+    problems = []
+    tolerance = duty_cycle.time_step + 0.01
+    window = duty_cycle.total_cycle_length
+
+    # The time on in a window is piecewise linear, so its maximum is at a change or a cycle after one
+    breakpoints = np.concatenate( [ result.times, result.times + window, [result.end_time] ] )
+    breakpoints = breakpoints[ breakpoints <= result.end_time ]
+    time_on = result.get_time_on_in_window( breakpoints, window )
+    if len(time_on) > 0 and np.max(time_on) > duty_cycle.time_allowed_on + tolerance:
+        problems.append( f"on for {np.max(time_on):.2f} s in one cycle at t = {breakpoints[np.argmax(time_on)]:.2f} s (allowed {duty_cycle.time_allowed_on} s)" )
+
+    # Paused only once the limit has been reached
+    pause_times, resume_times = result.get_pause_and_resume_times()
+    time_on_at_pause = result.get_time_on_in_window( pause_times, window )
+    is_early = time_on_at_pause < duty_cycle.time_allowed_on - tolerance
+    if np.any(is_early):
+        problems.append( f"paused {np.sum(is_early)} times before the limit (first at t = {pause_times[is_early][0]:.2f} s)" )
+
+    # Resumed once rested, but not before
+    resume_level = duty_cycle.time_allowed_on - duty_cycle.resume_cycle_after
+    time_on_at_resume = result.get_time_on_in_window( resume_times, window )
+    is_wrong = np.abs( time_on_at_resume - resume_level ) > tolerance
+    if np.any(is_wrong):
+        problems.append( f"resumed {np.sum(is_wrong)} times at the wrong time (first at t = {resume_times[is_wrong][0]:.2f} s with {time_on_at_resume[is_wrong][0]:.2f} s on)" )
+
+    # Never moving without a request or while paused
+    is_bad = result.is_moving & ( ~result.is_requested | result.is_resting )
+    if np.any(is_bad):
+        problems.append( f"moved {np.sum(is_bad)} times without being allowed to (first at t = {result.times[is_bad][0]:.2f} s)" )
+
+    return problems
+
+################################################################################
+def run_replay( force : float, environment : str, timeline : np.ndarray, duration : float ) -> Optional[dict]:
+    """
+    Replays a timeline through a new duty cycle on a VirtualClock and checks it
+
+    Returns
+    -------
+    summary : dict
+        The results of the replay, or None if this force and environment has no
+        duty cycle
+    """
+    duty_cycle = dsdc.DutyCycle( force, environment, dsclock.VirtualClock() )
+    if duty_cycle.infinite_run_time:
+        return None
+    duty_cycle.print_output = False
+
+    wall_start = time.perf_counter()
+    result = replay_timeline( duty_cycle, timeline, duration )
+    wall_time = time.perf_counter() - wall_start
+
+    pause_times, resume_times = result.get_pause_and_resume_times()
+    return {
+        'force' : force,
+        'environment' : environment,
+        'time_allowed_on' : duty_cycle.time_allowed_on,
+        'total_cycle_length' : duty_cycle.total_cycle_length,
+        'duration' : duration,
+        'wall_time' : wall_time,
+        'number_of_ticks' : result.number_of_ticks,
+        'cpu_time_per_tick' : result.tick_cpu_time/max( result.number_of_ticks, 1 ),
+        'number_of_pauses' : len(pause_times),
+        'number_of_resumes' : len(resume_times),
+        'problems' : check_replay( result, duty_cycle ),
+    }
+
+################################################################################
+def print_summary( summary : dict ) -> None:
+    """
+    Prints the results of run_replay
+    """
+    status = "OK" if len(summary['problems']) == 0 else "FAILED"
+    print(f"{summary['environment']:>6} {summary['force']:>5.1f} N ({summary['time_allowed_on']:>5.1f} s / {summary['total_cycle_length']:>5.1f} s): "
+          f"{summary['number_of_pauses']:>4} pauses, {summary['number_of_ticks']:>7} ticks, "
+          f"{1e6*summary['cpu_time_per_tick']:>6.2f} us/tick, {summary['duration']/summary['wall_time']:>9.0f}x real time - {status}")
+    for problem in summary['problems']:
+        print(f"    {problem}")
+    return
+
+################################################################################
+################################################################################
+################################################################################
+def parse_command_line_arguments() -> ap.Namespace:
+    """
+    Parses the command line arguments for the duty cycle simulator
+    """
+    parser = ap.ArgumentParser(prog='drivesystemdutycyclesim.py', description='Replays movement timelines through the duty cycle on a virtual clock and checks the pauses against the HR4 table. Every row of the table is checked unless --force is given.')
+    parser.add_argument('--version', action='version', version=f'%(prog)s version {__version__}')
+    parser.add_argument('--force', type=float, default=None, metavar='N', help='force applied by the motor (all rows of the HR4 table by default)')
+    parser.add_argument('--environment', type=str, choices=ENVIRONMENTS, default=None, help='air or vacuum (both by default)')
+    parser.add_argument('--timeline', type=str, default=None, metavar='file', help='file of movement requests to replay (a random timeline by default)')
+    parser.add_argument('--duration', type=float, default=8.0, metavar='hours', help='length of the random timeline, or how long to replay a file for after its last request')
+    parser.add_argument('--mean-move-time', type=float, default=60.0, metavar='s', help='average length of a random movement')
+    parser.add_argument('--mean-stop-time', type=float, default=30.0, metavar='s', help='average time between random movements')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the random timeline')
+    return parser.parse_args()
+
+################################################################################
+def main():
+    """
+    Replays the timeline given on the command line for each force and environment
+    """
+    args = parse_command_line_arguments()
+
+    duration = 3600.0*args.duration
+    if args.timeline is not None:
+        timeline = read_timeline(args.timeline)
+        if len(timeline) > 0:
+            duration += timeline[-1,0]
+    else:
+        timeline = generate_timeline( duration, args.mean_move_time, args.mean_stop_time, args.seed )
+    print(f"Replaying {len(timeline)} requests over {duration/3600.0:.2f} hours")
+
+    forces = [args.force] if args.force is not None else [ value[0] for value in dsdc.DutyCycle.DUTY_CYCLE_HR4_DICT.values() ]
+    environments = [args.environment] if args.environment is not None else ENVIRONMENTS
+
+    is_ok = True
+    for environment in environments:
+        for force in forces:
+            summary = run_replay( force, environment, timeline, duration )
+            if summary is None:
+                print(f"{environment:>6} {force:>5.1f} N: no duty cycle")
+                continue
+            print_summary(summary)
+            is_ok = is_ok and len(summary['problems']) == 0
+
+    print("All duty cycles behaved as expected" if is_ok else "SOME DUTY CYCLES DID NOT BEHAVE AS EXPECTED")
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+DriveSystem Events
+==================
+
+Events published by the DriveSystem whenever something changes, so that the
+GUI, the command line interface and anything exporting the positions can react
+straight away instead of each polling the DriveSystem in its own loop. The
+events are:
+  - PositionsEvent      - new encoder positions have been read
+  - ConnectionEvent     - the serial port has been connected or disconnected
+  - ScanEvent           - a slit or raster scan has started or stopped
+  - AxisPausedEvent     - an axis has been paused or resumed by its duty cycle
+
+Subscribers are called on the thread that publishes the event (usually the
+DriveSystemThread), so they must be quick, and anything touching the GUI has to
+be passed on to the GUI thread (e.g. with wx.CallAfter or a LatestValueMailbox).
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+################################################################################
+################################################################################
+################################################################################
+class Event:
+    """
+    The base class of every event, recording when it was published
+    """
+    ################################################################################
+    def __init__(self) -> None:
+        """
+        Event: records the time the event was created
+        """
+        self.time = time.time()
+        return
+
+    ################################################################################
+    def __repr__(self) -> str:
+        """
+        Event: cast object to string
+        """
+        attributes = ", ".join( f"{key}={value!r}" for key, value in vars(self).items() if key != 'time' )
+        return f"{type(self).__name__}({attributes})"
+
+    ################################################################################
+    def get_key(self):
+        """
+        Event: gets the key under which the EventBus keeps the last event (one is
+        kept for each key)
+        """
+        return type(self)
+
+
+################################################################################
+################################################################################
+################################################################################
+class PositionsEvent(Event):
+    """
+    New encoder positions have been read from the motor box
+    """
+    ################################################################################
+    def __init__(self, positions : np.ndarray, axes : list[int] ) -> None:
+        """
+        PositionsEvent: stores a snapshot of the positions
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            A copy of the encoder positions of every axis
+        axes : list[int]
+            The axes that were just read
+        """
+        super().__init__()
+        self.positions = positions
+        self.axes = axes
+        return
+
+
+################################################################################
+################################################################################
+################################################################################
+class ConnectionEvent(Event):
+    """
+    The serial port to the motor box has been connected or disconnected
+    """
+    ################################################################################
+    def __init__(self, is_connected : bool ) -> None:
+        """
+        ConnectionEvent: stores the new state of the connection
+        """
+        super().__init__()
+        self.is_connected = is_connected
+        return
+
+
+################################################################################
+################################################################################
+################################################################################
+class ScanEvent(Event):
+    """
+    A slit or raster scan has started or stopped
+    """
+    ################################################################################
+    def __init__(self, is_scanning : bool ) -> None:
+        """
+        ScanEvent: stores whether a scan is now running
+        """
+        super().__init__()
+        self.is_scanning = is_scanning
+        return
+
+
+################################################################################
+################################################################################
+################################################################################
+class AxisPausedEvent(Event):
+    """
+    An axis has been paused or resumed by its duty cycle
+    """
+    ################################################################################
+    def __init__(self, axis : int, is_paused : bool ) -> None:
+        """
+        AxisPausedEvent: stores the axis and whether it is now paused
+        """
+        super().__init__()
+        self.axis = axis
+        self.is_paused = is_paused
+        return
+
+    ################################################################################
+    def get_key(self):
+        """
+        AxisPausedEvent: the last event is kept for each axis
+        """
+        return ( type(self), self.axis )
+
+
+################################################################################
+################################################################################
+################################################################################
+class Subscription:
+    """
+    A callback registered with an EventBus, with the events it wants
+    """
+    ################################################################################
+    def __init__(self, callback : Callable[[Event],None], event_types : tuple, event_filter : Optional[Callable[[Event],bool]] ) -> None:
+        """
+        Subscription: stores the callback and what it is subscribed to
+
+        Parameters
+        ----------
+        callback : Callable[[Event],None]
+            Called with every matching event
+        event_types : tuple
+            The Event classes wanted
+        event_filter : Callable[[Event],bool]
+            (Optional) Only events for which this returns True are passed on
+        """
+        self.callback = callback
+        self.event_types = event_types
+        self.event_filter = event_filter
+        return
+
+    ################################################################################
+    def matches(self, event : Event ) -> bool:
+        """
+        Subscription: checks if the event should be passed to the callback
+        """
+        return isinstance( event, self.event_types ) and ( self.event_filter is None or self.event_filter(event) )
+
+
+################################################################################
+################################################################################
+################################################################################
+class EventBus:
+    """
+    Passes published events to every subscriber that wants them. The last event
+    of each type is kept, so a new subscriber can be told the current state
+    straight away rather than waiting for the next change.
+    """
+    ################################################################################
+    def __init__(self) -> None:
+        """
+        EventBus: creates a bus with no subscribers
+        """
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        self.last_events = {} # Event key (see Event.get_key) -> the last event published with that key
+        return
+
+    ################################################################################
+    def subscribe(self, callback : Callable[[Event],None], event_types = Event, event_filter : Optional[Callable[[Event],bool]] = None, replay : bool = True ) -> Subscription:
+        """
+        EventBus: registers a callback to be called with events
+
+        Parameters
+        ----------
+        callback : Callable[[Event],None]
+            Called with every matching event, on the thread that publishes it
+        event_types : type | tuple
+            The Event class (or tuple of classes) wanted. Defaults to every event
+        event_filter : Callable[[Event],bool]
+            (Optional) Only events for which this returns True are passed on, e.g.
+            lambda e : e.axis == 3
+        replay : bool
+            Call the callback at once with the last matching event of each key, so
+            it starts from the current state
+
+        Returns
+        -------
+        subscription : Subscription
+            Pass this to unsubscribe() to stop receiving events
+        """
+        if not isinstance( event_types, tuple ):
+            event_types = ( event_types, )
+        subscription = Subscription( callback, event_types, event_filter )
+        with self.lock:
+            self.subscriptions.append(subscription)
+            last_events = list( self.last_events.values() ) if replay else []
+
+        for event in last_events:
+            self.call( subscription, event )
+        return subscription
+
+    ################################################################################
+    def unsubscribe(self, subscription : Subscription ) -> None:
+        """
+        EventBus: stops calling a callback registered with subscribe()
+        """
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+        return
+
+    ################################################################################
+    def publish(self, event : Event ) -> None:
+        """
+        EventBus: calls every subscriber that wants the event
+        """
+        with self.lock:
+            self.last_events[event.get_key()] = event
+            subscriptions = list(self.subscriptions)
+
+        for subscription in subscriptions:
+            self.call( subscription, event )
+        return
+
+    ################################################################################
+    def get_last_event(self, key ) -> Optional[Event]:
+        """
+        EventBus: gets the last event published with a key, e.g. PositionsEvent or
+        (AxisPausedEvent, 3) (None if there has not been one)
+        """
+        with self.lock:
+            return self.last_events.get(key)
+
+    ################################################################################
+    @staticmethod
+    def call( subscription : Subscription, event : Event ) -> None:
+        """
+        EventBus: calls a subscriber if it wants the event. Errors are caught, so
+        that a subscriber that fails cannot stop the thread publishing the event or
+        the other subscribers.
+        """
+        try:
+            if subscription.matches(event):
+                subscription.callback(event)
+        except Exception as e:
+            print(f"EVENT ERROR: {subscription.callback} failed with {type(e).__name__}: {e} for {event}")
+        return
@@ -0,0 +1,186 @@
+"""
+DriveSystem Frame Rate
+======================
+
+Limits how often the GUI redraws the positions, whatever the rate at which they
+are read from the motor box. The positions can be read many times a second
+during a scan, and drawing each of them would leave the GUI thread (and the
+control PC) with no time for anything else. The FrameRateGovernor measures how
+long each frame takes to draw and spaces the frames out so that:
+  - there are never more than MaxFrameRate frames per second
+  - drawing takes at most MAX_RENDER_FRACTION of the time of the GUI thread
+  - the frame rate is halved (down to MIN_FRAME_RATE) whenever a frame takes
+    longer to draw than the time between frames, or the process uses more than
+    MAX_CPU_FRACTION of a CPU, and then recovers slowly once things are quiet
+Positions read while waiting for the next frame are not queued - only the
+newest is drawn (see LatestValueMailbox).
+"""
+
+import contextlib
+import threading
+import time
+
+import drivesystemoptions as dsopts
+
+################################################################################
+# CONSTANTS
+MIN_FRAME_RATE = 0.5          # [Hz] The governor never backs off further than this
+MAX_RENDER_FRACTION = 0.5     # Fraction of the time the GUI thread can spend drawing
+MAX_CPU_FRACTION = 0.8        # Fraction of one CPU used by the process before backing off
+CPU_CHECK_TIME = 1.0          # [s] How often the CPU used by the process is checked
+BACK_OFF_FACTOR = 2.0         # The time between frames is multiplied by this when backing off
+RECOVERY_FACTOR = 0.9         # ...and by this after each frame without problems
+RENDER_TIME_SMOOTHING = 0.2   # Weight of the newest frame in the average time to draw a frame
+
+################################################################################
+################################################################################
+################################################################################
+class FrameRateGovernor:
+    """
+    Decides when the next frame can be drawn, from the measured time to draw
+    each frame and the CPU used by the process. Frames should be drawn inside
+    frame(), and not before time_until_next_frame() has passed.
+    """
+    ################################################################################
+    def __init__(self, max_frame_rate : float ) -> None:
+        """
+        FrameRateGovernor: sets the maximum frame rate
+
+        Parameters
+        ----------
+        max_frame_rate : float
+            The most frames drawn per second
+        """
+        self.min_interval = 1/max_frame_rate
+        self.max_interval = 1/min( MIN_FRAME_RATE, max_frame_rate )
+        self.interval = self.min_interval # Current time between frames
+        self.last_frame_time = None
+        self.mean_render_time = 0.0
+        self.last_cpu_check = ( time.monotonic(), time.process_time() )
+        self.is_cpu_busy = False # From the last check of the CPU
+        self.lock = threading.Lock()
+
+        # Counters
+        self.number_of_frames = 0
+        self.number_of_overruns = 0
+        self.number_of_cpu_back_offs = 0
+        self.max_render_time = 0.0
+        return
+
+    ################################################################################
+    @classmethod
+    def from_options(cls) -> 'FrameRateGovernor':
+        """
+        FrameRateGovernor: creates a governor from the MaxFrameRate option
+        """
+        return cls( dsopts.OPTION_MAX_FRAME_RATE.get_value() )
+
+    ################################################################################
+    def time_until_next_frame(self) -> float:
+        """
+        FrameRateGovernor: gets how long to wait in seconds before the next frame
+        can be drawn (0 if it can be drawn now)
+        """
+        with self.lock:
+            if self.last_frame_time is None:
+                return 0.0
+            return max( self.last_frame_time + self.interval - time.monotonic(), 0.0 )
+
+    ################################################################################
+    @contextlib.contextmanager
+    def frame(self):
+        """
+        FrameRateGovernor: times the drawing of a frame, then works out the time
+        until the next one
+        """
+        start = time.monotonic()
+        with self.lock:
+            self.last_frame_time = start # So frames asked for while this is drawn wait for the next one
+        try:
+            yield
+        finally:
+            self.record_frame( start, time.monotonic() )
+
+    ################################################################################
+    def record_frame(self, start : float, end : float ) -> None:
+        """
+        FrameRateGovernor: records a frame drawn between two times (from
+        time.monotonic()) and sets the time between frames
+
+        Parameters
+        ----------
+        start : float
+            When the frame started to be drawn
+        end : float
+            When it was finished
+        """
+        render_time = end - start
+        with self.lock:
+            self.last_frame_time = start
+            self.number_of_frames += 1
+            self.max_render_time = max( self.max_render_time, render_time )
+            self.mean_render_time += ( 1.0 if self.number_of_frames == 1 else RENDER_TIME_SMOOTHING )*( render_time - self.mean_render_time )
+
+            # Back off if the frame took longer than the time allowed for it, or the CPU was busy
+            # when it was last checked...
+            is_overrun = render_time > self.interval
+            is_cpu_checked = self.check_cpu(end)
+            if is_overrun or ( is_cpu_checked and self.is_cpu_busy ):
+                self.number_of_overruns += is_overrun
+                self.number_of_cpu_back_offs += is_cpu_checked and self.is_cpu_busy
+                self.interval *= BACK_OFF_FACTOR
+            # ... otherwise slowly go back to the maximum frame rate once the CPU is quiet
+            elif not self.is_cpu_busy:
+                self.interval *= RECOVERY_FACTOR
+
+            # Never spend more than a fraction of the time drawing
+            self.interval = min( max( self.interval, self.min_interval, self.mean_render_time/MAX_RENDER_FRACTION ), self.max_interval )
+        return
+
+    ################################################################################
+    def check_cpu(self, now : float ) -> bool:
+        """
+        FrameRateGovernor: sets is_cpu_busy from the CPU used by the process since
+        the last check, if CPU_CHECK_TIME has passed
+
+        Returns
+        -------
+        is_checked : bool
+            True if the CPU was checked
+        """
+        last_time, last_cpu_time = self.last_cpu_check
+        if now - last_time < CPU_CHECK_TIME:
+            return False
+        cpu_time = time.process_time()
+        self.last_cpu_check = ( now, cpu_time )
+        self.is_cpu_busy = ( cpu_time - last_cpu_time )/( now - last_time ) > MAX_CPU_FRACTION
+        return True
+
+    ################################################################################
+    def get_counters(self) -> dict:
+        """
+        FrameRateGovernor: gets the number of frames, how often it backed off, the
+        times taken to draw the frames and the current frame rate
+        """
+        with self.lock:
+            return {
+                'frames'           : self.number_of_frames,
+                'overruns'         : self.number_of_overruns,
+                'cpu_back_offs'    : self.number_of_cpu_back_offs,
+                'mean_render_time' : self.mean_render_time,
+                'max_render_time'  : self.max_render_time,
+                'frame_rate'       : 1/self.interval,
+            }
+
+    ################################################################################
+    def print_counters(self) -> None:
+        """
+        FrameRateGovernor: prints the counters to the console
+        """
+        counters = self.get_counters()
+        print(f"Frames drawn             : {counters['frames']}")
+        print(f"Frames overrunning       : {counters['overruns']}")
+        print(f"Backed off for busy CPU  : {counters['cpu_back_offs']}")
+        print(f"Mean/max time to draw    : {counters['mean_render_time']*1000:.1f} ms / {counters['max_render_time']*1000:.1f} ms")
+        print(f"Current frame rate limit : {counters['frame_rate']:.1f} Hz")
+        return
@@ -0,0 +1,264 @@
+"""
+DriveSystem Geometry
+====================
+
+A model of the clearances between the moving parts inside the magnet that does
+not depend on the GUI. Every clearance that is drawn by the DriveView (the
+distance between the silencer and the target ladder, and the distance between
+the trolley and the beam-blocker soft limit) is a linear function of the encoder
+positions, so they are stored as one matrix equation
+
+    clearance = A @ positions + b
+
+where each row of A and b is one constraint, in mm. A position is safe if every
+clearance is at least MINIMUM_CLEARANCE. Because the axes move at constant
+speed, the clearances along a move are piecewise linear in time and only need
+to be checked at the start, the end, and whenever an axis finishes moving, so
+whole trajectories can be checked at once with a handful of matrix products.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+import drivesystemoptions as dsopts
+import drivesystemmotorinfo as dsmi
+import drivesystemscanpath as dssp
+
+################################################################################
+# CONSTANTS
+MINIMUM_CLEARANCE = 0.0 # [mm]
+
+################################################################################
+################################################################################
+################################################################################
+class GeometryModel:
+    """
+    Holds the clearance constraints between the moving parts, built from the
+    options file.
+
+    Attributes
+    ----------
+    A : np.ndarray
+        (number of constraints, NUMBER_OF_MOTOR_AXES) matrix in mm per step
+    b : np.ndarray
+        (number of constraints,) offsets in mm
+    names : list[str]
+        The name of each constraint (as labelled in the DriveView)
+    """
+    ################################################################################
+    def __init__(self, number_of_axes : int, step_to_mm : float ) -> None:
+        """
+        GeometryModel: builds the constraints from the options. Constraints whose
+        options have not been set are left out with a warning.
+
+        Parameters
+        ----------
+        number_of_axes : int
+            The number of motor axes (NUMBER_OF_MOTOR_AXES in drivesystemlib)
+        step_to_mm : float
+            The distance moved in one step of the encoder in mm (STEP_TO_MM in
+            drivesystemlib)
+        """
+        rows = []
+        offsets = []
+        self.names = []
+
+        trolley_axis = self.get_axis_number( 'TaC', dsopts.OPTION_TROLLEY_AXIS_NUMBER )
+        array_axis = self.get_axis_number( 'ArC', dsopts.OPTION_ARRAY_AXIS_NUMBER )
+
+        # Silencer to target ladder (d_collision in the DriveView) - see DriveView.draw_objects
+        try:
+            row = np.zeros( number_of_axes )
+            row[array_axis-1] += step_to_mm
+            row[trolley_axis-1] -= step_to_mm
+            offset = dsopts.OPTION_ARRAY_TIP_TO_TARGET_LADDER_AT_SPECIFIED_ENCODER_POSITIONS.get_value()
+            offset -= dsopts.OPTION_ENCODER_AXIS_TWO.get_value()*step_to_mm
+            offset += dsopts.OPTION_ENCODER_AXIS_ONE.get_value()*step_to_mm
+            offset -= dsopts.get_silencer_length_from_tip()
+            offset -= dsopts.OPTION_TARGET_LADDER_THICKNESS.get_value()
+            rows.append(row)
+            offsets.append(offset)
+            self.names.append('d_collision')
+        except TypeError:
+            print("GEOMETRY WARNING: the silencer-target ladder distance cannot be calculated as some options are not set. It will not be checked before moving.")
+
+        # Trolley to beam-blocker soft limit (d_blocker in the DriveView)
+        soft_limit = dsopts.OPTION_BEAM_BLOCKER_TO_TROLLEY_AXIS_SOFT_LIMIT.get_value()
+        if dsopts.OPTION_IS_BEAM_BLOCKER_ENABLED.get_value() and soft_limit != None:
+            row = np.zeros( number_of_axes )
+            row[trolley_axis-1] = step_to_mm
+            rows.append(row)
+            offsets.append( -soft_limit*step_to_mm )
+            self.names.append('d_blocker')
+
+        self.A = np.array( rows, dtype=float ).reshape( len(rows), number_of_axes )
+        self.b = np.array( offsets, dtype=float )
+        return
+
+    ################################################################################
+    @staticmethod
+    def get_axis_number( key : str, option : 'dsopts.Option' ) -> int:
+        """
+        GeometryModel: gets the axis number of a motor from MOTOR_AXIS_DICT, or
+        from the options if the axis mapping has not been set yet
+        """
+        axis = dsmi.MOTOR_AXIS_DICT[key].axis_number if key in dsmi.MOTOR_AXIS_DICT else None
+        if axis == None:
+            axis = option.get_value()
+        return axis
+
+    ################################################################################
+    def get_clearances(self, positions : np.ndarray ) -> np.ndarray:
+        """
+        GeometryModel: calculates every clearance for one or more position vectors
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            Encoder positions with shape (NUMBER_OF_MOTOR_AXES,) or
+            (N, NUMBER_OF_MOTOR_AXES)
+
+        Returns
+        -------
+        clearances : np.ndarray
+            Clearances in mm with shape (number of constraints,) or
+            (N, number of constraints)
+        """
+        return np.asarray( positions, dtype=float ) @ self.A.T + self.b
+
+    ################################################################################
+    def is_safe(self, positions : np.ndarray ) -> np.ndarray:
+        """
+        GeometryModel: checks whether one or more position vectors satisfy every
+        constraint
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            Encoder positions with shape (NUMBER_OF_MOTOR_AXES,) or
+            (N, NUMBER_OF_MOTOR_AXES)
+
+        Returns
+        -------
+        is_safe : np.ndarray
+            Boolean (or array of booleans with shape (N,))
+        """
+        return np.all( self.get_clearances(positions) >= MINIMUM_CLEARANCE, axis=-1 )
+
+    ################################################################################
+    @staticmethod
+    def get_trajectory(start : np.ndarray, end : np.ndarray, speeds : Optional[np.ndarray] = None ) -> np.ndarray:
+        """
+        GeometryModel: gets the positions at the start and end of a move, and
+        whenever one of the axes finishes moving, assuming all axes start at the
+        same time and move at a constant speed
+
+        Parameters
+        ----------
+        start : np.ndarray
+            Encoder positions at the start of the move
+        end : np.ndarray
+            Encoder positions at the end of the move
+        speeds : np.ndarray
+            Speed of each axis in steps per second (all the same if None)
+
+        Returns
+        -------
+        trajectory : np.ndarray
+            (M, NUMBER_OF_MOTOR_AXES) positions at each breakpoint
+        """
+        start = np.asarray( start, dtype=float )
+        end = np.asarray( end, dtype=float )
+        if speeds is None:
+            speeds = np.full( len(start), dssp.DEFAULT_SLEW_SPEED )
+
+        distance = end - start
+        finish_times = np.abs(distance)/speeds
+        times = np.unique( np.concatenate( [ [0.0], finish_times ] ) )
+        travelled = np.minimum( speeds[np.newaxis,:]*times[:,np.newaxis], np.abs(distance)[np.newaxis,:] )
+        return start + np.sign(distance)*travelled
+
+    ################################################################################
+    def check_move(self, start : np.ndarray, targets : dict, speeds : Optional[np.ndarray] = None ) -> Tuple[bool, str]:
+        """
+        GeometryModel: checks a move of one or more axes before it is sent. The
+        move is rejected if any clearance falls below MINIMUM_CLEARANCE at any
+        point along the way. If a clearance is already too small at the start,
+        only moves that do not make it any smaller are allowed, so that it is
+        always possible to move out of trouble.
+
+        Parameters
+        ----------
+        start : np.ndarray
+            The current encoder positions
+        targets : dict
+            Dictionary of axis number -> encoder position
+        speeds : np.ndarray
+            Speed of each axis in steps per second (all the same if None)
+
+        Returns
+        -------
+        is_allowed : bool
+            True if the move can be sent
+        message : str
+            Why the move was rejected (empty if it is allowed)
+        """
+        if len(self.b) == 0:
+            return True, ""
+
+        start = np.asarray( start, dtype=float )
+        end = start.copy()
+        for axis, encoder in targets.items():
+            end[axis-1] = encoder
+
+        clearances = self.get_clearances( self.get_trajectory( start, end, speeds ) )
+        is_bad = ( clearances < MINIMUM_CLEARANCE ) & ( clearances < clearances[0] )
+        if not np.any(is_bad):
+            return True, ""
+
+        index = np.argmax( np.any( is_bad, axis=1 ) )
+        message = ", ".join( [ f"{self.names[k]} = {clearances[index,k]:.1f} mm" for k in np.nonzero( is_bad[index] )[0] ] )
+        return False, message
+
+    ################################################################################
+    def check_path(self, path : np.ndarray ) -> int:
+        """
+        GeometryModel: checks a planned sequence of positions that are visited in
+        turn (e.g. a scan), including the moves between them
+
+        Parameters
+        ----------
+        path : np.ndarray
+            (N, NUMBER_OF_MOTOR_AXES) encoder positions
+
+        Returns
+        -------
+        index : int
+            The index of the first position that cannot be reached safely from
+            the one before, or -1 if the whole path is safe
+        """
+        path = np.asarray( path, dtype=float )
+        if len(self.b) == 0 or len(path) == 0:
+            return -1
+
+        # Check the points themselves
+        is_point_safe = self.is_safe(path)
+        if not np.all(is_point_safe):
+            return int( np.argmin(is_point_safe) )
+        if len(path) == 1:
+            return -1
+
+        # The clearances are linear, so the worst point of each segment is at one
+        # of its breakpoints (where each axis finishes moving). Get them all at
+        # once with shape (segment, breakpoint, axis)
+        speeds = np.full( path.shape[1], dssp.DEFAULT_SLEW_SPEED )
+        distance = np.diff( path, axis=0 )
+        finish_times = np.abs(distance)/speeds
+        travelled = np.minimum( speeds[np.newaxis,np.newaxis,:]*finish_times[:,:,np.newaxis], np.abs(distance)[:,np.newaxis,:] )
+        breakpoints = path[:-1,np.newaxis,:] + np.sign(distance)[:,np.newaxis,:]*travelled
+
+        is_segment_safe = np.all( self.is_safe(breakpoints), axis=1 )
+        if np.all(is_segment_safe):
+            return -1
+        return int( np.argmin(is_segment_safe) ) + 1
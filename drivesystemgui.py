@@ -25,6 +25,10 @@ import drivesysteminbeamelementselector
 import drivesystemdetectoridmapping
 import drivesystemplotview as dspv
 import drivesystemguimotorinfo as dsgmi
+import drivesystemsequence as dsseq
+import drivesystemmailbox as dsmailbox
+import drivesystemevents as dsevents
+import drivesystemframerate as dsframerate
 
 ARRAY_IS_UPSTREAM = True # This should be converted to an option at some point
 
@@ -329,6 +333,33 @@ class BeamView(dspv.PlotView):
         """
         # NOTHING TO DO HERE!
         pass
+
+    ################################################################################
+    def get_moving_artists(self) -> list:
+        """
+        BeamView: The target ladder and beam blocker (with their position text),
+        and the in-beam element view drawn on top of them
+        """
+        artists = [ self.inset_axes_target_ladder, self.text_target_ladder_position, self.ax_inset_inbeamelement ]
+        if dsopts.OPTION_IS_BEAM_BLOCKER_ENABLED.get_value():
+            artists += [ self.inset_axes_beam_blocker, self.text_beam_blocker_position ]
+        return artists
+
+    ################################################################################
+    def get_state(self, pos : list) -> tuple:
+        """
+        BeamView: The positions of the target ladder and beam blocker axes, the
+        element in the beam, and which insets are shown (a hidden inset is not
+        moved, so it has to be updated when it is shown again)
+        """
+        insets = [ self.inset_axes_target_ladder, self.ax_inset_inbeamelement ]
+        names = ['TLH', 'TLV']
+        if dsopts.OPTION_IS_BEAM_BLOCKER_ENABLED.get_value():
+            insets.append( self.inset_axes_beam_blocker )
+            names += ['BBH', 'BBV']
+        positions = tuple( int( pos[ dsmi.MOTOR_AXIS_DICT[name].axis_number - 1 ] ) for name in names )
+        visibilities = tuple( inset.get_visible() for inset in insets )
+        return positions + ( DriveSystem.get_instance().get_in_beam_element(), ) + visibilities
         
     ################################################################################
     def show_target_ladder(self):
@@ -336,6 +367,8 @@ class BeamView(dspv.PlotView):
         BeamView: Enables the display of the target ladder
         """
         self.inset_axes_target_ladder.set_visible(True)
+        self.invalidate_background()
+        self.update_positions(self.last_positions)
         self.draw_canvas()
     
     ################################################################################
@@ -344,6 +377,8 @@ class BeamView(dspv.PlotView):
         BeamView: Disables the display of the target ladder
         """
         self.inset_axes_target_ladder.set_visible(False)
+        self.invalidate_background()
+        self.update_positions(self.last_positions)
         self.draw_canvas()
     
     ################################################################################
@@ -352,6 +387,8 @@ class BeamView(dspv.PlotView):
         BeamView: Enables the display of the beam blocker
         """
         self.inset_axes_beam_blocker.set_visible(True)
+        self.invalidate_background()
+        self.update_positions(self.last_positions)
     
     ################################################################################
     def hide_beam_blocker(self):
@@ -359,6 +396,8 @@ class BeamView(dspv.PlotView):
         BeamView: Disables the display of the beam blocker
         """
         self.inset_axes_beam_blocker.set_visible(False)
+        self.invalidate_background()
+        self.update_positions(self.last_positions)
 
     ################################################################################
     def show_inbeamelementview(self):
@@ -366,6 +405,7 @@ class BeamView(dspv.PlotView):
         TODO
         """
         self.ax_inset_inbeamelement.set_visible(True)
+        self.invalidate_background()
         for circle in self.inbeamelement_circles:
             circle.set_visible(True)
         self.inbeamelement_horzline.set_visible(True)
@@ -398,6 +438,7 @@ class BeamView(dspv.PlotView):
         TODO
         """
         self.ax_inset_inbeamelement.set_visible(False)
+        self.invalidate_background()
         for circle in self.inbeamelement_circles:
             circle.set_visible(False)
         self.inbeamelement_horzline.set_visible(False)
@@ -682,7 +723,7 @@ class DriveView(dspv.PlotView):
             self.ax.add_patch(self.circle_si_recoil) # Si recoil circle
         if pvp_draw_beam_blocker:
             self.ax.add_patch( self.rectangle_BBH ) # Beam blocker
-            self.line_BBH_soft_limit = plt.plot([ self.beam_blocker_soft_limit, self.beam_blocker_soft_limit ], [-1.1*(dsmi.MOTOR_AXIS_DICT['TaC'].height/2), 1.1*(dsmi.MOTOR_AXIS_DICT['TaC'].height/2)], linestyle='dashed', color='black', linewidth=1)
+            self.line_BBH_soft_limit = self.ax.plot([ self.beam_blocker_soft_limit, self.beam_blocker_soft_limit ], [-1.1*(dsmi.MOTOR_AXIS_DICT['TaC'].height/2), 1.1*(dsmi.MOTOR_AXIS_DICT['TaC'].height/2)], linestyle='dashed', color='black', linewidth=1)
             self.text_BBH = self.ax.text( self.beam_blocker_soft_limit, 1.1*(dsmi.MOTOR_AXIS_DICT['TaC'].height/2) + 20, "BBSL", color='#000000', ha='center' )
 
         # Define list of arrows
@@ -854,6 +895,27 @@ class DriveView(dspv.PlotView):
         # NOTHING TO DO HERE!
         pass
 
+    ################################################################################
+    def get_moving_artists(self) -> list:
+        """
+        DriveView: Everything on the axis that moves or changes with the positions.
+        All the shapes and lines are included so they still overlap in the order
+        they were added, along with the arrows and text that follow them.
+        """
+        arrows = [ artist for arrow in self.arrowdict.values() for artist in [ arrow.left_arrow, arrow.right_arrow, arrow.double_arrow, arrow.text ] if artist is not None ]
+        position_texts = [ pos_text.text_object for pos_text in self.position_text_dict.values() if pos_text.text_object is not None ]
+        labels = [ self.text_axis_1_label, self.text_axis_2_label, self.text_axis_3_label, self.text_axis_4_label, self.text_fc_label, self.text_zd_label ]
+        return list( self.ax.patches ) + list( self.ax.lines ) + arrows + position_texts + labels
+
+    ################################################################################
+    def get_state(self, pos : list) -> tuple:
+        """
+        DriveView: The positions of the trolley, array, target ladder (horizontal)
+        and FC/ZD axes, and of axes 1-4 which are written at the top
+        """
+        axes = set( range(4) ) | { dsmi.MOTOR_AXIS_DICT[name].axis_number - 1 for name in ['TaC', 'ArC', 'TLH', 'Det'] }
+        return tuple( int( pos[i] ) for i in sorted(axes) )
+
 ################################################################################
 ################################################################################
 ################################################################################
@@ -1076,6 +1138,9 @@ class ControlView(wx.Panel):
         # Get the instance of the GUI so that commands can be sent to it from buttons defined in the ControlView panel
         self.drive_system_gui = drive_system_gui
 
+        # Sequence file currently running (if any)
+        self.sequence_runner = None
+
         # Call parent constructor and set options
         wx.Panel.__init__(self, parent, size=(drive_system_gui_width, controlview_height), pos=(0,0))
         self.SetBackgroundColour(drivesystem_window_background_colour())
@@ -1285,8 +1350,15 @@ class ControlView(wx.Panel):
     def button_func_send_command(self,event):
         """
         ControlView: Function triggered by button_send_command to send command to 
-        the DriveSystem serial interface object
+        the DriveSystem serial interface object. Sequence files are run with
+        'run <file>'
         """
+        # Run a sequence file
+        text = self.textctrl_command_input.GetValue().strip()
+        if text.lower().startswith('run '):
+            self.start_sequence( text[4:].strip() )
+            return
+
         # Construct command
         command = self.drive_system.construct_command_from_str( self.textctrl_command_input.GetValue() )
         
@@ -1360,8 +1432,10 @@ class ControlView(wx.Panel):
     def button_func_abort_all(self,event):
         """
         ControlView: Function triggered by button_abort_all that aborts all the
-        motor axes
+        motor axes (and stops any sequence file that is running)
         """
+        if self.sequence_runner is not None:
+            self.sequence_runner.kill()
         self.drive_system.abort_all()
 
     ################################################################################
@@ -1376,14 +1450,16 @@ class ControlView(wx.Panel):
     def button_func_slit_scan(self,event):
         """
         ControlView: Function triggered by button_scan_slit that pops open a menu to
-        allow the selection of a horizontal or vertical scan.
+        allow the selection of a horizontal, vertical, or 2D raster scan.
         """
         menu = wx.Menu()
         horz_scan = menu.Append(wx.ID_ANY, "Horizontal scan (using vertical slit)")
         vert_scan = menu.Append(wx.ID_ANY, "Vertical scan (using horizontal slit)")
+        raster_scan = menu.Append(wx.ID_ANY, "2D raster scan (around selected element)")
         
         self.Bind(wx.EVT_MENU, lambda evt: self.start_slit_scan(True), horz_scan)
         self.Bind(wx.EVT_MENU, lambda evt: self.start_slit_scan(False), vert_scan)
+        self.Bind(wx.EVT_MENU, lambda evt: self.start_raster_scan(), raster_scan)
 
         self.PopupMenu(menu)
         menu.Destroy()
@@ -1395,12 +1471,57 @@ class ControlView(wx.Panel):
         t.start()
         return
     
+    ################################################################################
+    def start_raster_scan(self):
+        t = threading.Thread( target=self.drive_system.raster_scan_launch_threads )
+        t.start()
+        return
+    
+    ################################################################################
+    def start_sequence(self, path : str ):
+        """
+        ControlView: compiles a sequence file and runs it in another thread (see 
+        drivesystemsequence.py)
+        """
+        if self.sequence_runner is not None and self.sequence_thread.is_alive():
+            print("A sequence is already running. Press ABORT ALL to stop it.")
+            return
+        
+        steps = dsseq.compile_sequence_file( self.drive_system, path )
+        if steps is None:
+            print(f"Sequence file {repr(path)} not run")
+            return
+        
+        print(f"Compiled {repr(path)} into {len(steps)} steps")
+        self.sequence_runner = dsseq.SequenceRunner( self.drive_system, steps, lambda i, n, step : wx.CallAfter( self.textctrl_command_response.SetValue, f"Sequence step {i+1}/{n}" ) )
+        self.sequence_thread = threading.Thread( target=self.sequence_runner.run )
+        self.sequence_thread.start()
+        return
+
     ################################################################################
     def kill_slit_scan(self,event):
         print('======= SLIT SCANNING KILLED ========')
         self.drive_system.kill_slit_scan()
         return
 
+    ################################################################################
+    def show_slit_scan_running(self, is_scanning : bool ):
+        """
+        ControlView: Turns the slit-scan button into a button to stop the scan
+        while one is running, and back again once it stops
+        """
+        if not hasattr( self, 'button_slit_scan' ):
+            return
+        if is_scanning:
+            self.button_slit_scan.SetBackgroundColour('#FF0000')
+            self.button_slit_scan.SetLabelText('STOP SCAN')
+            self.button_slit_scan.Bind( wx.EVT_BUTTON, self.kill_slit_scan )
+        else:
+            self.button_slit_scan.SetBackgroundColour(controlview_slit_scan_button_colour)
+            self.button_slit_scan.SetLabelText('SLIT SCAN')
+            self.button_slit_scan.Bind( wx.EVT_BUTTON, self.button_func_slit_scan )
+        return
+
     ################################################################################
     def refresh(self):
         """
@@ -1450,19 +1571,24 @@ class DriveSystemGUI(wx.Frame):
         # Initialise UI
         self.init_ui()
 
+        # Only the newest positions are drawn, however far behind the GUI thread gets,
+        # and no more often than the governor allows
+        self.frame_rate_governor = dsframerate.FrameRateGovernor.from_options()
+        self.position_mailbox = dsmailbox.LatestValueMailbox( self.draw_positions, self.schedule_frame )
+
         # Place self at centre of the display
         self.Centre()
 
         # Raise it to the top of the windows
         self.Raise()
 
-        # Create a thread to keep the GUI running
+        # Update the GUI whenever the DriveSystem publishes a change (starting from the current state)
         self._drivesystem = DriveSystem.get_instance()
-        self.gui_refresh_timer = threading.Event()
-        self.is_gui_running = True
-        self.UPDATE_TIME = 0.5
-        self.thread = threading.Thread( target=self.refresh_gui_thread )
-        self.thread.start()
+        self.subscriptions = [
+            self._drivesystem.events.subscribe( lambda event : self.update_positions( event.positions ), dsevents.PositionsEvent ),
+            self._drivesystem.events.subscribe( lambda event : wx.CallAfter( self.controlview.show_slit_scan_running, event.is_scanning ), dsevents.ScanEvent ),
+            self._drivesystem.events.subscribe( lambda event : self.update_paused_axis( event.axis, event.is_paused ), dsevents.AxisPausedEvent ),
+        ]
 
     ################################################################################
     def init_ui(self):
@@ -1479,12 +1605,14 @@ class DriveSystemGUI(wx.Frame):
     ################################################################################
     def close_program(self, event):
         """
-        DriveSystemGUI: This closes the GUI and kills the background thread
+        DriveSystemGUI: This closes the GUI and stops listening to the DriveSystem
         """
         print("Exiting GUI...")
 
-        # Tell thread to stop doing things to the GUI
-        self.is_gui_running = False
+        # Stop doing things to the GUI
+        for subscription in self.subscriptions:
+            self._drivesystem.events.unsubscribe( subscription )
+        self.frame_rate_governor.print_counters()
         
         # Close all top level windows
         for item in wx.GetTopLevelWindows():
@@ -1496,43 +1624,30 @@ class DriveSystemGUI(wx.Frame):
 
     ################################################################################
     def update_positions(self, pos : list):
-        # CallAfter forces the main thread to do this!
-        wx.CallAfter( self.posvispanel.update_positions, pos )
+        # The mailbox uses CallAfter to force the main thread to do this, but never
+        # queues more than one update
+        self.position_mailbox.post( pos )
 
     ################################################################################
-    def update_paused_axis( self, axis : int, is_paused : bool):
-        wx.CallAfter( self.show_or_hide_pause_panel, args=(axis, is_paused) )
+    def schedule_frame(self, callback):
+        # CallAfter forces the main thread to do this, waiting until the governor
+        # allows the next frame
+        delay = self.frame_rate_governor.time_until_next_frame()
+        if delay > 0:
+            wx.CallAfter( wx.CallLater, int( np.ceil( delay*1000 ) ), callback )
+        else:
+            wx.CallAfter( callback )
 
     ################################################################################
-    def refresh_gui_thread(self):
-        slit_scan_button_change_to_stop = False
-        while self.is_gui_running:
-            # Get current time
-            t = time.time()
-
-            # Get positions
-            pos = self._drivesystem.get_positions()
+    def draw_positions(self, pos : list):
+        # Called on the main thread by the mailbox, timing how long drawing takes
+        with self.frame_rate_governor.frame():
+            self.posvispanel.update_positions( pos )
 
-            # Ask to update the positions on the GUI
-            wx.CallAfter( self.update_positions, pos )
-
-            # Check if slit scan is happening and change button
-            if self._drivesystem.is_slit_scanning and slit_scan_button_change_to_stop == False:
-                slit_scan_button_change_to_stop = True
-                self.controlview.button_slit_scan.SetBackgroundColour('#FF0000')
-                self.controlview.button_slit_scan.SetLabelText('STOP SCAN')
-                self.controlview.button_slit_scan.Bind( wx.EVT_BUTTON, self.controlview.kill_slit_scan )
-            
-            if self._drivesystem.is_slit_scanning == False and slit_scan_button_change_to_stop:
-                self.controlview.button_slit_scan.SetBackgroundColour(controlview_slit_scan_button_colour)
-                self.controlview.button_slit_scan.SetLabelText('SLIT SCAN')
-                self.controlview.button_slit_scan.Bind( wx.EVT_BUTTON, self.controlview.button_func_slit_scan )
-
-            # Calculate elapsed time
-            time_elapsed = time.time() - t
-
-            # Sleep for remaining time
-            self.gui_refresh_timer.wait( np.max([self.UPDATE_TIME - time_elapsed, 0 ]) )
+    ################################################################################
+    def update_paused_axis( self, axis : int, is_paused : bool):
+        # CallAfter forces the main thread to do this!
+        wx.CallAfter( self.controlview.show_or_hide_pause_panel, (axis, is_paused) )
 
 
 
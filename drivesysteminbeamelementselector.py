@@ -495,50 +495,53 @@ class MoveMotorPanel( wx.Panel ):
         format_button_deselected( self.button_move )
         self.in_beam_element_selection_panel.change_selected_item(None, None)
 
-        # Check whether we are moving in 2D or not
-
-        # Tell motors to move with move absolute commands - access motor axes by name, and the ordering is horizontal, then vertical
+        # Tell motors to move together - access motor axes by name, and the ordering is horizontal, then vertical
+        targets = {}
+        position = dsopts.AXIS_POSITION_DICT.get( str( globalpos ), None )
+        is_target_ladder = False
+        
         # Move 2D targets
         if re.search('[0-9].[0-9].[0-9]', str(globalpos)):
             print('TARGET: ' + str(globalpos))
-            self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['TLH'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][0] )
-            if dsopts.OPTION_TARGET_LADDER_DIMENSION.get_value() == 2:
-                self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['TLV'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][1] )
+            is_target_ladder = True
 
         # Move alpha source
         elif re.search('alpha', str(globalpos)):
             print('ALPHA SOURCE: ' + str(globalpos))
-            self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['TLH'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][0] )
-            if dsopts.OPTION_TARGET_LADDER_DIMENSION.get_value() == 2:
-                self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['TLV'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][1] )
+            is_target_ladder = True
         
         # Move slits/apertures
         elif re.search('[a-zA-Z]_slit',str(globalpos)) or re.search('[a-zA-Z]_aperture',str(globalpos)):
             print('SLIT/APERTURES: ' + str(globalpos))
-            self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['TLH'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][0] )
-            if dsopts.OPTION_TARGET_LADDER_DIMENSION.get_value() == 2:
-                self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['TLV'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][1] )
+            is_target_ladder = True
         
         # Move beam blocker
         elif re.search('bb.*',str(globalpos)): # beam blocker
-            self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['BBH'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][0] )
-            self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['BBV'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][1] )
+            targets[ dsmi.MOTOR_AXIS_DICT['BBH'].axis_number ] = position[0]
+            targets[ dsmi.MOTOR_AXIS_DICT['BBV'].axis_number ] = position[1]
 
         # Move beam monitoring detectors
         elif re.search('bm.*',str(globalpos)): # beam monitor
-            self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['Det'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][0] )
+            targets[ dsmi.MOTOR_AXIS_DICT['Det'].axis_number ] = position[0]
 
         # Move tritium targets
         elif re.search('ti_target[0-9]', str(globalpos)):
             print('Ti TARGET: ' + str(globalpos))
-            self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['TLH'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][0] )
-            if dsopts.OPTION_TARGET_LADDER_DIMENSION.get_value() == 2:
-                self.drive_system.move_absolute( dsmi.MOTOR_AXIS_DICT['TLV'].axis_number, dsopts.AXIS_POSITION_DICT[ str( globalpos ) ][1] )
+            is_target_ladder = True
         
         # Tell user their selected action didn't work
         else:
             print("Wasn't able to move - I don't recognise the element...")
 
+        # Target ladder moves horizontally, and vertically if it is 2D
+        if is_target_ladder:
+            targets[ dsmi.MOTOR_AXIS_DICT['TLH'].axis_number ] = position[0]
+            if dsopts.OPTION_TARGET_LADDER_DIMENSION.get_value() == 2:
+                targets[ dsmi.MOTOR_AXIS_DICT['TLV'].axis_number ] = position[1]
+
+        if len(targets) > 0:
+            self.drive_system.move_group( targets )
+
         # Regardless, store the element
         self.drive_system.set_in_beam_element( str(globalpos) )
         
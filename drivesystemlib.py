@@ -24,6 +24,12 @@ import drivesystemoptions as dsopts
 import serialinterface
 import drivesystemdetectoridmapping as dsdidmap
 import drivesystemmotorinfo as dsmi
+import drivesystemscanpath as dssp
+import drivesystemscanlog as dsscanlog
+import drivesystemgeometry as dsgeom
+import drivesystemratelimit as dsratelimit
+import drivesystemclock as dsclock
+import drivesystemevents as dsevents
 
 ################################################################################
 # Kill warnings about pushing to Grafana
@@ -142,6 +148,10 @@ class DriveSystem(serialinterface.SerialInterface):
         # Use parent constructor
         super().__init__(dsopts.CMD_LINE_ARG_SERIAL_PORT.get_value())
 
+        # Changes (new positions, scans starting and stopping...) are published here
+        self.events = dsevents.EventBus()
+        self.last_connection_state = None
+
         # Store positions and axis names for Grafana
         self.positions = np.zeros( NUMBER_OF_MOTOR_AXES, dtype=int )
         self.grafana_axis_name = dsmi.get_motor_axis_dict_property_as_array('grafana_name')
@@ -153,18 +163,68 @@ class DriveSystem(serialinterface.SerialInterface):
         self.disabled_axes = dsopts.OPTION_DISABLED_AXES.get_value()
         self.paused_axes = [] # Stores any axes that need to be paused because of their duty cycle
         self.movement_commands = ['ma', 'mr', 'cv', 'hd', 'md'] # List of commands causing movement on a motor axis
-        self.duty_cycles = [
-            # dutycycle.DutyCycle( , )
-        ]
+        self.last_move_targets = {} # Stores the last encoder position each axis was sent to
+        self.duty_cycle_manager = drivesystemdutycycle.DutyCycleManager.from_options(self) # Fills paused_axes when a motor has been on for too long
+        self.duty_cycle_manager.add_pause_callback( self.publish_axis_paused )
         self.selected_in_beam_element = None # Use this to store ID of in beam element selected
+        self.geometry = dsgeom.GeometryModel( NUMBER_OF_MOTOR_AXES, STEP_TO_MM ) # Used to check moves will not make anything collide
+        self.rate_limiter = dsratelimit.CommandRateLimiter.from_options() # Stops the motor box being flooded with commands
 
         # Try and get authentication details for Grafana
         self.get_grafana_authentication()
 
         # Define a bool to be set to True while slit scanning
         self.is_slit_scanning = False
-        self.slit_scanning_check_encoder_position_timer = threading.Event()
-        self.slit_scanning_wait_at_position_timer = threading.Event()
+        self.slit_scanning_check_encoder_position_timer = dsclock.Event()
+        self.slit_scanning_wait_at_position_timer = dsclock.Event()
+        self.scan_polled_axes = [3,5] # Axes polled by the encoder thread while scanning
+        return
+
+    ################################################################################
+    @property
+    def is_slit_scanning(self) -> bool:
+        return self._is_slit_scanning
+
+    @is_slit_scanning.setter
+    def is_slit_scanning(self, is_slit_scanning : bool ) -> None:
+        # Tell everyone when a scan starts or stops
+        is_changed = getattr( self, '_is_slit_scanning', None ) != is_slit_scanning
+        self._is_slit_scanning = is_slit_scanning
+        if is_changed:
+            self.events.publish( dsevents.ScanEvent(is_slit_scanning) )
+
+    ################################################################################
+    def publish_positions(self, axes : list[int] ) -> None:
+        """
+        DriveSystem: publishes a snapshot of the positions after some axes have been
+        read
+
+        Parameters
+        ----------
+        axes : list[int]
+            The axes that were just read
+        """
+        self.events.publish( dsevents.PositionsEvent( self.positions.copy(), axes ) )
+        return
+
+    ################################################################################
+    def publish_connection_state(self, is_connected : bool ) -> None:
+        """
+        DriveSystem: publishes the state of the connection to the motor box if it
+        has changed since it was last published
+        """
+        if is_connected != self.last_connection_state:
+            self.last_connection_state = is_connected
+            self.events.publish( dsevents.ConnectionEvent(is_connected) )
+        return
+
+    ################################################################################
+    def publish_axis_paused(self, axis : int, is_paused : bool ) -> None:
+        """
+        DriveSystem: publishes an axis being paused or resumed by its duty cycle
+        (registered with the DutyCycleManager)
+        """
+        self.events.publish( dsevents.AxisPausedEvent( axis, is_paused ) )
         return
     
     ################################################################################
@@ -236,7 +296,7 @@ class DriveSystem(serialinterface.SerialInterface):
         num = None
         
         # Match pattern
-        pattern = re.match('([0-9]+)([a-z]+)([0-9]?)\r?', command )
+        pattern = re.match('([0-9]+)([a-z]+)(-?[0-9]*)\r?', command )
 
         # No matches
         if pattern == None:
@@ -300,12 +360,77 @@ class DriveSystem(serialinterface.SerialInterface):
         
         return True
 
+    ################################################################################
+    @staticmethod
+    def get_move_targets( decon_cmd_list : list ) -> dict:
+        """
+        DriveSystem: gets the encoder positions that a list of deconstructed
+        commands will move to (only 'ma' and 'mr' have a known target)
+
+        Parameters
+        ----------
+        decon_cmd_list : list
+            List of (axis, cmd, num) from deconstruct_command_from_str
+
+        Returns
+        -------
+        targets : dict
+            Dictionary of axis -> (cmd, num) for move commands
+        """
+        return { axis : (cmd, num) for axis, cmd, num in decon_cmd_list if cmd in ['ma', 'mr'] and axis != None and num != None }
+
+    ################################################################################
+    def get_absolute_targets( self, targets : dict ) -> dict:
+        """
+        DriveSystem: converts move targets into absolute encoder positions using
+        the current positions
+
+        Parameters
+        ----------
+        targets : dict
+            Dictionary of axis -> (cmd, num), where cmd is 'ma' or 'mr'
+
+        Returns
+        -------
+        absolute_targets : dict
+            Dictionary of axis -> encoder position
+        """
+        return { axis : num if cmd == 'ma' else int(self.positions[axis-1]) + num for axis, (cmd, num) in targets.items() }
+
+    ################################################################################
+    def check_geometry( self, targets : dict ) -> bool:
+        """
+        DriveSystem: checks that moving to the targets from the current position
+        will not bring any of the moving parts too close together (see 
+        drivesystemgeometry.py)
+
+        Parameters
+        ----------
+        targets : dict
+            Dictionary of axis -> (cmd, num), where cmd is 'ma' or 'mr'
+
+        Returns
+        -------
+        is_allowed : bool
+            True if the move can be sent
+        """
+        if len(targets) == 0:
+            return True
+        
+        absolute_targets = self.get_absolute_targets(targets)
+        is_allowed, message = self.geometry.check_move( self.positions, absolute_targets )
+        if not is_allowed:
+            print(f"Moving axes {list(absolute_targets.keys())} to {list(absolute_targets.values())} would bring parts too close together ({message}). Ignoring...")
+        return is_allowed
+
     ################################################################################
     def abort_all(self) -> None:
         """
         DriveSystem: Sends a command to abort all the motors
         """
         print( "Abort command on all axes")
+        self.last_move_targets.clear()
+        self.duty_cycle_manager.forget_resume_targets()
         in_cmd_list = []
         for i in range(1,NUMBER_OF_MOTOR_AXES+1):
             in_cmd_list.append( self.construct_command( i, 'ab' ) )
@@ -349,6 +474,8 @@ class DriveSystem(serialinterface.SerialInterface):
             The number of the axis to be aborted
         """
         in_cmd = self.construct_command( axis, 'ab' )
+        self.last_move_targets.pop( axis, None )
+        self.duty_cycle_manager.forget_resume_targets([axis])
         self.execute_command( in_cmd, False, True )
         return
 
@@ -368,6 +495,68 @@ class DriveSystem(serialinterface.SerialInterface):
         self.execute_command( in_cmd, False, True )
         return
 
+    ################################################################################
+    def move_group( self, targets : dict, print_output = True ) -> Optional['MoveGroup']:
+        """
+        DriveSystem: moves several axes to absolute encoder positions at the same
+        time. All of the targets are checked first, and if any of them cannot be
+        moved (disabled or paused axis, bad target) nothing is sent. Otherwise 
+        the move commands are sent back-to-back while holding the serial port
+        lock, so that the axes start within milliseconds of each other and no
+        other command can be sent in between.
+
+        Parameters
+        ----------
+        targets : dict
+            Dictionary of axis number -> encoder position
+        print_output : bool (default True)
+            Print the responses from the motor box
+
+        Returns
+        -------
+        move_group : MoveGroup
+            A handle that can be used to wait for all the axes to arrive, or None
+            if the move was rejected
+        """
+        # Validate everything before sending anything
+        checked_targets = {}
+        for axis, encoder in targets.items():
+            try:
+                axis = int(axis)
+                encoder = int(encoder)
+            except (ValueError, TypeError):
+                print(f"Cannot move axis {axis} to {encoder}. Ignoring move of axes {list(targets.keys())}")
+                return None
+            
+            if axis < 1 or axis > NUMBER_OF_MOTOR_AXES:
+                print(f"Axis {axis} does not exist. Ignoring move of axes {list(targets.keys())}")
+                return None
+            if axis in self.disabled_axes:
+                print(f"Movement on axis {axis} disabled. Ignoring move of axes {list(targets.keys())}")
+                return None
+            if axis in self.paused_axes:
+                print(f"Movement commands on axis {axis} are paused. Ignoring move of axes {list(targets.keys())}")
+                return None
+            checked_targets[axis] = encoder
+        
+        if len(checked_targets) == 0:
+            return None
+        
+        # Check the move will not make anything collide
+        if not self.check_geometry( { axis : ('ma', encoder) for axis, encoder in checked_targets.items() } ):
+            return None
+
+        # Send everything in one go
+        in_cmd_list = [ self.construct_command( axis, 'ma', encoder ) for axis, encoder in checked_targets.items() ]
+        self.rate_limiter.acquire( [ (axis, 'ma', encoder) for axis, encoder in checked_targets.items() ] )
+        output_list = self.serial_port_write_read_pipelined( in_cmd_list, False )
+        self.last_move_targets.update(checked_targets)
+        if print_output:
+            for outputline in output_list:
+                print(outputline.strip('\n'))
+
+        return MoveGroup( self, checked_targets )
+
     ################################################################################
     # move relative
     def move_relative( self, axis : int, steps : int ) -> None:
@@ -473,7 +662,13 @@ class DriveSystem(serialinterface.SerialInterface):
                 print(f"Movement commands on axis {axis} are paused. Ignoring command {repr(in_cmd)}")
             return None, None
 
+        # Check the move will not make anything collide
+        elif not self.check_geometry( self.get_move_targets( [(axis, cmd, num)] ) ):
+            return None, None
+
         # Send the command to the motor box
+        self.rate_limiter.acquire( [(axis, cmd, num)] )
+        self.last_move_targets.update( self.get_absolute_targets( self.get_move_targets( [(axis, cmd, num)] ) ) )
         outputline = self.serial_port_write_read( in_cmd, False )
 
         # Format the command if desired
@@ -551,8 +746,18 @@ class DriveSystem(serialinterface.SerialInterface):
                     print(f"Movement commands on axis {in_cmd_decon_list[i][0]} are paused. Ignoring command {repr(in_cmd_list[i])}")
         
         # Filter the command list
-        in_cmd_list = [cmd for cmd, axis in zip(in_cmd_list, [ x[0] for x in in_cmd_decon_list ]) if axis not in self.disabled_axes ]
+        is_allowed = [ axis not in self.disabled_axes and not ( axis in self.paused_axes and cmd in self.movement_commands ) for axis, cmd, num in in_cmd_decon_list ]
+        in_cmd_list = [ x for x, allowed in zip(in_cmd_list, is_allowed) if allowed ]
+        in_cmd_decon_list = [ x for x, allowed in zip(in_cmd_decon_list, is_allowed) if allowed ]
+
+        # Check the moves in the batch will not make anything collide (together) - drop them all if they do
+        move_targets = self.get_move_targets( in_cmd_decon_list )
+        if not self.check_geometry( move_targets ):
+            in_cmd_list = [ cmd for cmd in in_cmd_list if self.deconstruct_command_from_str(cmd)[1] not in ['ma', 'mr'] ]
+            move_targets = {}
     
+        self.rate_limiter.acquire( [ self.deconstruct_command_from_str(x) for x in in_cmd_list ] )
+        self.last_move_targets.update( self.get_absolute_targets(move_targets) )
         output_list = self.serial_port_write_read_batch( in_cmd_list, False, False )
         if format_response:
             axis_list = []
@@ -633,8 +838,10 @@ class DriveSystem(serialinterface.SerialInterface):
         axis, answer = self.execute_command( in_cmd )
 
         if answer is not None:
-            self.positions[axis-1] = int( answer )
+            self.positions[int(axis)-1] = int( answer )
             self.send_to_influx( axis, int( answer ) )
+            self.duty_cycle_manager.observe_positions( [int(axis)], [int(answer)] )
+            self.publish_positions( [int(axis)] )
             return True
         else:
             return False
@@ -679,6 +886,10 @@ class DriveSystem(serialinterface.SerialInterface):
             else:
                 axis_can_be_read_list[i] =  False
         
+        read_axes = [ i+1 for i in range(0,len(axis_can_be_read_list)) if axis_can_be_read_list[i] ]
+        self.duty_cycle_manager.observe_positions( read_axes, [ int(self.positions[axis-1]) for axis in read_axes ] )
+        if len(read_axes) > 0:
+            self.publish_positions( read_axes )
         return axis_can_be_read_list
 
 
@@ -789,7 +1000,34 @@ class DriveSystem(serialinterface.SerialInterface):
     ################################################################################
     def slit_scan_launch_threads(self, is_horz_scan = True) -> None:
         """
-        TODO
+        DriveSystem: runs a slit scan (see slit_scan_steps) and blocks until it
+        is complete
+        """
+        self.scan_launch_threads( self.slit_scan_steps, is_horz_scan )
+        return
+
+    ################################################################################
+    def raster_scan_launch_threads(self) -> None:
+        """
+        DriveSystem: runs a 2-D raster scan of the target ladder (see
+        raster_scan_steps) and blocks until it is complete
+        """
+        self.scan_launch_threads( self.raster_scan_steps )
+        return
+
+    ################################################################################
+    def scan_launch_threads(self, scan_func, *args) -> None:
+        """
+        DriveSystem: prepares the target-ladder axes for a scan, runs scan_func
+        while another thread keeps the target-ladder encoder positions up to
+        date, and then restores normal operation
+
+        Parameters
+        ----------
+        scan_func : Callable
+            The function that moves the motors during the scan
+        args
+            Arguments passed to scan_func
         """
         # Check if we can do it if axes are disabled
         if 3 in self.disabled_axes or 5 in self.disabled_axes:
@@ -811,15 +1049,16 @@ class DriveSystem(serialinterface.SerialInterface):
 
         # Start a thread to check the encoder positions
         self.is_slit_scanning = True
+        self.scan_polled_axes = [3,5]
         check_encoder_pos_target_ladder_thread = threading.Thread( target=self.slit_scan_check_encoder_pos_target_ladder_thread_func )
-        check_encoder_pos_target_ladder_thread.start()
+        dsclock.get_clock().start_thread( check_encoder_pos_target_ladder_thread )
 
-        # Now run the script to move the motors on the horz/vert slit
-        self.slit_scan_steps(is_horz_scan)
+        # Now run the script to move the motors
+        scan_func(*args)
 
         # Stop the slit scan and scanning the encoder positions
         self.is_slit_scanning = False
-        check_encoder_pos_target_ladder_thread.join()
+        dsclock.get_clock().join_thread( check_encoder_pos_target_ladder_thread )
 
         # Resume the DriveSystemThread
         DriveSystemThread.get_instance().resume_thread()
@@ -828,32 +1067,60 @@ class DriveSystem(serialinterface.SerialInterface):
     ################################################################################
     def slit_scan_check_encoder_pos_target_ladder_thread_func(self) -> None:
         """
-        TODO
+        DriveSystem: polls the target-ladder encoder positions while a scan is
+        running
         """
         update_time = 0.2
+        clock = dsclock.get_clock()
         while self.is_slit_scanning:
-            t = time.time()
-            self.check_encoder_pos_batch([3,5])
-            elapsed_time = time.time() - t
-            self.slit_scanning_check_encoder_position_timer.wait( np.max([ update_time - elapsed_time, 0.0 ]) )
+            t = clock.monotonic()
+            if len(self.scan_polled_axes) > 0:
+                self.check_encoder_pos_batch(self.scan_polled_axes)
+            elapsed_time = clock.monotonic() - t
+            clock.wait( self.slit_scanning_check_encoder_position_timer, np.max([ update_time - elapsed_time, 0.0 ]) )
         return
 
 
+    ################################################################################
+    # Defaults for the options that can be set in the slit scan file
+    SCAN_FILE_DEFAULTS = {
+        'OFFSET_IN_MM' : 6.0,
+        'STEP_SIZE_IN_MM' : 0.1,
+        'WAIT_TIME_IN_SECONDS': 0.5,
+        'RASTER_H_OFFSET_IN_MM' : 2.0,
+        'RASTER_V_OFFSET_IN_MM' : 2.0,
+        'RASTER_H_STEP_SIZE_IN_MM' : 0.5,
+        'RASTER_V_STEP_SIZE_IN_MM' : 0.5,
+        'RASTER_ORDERING' : 'auto',
+        'SLEW_SPEED_IN_MM_PER_SECOND' : dssp.DEFAULT_SLEW_SPEED*STEP_TO_MM,
+        'SCAN_MODE' : 'step',
+        'FLY_SPEED_IN_MM_PER_SECOND' : 0.5,
+    }
+    SCAN_MODES = ['step', 'fly']
+
     ################################################################################
     @staticmethod
-    def slit_scan_read_file() -> tuple:
+    def scan_read_file( keys : list[str] ) -> dict:
         """
-        TODO
+        DriveSystem: reads the options for a scan from the file given by the
+        SlitScanOptionsFilePath option. Options are cast to the type of their
+        default value in SCAN_FILE_DEFAULTS.
+
+        Parameters
+        ----------
+        keys : list[str]
+            The options used by this scan - defaults are only reported for these
+
+        Returns
+        -------
+        options : dict
+            Dictionary of option -> value for every option in SCAN_FILE_DEFAULTS
         """
         # Check if file exists. Return defaults if it doesn't
         filepath = dsopts.OPTION_SLIT_SCAN_PARAMETER_FILE.get_value()
 
         # Defaults
-        mydict = {
-            'OFFSET_IN_MM' : [6, False],
-            'STEP_SIZE_IN_MM' : [0.1, False],
-            'WAIT_TIME_IN_SECONDS': [0.5,False]
-        }
+        mydict = { k : [v, False] for k, v in DriveSystem.SCAN_FILE_DEFAULTS.items() }
 
         try:
             with open( filepath, 'r') as file:
@@ -906,32 +1173,79 @@ class DriveSystem(serialinterface.SerialInterface):
 
                     # Store all found keys
                     try:
-                        mydict[key] = [ float(value), True ]
-                    except TypeError:
-                        print(f'SLIT SCAN OPTION: could not convert {value} to a float. Will use the defaul for item {key}...')
+                        mydict[key] = [ type(DriveSystem.SCAN_FILE_DEFAULTS[key])(value), True ]
+                    except ValueError:
+                        print(f'SLIT SCAN OPTION: could not convert {value} to a {type(DriveSystem.SCAN_FILE_DEFAULTS[key]).__name__}. Will use the default for item {key}...')
 
                 
-        except FileNotFoundError:
+        except (FileNotFoundError, TypeError):
             print(f"Cannot find slit scan parameters in file {repr(filepath)}. Using defaults...")
 
-        for k, v in mydict.items():
-            if v[1] == False:
-                print('SLIT SCAN OPTION WARNING: option not set for {k}. Using default...')
+        for k in keys:
+            if mydict[k][1] == False:
+                print(f'SLIT SCAN OPTION WARNING: option not set for {k}. Using default...')
 
-        offset_in_mm = mydict['OFFSET_IN_MM'][0]
-        step_size_in_mm = mydict['STEP_SIZE_IN_MM'][0]
-        wait_time_in_seconds = mydict['WAIT_TIME_IN_SECONDS'][0]
-        
-        return (offset_in_mm, step_size_in_mm, wait_time_in_seconds)
+        return { k : v[0] for k, v in mydict.items() }
+
+    ################################################################################
+    @staticmethod
+    def slit_scan_read_file() -> dict:
+        """
+        DriveSystem: reads the parameters for a 1-D slit scan from the slit scan
+        file
+
+        Returns
+        -------
+        options : dict
+            Dictionary of option -> value (see SCAN_FILE_DEFAULTS)
+        """
+        mydict = DriveSystem.scan_read_file( [
+            'OFFSET_IN_MM', 'STEP_SIZE_IN_MM', 'WAIT_TIME_IN_SECONDS', 'SCAN_MODE',
+            'FLY_SPEED_IN_MM_PER_SECOND', 'SLEW_SPEED_IN_MM_PER_SECOND'
+        ] )
+
+        mydict['SCAN_MODE'] = mydict['SCAN_MODE'].lower()
+        if mydict['SCAN_MODE'] not in DriveSystem.SCAN_MODES:
+            print(f"SLIT SCAN OPTION: unknown scan mode {repr(mydict['SCAN_MODE'])} - should be one of {', '.join(DriveSystem.SCAN_MODES)}. Using step...")
+            mydict['SCAN_MODE'] = 'step'
+
+        DriveSystem.scan_check_speeds( mydict, ['FLY_SPEED_IN_MM_PER_SECOND', 'SLEW_SPEED_IN_MM_PER_SECOND'] )
+        return mydict
+
+    ################################################################################
+    @staticmethod
+    def scan_check_speeds( mydict : dict, keys : list[str] ) -> None:
+        """
+        DriveSystem: replaces any speed read from the scan file that is slower than
+        one step per second (which the motor box would be sent as a speed of 0)
+        with its default in SCAN_FILE_DEFAULTS
+
+        Parameters
+        ----------
+        mydict : dict
+            Dictionary of option -> value from scan_read_file(), changed in place
+        keys : list[str]
+            The speeds in mm/s to check
+        """
+        for key in keys:
+            if not mydict[key] >= STEP_TO_MM:
+                print(f"SLIT SCAN OPTION: {key} = {mydict[key]} is slower than one step per second ({STEP_TO_MM} mm/s). Using the default of {DriveSystem.SCAN_FILE_DEFAULTS[key]}...")
+                mydict[key] = DriveSystem.SCAN_FILE_DEFAULTS[key]
+        return
 
 
     ################################################################################
     def slit_scan_steps(self, is_horz_scan = True) -> None:
         """
-        TODO
+        DriveSystem: scans the target ladder across the vertical slit (horizontal
+        scan) or the horizontal slit (vertical scan), either waiting at each point
+        (step mode) or moving continuously while sampling the encoder (fly mode)
         """
         # Get information from file
-        offset_in_mm, step_size_in_mm, wait_time_in_seconds = self.slit_scan_read_file()
+        mydict = self.slit_scan_read_file()
+        offset_in_mm = mydict['OFFSET_IN_MM']
+        step_size_in_mm = mydict['STEP_SIZE_IN_MM']
+        wait_time_in_seconds = mydict['WAIT_TIME_IN_SECONDS']
 
         # Set the slit as the focused element
         if is_horz_scan:
@@ -963,13 +1277,9 @@ class DriveSystem(serialinterface.SerialInterface):
         number_of_values = int( np.abs( (start_position - end_position)/step_size ) + 1 )
         encoder_positions = np.linspace( start_position, end_position, number_of_values, dtype=int )
 
-        # Move to right place on axis we're not wanting to move during operation
-        cmd_on_axis_that_wont_move = self.construct_command(other_axis, 'ma', middle[(axis_index + 1) % 2] )
-        self.execute_command(cmd_on_axis_that_wont_move)
-
-        # Move to starting position on axis we will move during operation
-        cmd_on_axis_that_will_move = self.construct_command(axis_to_move, 'ma', encoder_positions[0] )
-        self.execute_command(cmd_on_axis_that_will_move)
+        # Move to right place on axis we're not wanting to move during operation,
+        # and to the starting position on the axis we will move
+        self.move_group( { other_axis : middle[(axis_index + 1) % 2], axis_to_move : encoder_positions[0] } )
 
         # Check we make it to the starting position to begin slit scanning
         ctr_wont_move = 0
@@ -1007,43 +1317,386 @@ class DriveSystem(serialinterface.SerialInterface):
                 return
 
             # Sleep if we've not made it yet
-            time.sleep(0.2)
+            dsclock.get_clock().sleep(0.2)
+
+        # Open a file to record the results of the scan
+        scan_log = dsscanlog.ScanResultWriter( f'slit_scan_{slit_name}', {
+            'slit' : slit_name,
+            'scanned_axis' : axis_to_move,
+            'slit_centre_encoder' : middle[axis_index],
+            'fixed_axis' : other_axis,
+            'fixed_axis_encoder' : middle[(axis_index + 1) % 2],
+            'offset_in_mm' : offset_in_mm,
+            'step_size_in_mm' : step_size_in_mm,
+            'wait_time_in_seconds' : wait_time_in_seconds,
+            'scan_mode' : mydict['SCAN_MODE'],
+            'fly_speed_in_mm_per_second' : mydict['FLY_SPEED_IN_MM_PER_SECOND'],
+        } )
+
+        # Fly scan - move to the other end in one go while sampling
+        if mydict['SCAN_MODE'] == 'fly':
+            print('===== SLIT FLY SCANNING IN PROGRESS =====')
+            try:
+                is_complete = self.slit_scan_fly( axis_to_move, encoder_positions[-1], mydict['FLY_SPEED_IN_MM_PER_SECOND'], mydict['SLEW_SPEED_IN_MM_PER_SECOND'], scan_log )
+            finally:
+                scan_log.close()
+            if is_complete:
+                print('====== SLIT FLY SCANNING COMPLETE =======')
+            return
 
         # Now start visiting all the places
         print('===== SLIT SCANNING IN PROGRESS =====')
-        for i in range(0,len(encoder_positions)):
-            if self.is_slit_scanning:
-                cmd = self.construct_command(axis_to_move, 'ma', encoder_positions[i] )
-                self.execute_command(cmd)
-                ctr = 0
-
-                # While loop to try and move to the position for the next scan
-                while True:
-                    if self.positions[axis_to_move-1] != encoder_positions[i] or self.positions[other_axis-1] != middle[(axis_index + 1) % 2]:
-                        time.sleep(0.1)
-                        ctr += 1
-                        if ctr % 5 == 0:
-                            # Tell the user we're trying to move and re-issue the command
-                            print(f'Trying to move to {slit_name} {self.slit_scan_offset_string(encoder_positions[i], middle[axis_index])}')
-                            self.execute_command(cmd)
-                        if ctr > 50:
-                            print("Cannot complete slit scan as nothing is moving (did you abort a motor?). Stopping...")
-                            print('======= SLIT SCANNING FAILED ========')
-                            self.kill_slit_scan()
-                            return
-                    else:
-                        break
-                
-                # Now do the scan = sitting and doing nothing
-                print(f'Moved to {slit_name} {self.slit_scan_offset_string(encoder_positions[i], middle[axis_index])}')
-                self.slit_scanning_wait_at_position_timer.wait(wait_time_in_seconds)
-            else:
-                # Essentially exit this function if someone kills the slit scan
-                return
+        try:
+            for i in range(0,len(encoder_positions)):
+                if self.is_slit_scanning:
+                    # Try and move to the position for the next scan
+                    targets = { axis_to_move : encoder_positions[i], other_axis : middle[(axis_index + 1) % 2] }
+                    arrived, retries = self.scan_move_to_point( targets, [axis_to_move], f'{slit_name} {self.slit_scan_offset_string(encoder_positions[i], middle[axis_index])}' )
+                    if not arrived:
+                        return
+                    [measured_encoder], arrival = self.scan_read_encoders( [axis_to_move] )
+                    
+                    # Now do the scan = sitting and doing nothing
+                    print(f'Moved to {slit_name} {self.slit_scan_offset_string(encoder_positions[i], middle[axis_index])}')
+                    dsclock.get_clock().wait( self.slit_scanning_wait_at_position_timer, wait_time_in_seconds )
+                    [departure_encoder], departure = self.scan_read_encoders( [axis_to_move] )
+                    scan_log.write_point( i, axis_to_move, encoder_positions[i], measured_encoder, arrival, departure, retries, departure_encoder )
+                else:
+                    # Essentially exit this function if someone kills the slit scan
+                    return
+        finally:
+            scan_log.close()
         
         print('====== SLIT SCANNING COMPLETE =======')
 
         return
+
+    ################################################################################
+    def slit_scan_fly(self, axis : int, end_encoder : int, fly_speed_in_mm_per_second : float, slew_speed_in_mm_per_second : float, scan_log : 'dsscanlog.ScanResultWriter' ) -> bool:
+        """
+        DriveSystem: moves an axis continuously to the end of a fly scan at a
+        reduced speed, sampling its encoder position as quickly as the serial
+        port allows. The other target-ladder axis is not polled while this is
+        happening. The speed of the axis is read from the motor box first, and
+        restored afterwards.
+
+        Parameters
+        ----------
+        axis : int
+            The target-ladder axis to move (3 or 5)
+        end_encoder : int
+            The encoder position at the end of the scan
+        fly_speed_in_mm_per_second : float
+            The speed to move at during the scan
+        slew_speed_in_mm_per_second : float
+            The speed to restore afterwards if it cannot be read from the motor box
+        scan_log : dsscanlog.ScanResultWriter
+            Where the samples are written
+
+        Returns
+        -------
+        is_complete : bool
+            True if the axis reached the end of the scan
+        """
+        # Allow twice the expected time (plus a bit) before giving up
+        distance_in_mm = np.abs( end_encoder - self.positions[axis-1] )*STEP_TO_MM
+        timeout = 2*distance_in_mm/fly_speed_in_mm_per_second + 5.0
+        
+        self.scan_polled_axes = []
+        slew_speed = self.read_slew_speed(axis)
+        if slew_speed is None:
+            slew_speed = int( slew_speed_in_mm_per_second*MM_TO_STEP )
+            print(f"Could not read the slew speed of axis {axis} from the motor box. It will be set to {slew_speed} steps/s after the scan")
+        self.execute_command( self.construct_command( axis, 'sv', int( fly_speed_in_mm_per_second*MM_TO_STEP ) ) )
+        try:
+            self.execute_command( self.construct_command( axis, 'ma', end_encoder ) )
+            clock = dsclock.get_clock()
+            t_start = clock.monotonic()
+            sample_index = 0
+            while self.is_slit_scanning:
+                # The sample time is taken halfway through the request
+                before = dsscanlog.timestamp()
+                axis_str, answer = self.execute_command( self.construct_command( axis, 'oa' ) )
+                after = dsscanlog.timestamp()
+                if answer is not None:
+                    encoder = int(answer)
+                    self.positions[axis-1] = encoder
+                    self.duty_cycle_manager.observe_positions( [axis], [encoder] ) # Nothing else polls the axis during the scan
+                    self.publish_positions( [axis] )
+
+                    scan_log.write_sample( sample_index, axis, end_encoder, encoder, ( (before[0] + after[0])/2, (before[1] + after[1])/2 ) )
+                    sample_index += 1
+
+                    if encoder == end_encoder:
+                        return True
+
+                # The duty cycle manager has stopped the axis, and will finish the move once it has rested
+                if axis in self.paused_axes:
+                    print(f"Cannot complete fly scan as axis {axis} has been paused by its duty cycle. Stopping...")
+                    print('======= SLIT SCANNING FAILED ========')
+                    self.kill_slit_scan()
+                    return False
+
+                if clock.monotonic() - t_start > timeout:
+                    print("Cannot complete fly scan as the axis did not reach the end in time (did you abort a motor?). Stopping...")
+                    print('======= SLIT SCANNING FAILED ========')
+                    self.kill_slit_scan()
+                    return False
+        finally:
+            # Stop the axis if the scan was killed and put everything back as it was
+            if self.positions[axis-1] != end_encoder and axis not in self.paused_axes:
+                self.abort_axis(axis)
+                self.reset_axis(axis)
+            self.execute_command( self.construct_command( axis, 'sv', slew_speed ) )
+            self.scan_polled_axes = [3,5]
+
+        return False
+
+    ################################################################################
+    def read_slew_speed(self, axis : int ) -> Optional[int]:
+        """
+        DriveSystem: reads the slew speed of an axis from the motor box, from the
+        "Slew speed = ..." line of the reply to qa
+
+        Parameters
+        ----------
+        axis : int
+            The axis to query
+
+        Returns
+        -------
+        slew_speed : int
+            The slew speed in steps/s, or None if it could not be read
+        """
+        # The query counts towards the rate limits like every other command. The whole reply is read while
+        # the port is locked, so none of it is left for the next command
+        in_cmd = self.construct_command( axis, 'qa' )
+        self.rate_limiter.acquire( [ self.deconstruct_command_from_str(in_cmd) ] )
+        self.lock.acquire()
+        try:
+            output_list = [ self.serial_port_write_read_no_lock( in_cmd, False ) ]
+            output_list += self.serial_port_read_multiple_lines_no_lock()
+        finally:
+            self.lock.release()
+
+        for line in output_list:
+            pattern = re.search( 'Slew speed = (\\d+)', line )
+            if pattern is not None:
+                return int( pattern.group(1) )
+        return None
+
+    ################################################################################
+    def scan_read_encoders(self, axes : list[int] ) -> Tuple[list[Optional[int]], Tuple[float,float]]:
+        """
+        DriveSystem: reads the encoder positions of some axes straight from the
+        motor box for the scan results, rather than using the last positions
+        polled (which only show that the axes reached their targets)
+
+        Parameters
+        ----------
+        axes : list[int]
+            The axes to read
+
+        Returns
+        -------
+        encoders : list[int]
+            The encoder position of each axis (None if it could not be read)
+        read_time : tuple
+            (monotonic, wall) time halfway through the reads from
+            drivesystemscanlog.timestamp()
+        """
+        before = dsscanlog.timestamp()
+        encoders = []
+        for axis in axes:
+            axis_str, answer = self.execute_command( self.construct_command( axis, 'oa' ) )
+            encoders.append( int(answer) if answer is not None else None )
+        after = dsscanlog.timestamp()
+        return encoders, ( (before[0] + after[0])/2, (before[1] + after[1])/2 )
+
+    ################################################################################
+    def scan_move_to_point(self, targets : dict, axes_to_command : list[int], description : str, max_attempts : int = 50 ) -> Tuple[bool, int]:
+        """
+        DriveSystem: moves the target ladder to the next point in a scan and waits
+        until the encoder positions match the targets, re-issuing the move
+        commands every so often in case they were lost
+
+        Parameters
+        ----------
+        targets : dict
+            Dictionary of axis -> encoder position that must be reached
+        axes_to_command : list[int]
+            The axes in targets that need to be sent a move command
+        description : str
+            How to describe the point to the user
+        max_attempts : int
+            The number of 0.1 s checks before the scan is abandoned
+
+        Returns
+        -------
+        arrived : bool
+            True if the point was reached, False if the scan failed or was killed
+        retries : int
+            The number of times the move commands were re-issued
+        """
+        commanded_targets = { axis : targets[axis] for axis in axes_to_command }
+        self.move_group( commanded_targets, False )
+        ctr = 0
+        retries = 0
+
+        while self.is_slit_scanning:
+            if all( self.positions[axis-1] == encoder for axis, encoder in targets.items() ):
+                return True, retries
+
+            dsclock.get_clock().sleep(0.1)
+            ctr += 1
+            if ctr % 5 == 0:
+                # Tell the user we're trying to move and re-issue the command
+                print(f'Trying to move to {description}')
+                retries += 1
+                self.move_group( commanded_targets, False )
+            if ctr > max_attempts:
+                print("Cannot complete slit scan as nothing is moving (did you abort a motor?). Stopping...")
+                print('======= SLIT SCANNING FAILED ========')
+                self.kill_slit_scan()
+                return False, retries
+
+        return False, retries
+
+    ################################################################################
+    @staticmethod
+    def raster_scan_read_file() -> dict:
+        """
+        DriveSystem: reads the parameters for a 2-D raster scan from the slit scan
+        file
+
+        Returns
+        -------
+        options : dict
+            Dictionary of option -> value (see SCAN_FILE_DEFAULTS)
+        """
+        mydict = DriveSystem.scan_read_file( [
+            'RASTER_H_OFFSET_IN_MM', 'RASTER_V_OFFSET_IN_MM', 'RASTER_H_STEP_SIZE_IN_MM', 
+            'RASTER_V_STEP_SIZE_IN_MM', 'RASTER_ORDERING', 'WAIT_TIME_IN_SECONDS', 'SLEW_SPEED_IN_MM_PER_SECOND'
+        ] )
+        DriveSystem.scan_check_speeds( mydict, ['SLEW_SPEED_IN_MM_PER_SECOND'] )
+        return mydict
+
+    ################################################################################
+    def raster_scan_plan(self, centre : list[int], start : list[int], mydict : dict ) -> Tuple[np.ndarray, float]:
+        """
+        DriveSystem: calculates the points of a 2-D raster scan around a centre
+        position and chooses the order in which to visit them. The candidate
+        orderings (row-major, serpentine and nearest-neighbour + 2-opt) are 
+        compared using the slew speed of each axis (read from the motor box)
+        before a choice is made.
+
+        Parameters
+        ----------
+        centre : list[int]
+            The [horizontal, vertical] encoder position at the centre of the scan
+        start : list[int]
+            The [horizontal, vertical] encoder position before the scan begins
+        mydict : dict
+            The options from raster_scan_read_file()
+
+        Returns
+        -------
+        path : np.ndarray
+            (N,2) array of [horizontal, vertical] encoder positions to visit in order
+        estimated_time : float
+            The estimated duration of the scan in seconds
+        """
+        # Calculate encoder positions of the rows and columns
+        positions = []
+        for offset_key, step_key, middle in zip( ['RASTER_H_OFFSET_IN_MM', 'RASTER_V_OFFSET_IN_MM'], ['RASTER_H_STEP_SIZE_IN_MM', 'RASTER_V_STEP_SIZE_IN_MM'], centre ):
+            offset = np.abs( mydict[offset_key] )*MM_TO_STEP
+            step_size = np.abs( mydict[step_key] )*MM_TO_STEP
+            number_of_values = int( 2*offset/step_size + 1 ) if step_size > 0 else 1
+            positions.append( np.linspace( middle - offset, middle + offset, number_of_values, dtype=int ) )
+
+        points, shape = dssp.raster_grid( positions[0], positions[1] )
+
+        # Compare the orderings at the speeds the axes will actually move at (the raster scan does not set
+        # them), using the scan file's speed only if they cannot be read from the motor box
+        slew_speeds = []
+        for axis in [3,5]:
+            slew_speed = self.read_slew_speed(axis)
+            if slew_speed is None or slew_speed <= 0:
+                slew_speed = mydict['SLEW_SPEED_IN_MM_PER_SECOND']*MM_TO_STEP
+                print(f"Could not read the slew speed of axis {axis} from the motor box. Using {slew_speed:.0f} steps/s from the scan file for the estimates")
+            slew_speeds.append(slew_speed)
+        slew_speeds = tuple(slew_speeds)
+        orderings = dssp.candidate_orderings( points, shape, start, slew_speeds )
+        print(f'Estimated times for a {shape[1]} x {shape[0]} raster scan:')
+        best_name, best_order, best_time = dssp.choose_ordering( points, orderings, start, slew_speeds, mydict['WAIT_TIME_IN_SECONDS'] )
+
+        # Use the requested ordering if there is one
+        requested = mydict['RASTER_ORDERING'].lower()
+        if requested != 'auto':
+            if requested in orderings:
+                best_name = requested
+                best_order = orderings[requested]
+                best_time = dssp.estimate_scan_time( points, best_order, start, slew_speeds, mydict['WAIT_TIME_IN_SECONDS'] )[0]
+            else:
+                print(f'SLIT SCAN OPTION WARNING: unknown RASTER_ORDERING {repr(requested)} (choose from auto, {", ".join(orderings.keys())}). Using {best_name}...')
+
+        print(f'Using {best_name} ordering ({best_time:.1f} s)')
+        return points[best_order], best_time
+
+    ################################################################################
+    def raster_scan_steps(self) -> None:
+        """
+        DriveSystem: scans the target ladder over a 2-D grid centred on the 
+        selected in-beam element (or the current position if no element on the
+        target ladder is selected), waiting at each point
+        """
+        mydict = self.raster_scan_read_file()
+
+        # Centre the scan on the selected element if it is on the target ladder
+        element = self.selected_in_beam_element
+        start = [ int(self.positions[2]), int(self.positions[4]) ]
+        if element in dsdidmap.IDMap.ID_LIST_LADDER or dsdidmap.TargetID.is_valid(element):
+            centre = list( dsopts.AXIS_POSITION_DICT[element] )
+            description = element
+        else:
+            centre = start
+            description = 'current position'
+
+        path, estimated_time = self.raster_scan_plan( centre, start, mydict )
+
+        # Open a file to record the results of the scan
+        scan_log = dsscanlog.ScanResultWriter( 'raster_scan', {
+            'element' : description,
+            'centre_encoder_3' : centre[0],
+            'centre_encoder_5' : centre[1],
+            'estimated_time_in_seconds' : f'{estimated_time:.1f}',
+            **{ k.lower() : v for k, v in mydict.items() if k.startswith('RASTER') or k == 'WAIT_TIME_IN_SECONDS' }
+        } )
+
+        print(f'===== RASTER SCANNING AROUND {description} IN PROGRESS =====')
+        try:
+            for i in range(0,len(path)):
+                if self.is_slit_scanning == False:
+                    # Essentially exit this function if someone kills the scan
+                    return
+
+                # The first point may be a long way away
+                targets = { 3 : path[i][0], 5 : path[i][1] }
+                arrived, retries = self.scan_move_to_point( targets, [3,5], f'point {i+1}/{len(path)} {path[i][0]} {path[i][1]}', 500 if i == 0 else 50 )
+                if not arrived:
+                    return
+                measured_encoders, arrival = self.scan_read_encoders( [3,5] )
+
+                print(f'Moved to point {i+1}/{len(path)}: {description} {self.slit_scan_offset_string(path[i][0], centre[0])} (H), {self.slit_scan_offset_string(path[i][1], centre[1])} (V)')
+                dsclock.get_clock().wait( self.slit_scanning_wait_at_position_timer, mydict['WAIT_TIME_IN_SECONDS'] )
+                departure_encoders, departure = self.scan_read_encoders( [3,5] )
+                for axis, commanded_encoder, measured_encoder, departure_encoder in zip( [3,5], path[i], measured_encoders, departure_encoders ):
+                    scan_log.write_point( i, axis, commanded_encoder, measured_encoder, arrival, departure, retries, departure_encoder )
+        finally:
+            scan_log.close()
+
+        print('====== RASTER SCANNING COMPLETE =======')
+        return
     
     ################################################################################
     @staticmethod
@@ -1081,6 +1734,72 @@ class DriveSystem(serialinterface.SerialInterface):
         
 
 
+################################################################################
+################################################################################
+################################################################################
+class MoveGroup:
+    """
+    A handle for a group of axes sent to absolute positions together by
+    DriveSystem.move_group. The group is complete when the encoder positions
+    (which are updated by whichever thread is polling the motor box) match all
+    of the targets.
+    """
+    ################################################################################
+    def __init__(self, drive_system : DriveSystem, targets : dict ) -> None:
+        """
+        MoveGroup: stores the targets of the move
+
+        Parameters
+        ----------
+        drive_system : DriveSystem
+            The DriveSystem that sent the move
+        targets : dict
+            Dictionary of axis number -> encoder position
+        """
+        self.drive_system = drive_system
+        self.targets = dict(targets)
+        self.start_time = dsclock.get_clock().monotonic()
+        return
+    
+    ################################################################################
+    def get_remaining_axes(self) -> list[int]:
+        """
+        MoveGroup: gets the axes that have not yet arrived at their targets
+        """
+        return [ axis for axis, encoder in self.targets.items() if self.drive_system.positions[axis-1] != encoder ]
+
+    ################################################################################
+    def is_complete(self) -> bool:
+        """
+        MoveGroup: True if every axis has arrived at its target
+        """
+        return len( self.get_remaining_axes() ) == 0
+
+    ################################################################################
+    def wait(self, timeout : Optional[float] = None, poll_interval : float = 0.1 ) -> bool:
+        """
+        MoveGroup: blocks until every axis has arrived at its target
+
+        Parameters
+        ----------
+        timeout : float
+            The maximum time to wait in seconds (forever if None)
+        poll_interval : float
+            How often to check the encoder positions in seconds
+
+        Returns
+        -------
+        is_complete : bool
+            True if every axis arrived before the timeout
+        """
+        clock = dsclock.get_clock()
+        while not self.is_complete():
+            if timeout is not None and clock.monotonic() - self.start_time > timeout:
+                return False
+            clock.sleep(poll_interval)
+        return True
+
+
 ################################################################################
 ################################################################################
 ################################################################################
@@ -1134,7 +1853,8 @@ class DriveSystemThread(threading.Thread):
         self.axis_is_readable = np.zeros( (NUMBER_OF_MOTOR_AXES), dtype = bool )
 
         # Define an event used to kill the loop
-        self.event = threading.Event()
+        self.event = dsclock.Event()
+        self.clock = dsclock.get_clock()
 
         return
 
@@ -1156,9 +1876,11 @@ class DriveSystemThread(threading.Thread):
         # Loop while defined to be running
         while self.is_running:
             # Only send commands while the serial port is open AND the thread is not paused
-            if self._driveSystem.check_connection() and self.is_paused == False:
+            is_connected = self._driveSystem.check_connection()
+            self._driveSystem.publish_connection_state( is_connected )
+            if is_connected and self.is_paused == False:
                 # Get the current time
-                t = time.time()
+                t = self.clock.monotonic()
                 
                 # Get the encoder positions for all the motors
                 self.axis_is_readable = self._driveSystem.check_encoder_pos_batch()
@@ -1174,11 +1896,11 @@ class DriveSystemThread(threading.Thread):
                 print( "[", ",".join( [ f'{pos[i]:>7}' if i+1 not in self._driveSystem.disabled_axes else f'{pos[i]:>6}*' for i in range(0,len(pos)) ] ), "]" )
 
                 # Check how much time is left in which to sleep before we repeat again.
-                time_elapsed = time.time() - t
-                self.event.wait( np.max([self.UPDATE_TIME - time_elapsed, 0 ]) )
+                time_elapsed = self.clock.monotonic() - t
+                self.clock.wait( self.event, np.max([self.UPDATE_TIME - time_elapsed, 0 ]) )
             else:
                 # Keep thread alive but sleep if disconnected
-                self.event.wait(1)
+                self.clock.wait( self.event, 1 )
         
         return
 
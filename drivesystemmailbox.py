@@ -0,0 +1,114 @@
+"""
+DriveSystem Mailbox
+===================
+
+A latest-value-wins mailbox for handing snapshots from a background thread to
+the GUI thread. The producer overwrites the single pending value rather than
+queueing it, and the consumer is only scheduled (e.g. with wx.CallAfter) when
+there is not already a delivery waiting. However slow the consumer is, there is
+never more than one delivery queued, and it always gets the newest value, so
+the queue and the lag behind the motors stay bounded. Counters record how many
+values were overwritten before they could be delivered, and how old the values
+were when they were.
+"""
+
+import threading
+import time
+from typing import Any, Callable
+
+################################################################################
+################################################################################
+################################################################################
+class LatestValueMailbox:
+    """
+    Holds at most one pending value. post() can be called from any thread;
+    the consumer is called with the newest value on whichever thread the
+    schedule function runs it on.
+    """
+    ################################################################################
+    def __init__(self, consumer : Callable[[Any], None], schedule : Callable[[Callable], None] ) -> None:
+        """
+        LatestValueMailbox: creates an empty mailbox
+
+        Parameters
+        ----------
+        consumer : Callable[[Any], None]
+            Called with the newest value when it is delivered
+        schedule : Callable[[Callable], None]
+            Arranges for a function to be called later on the consumer's thread
+            (e.g. wx.CallAfter)
+        """
+        self.consumer = consumer
+        self.schedule = schedule
+        self.lock = threading.Lock()
+        self.value = None
+        self.post_time = None
+        self.has_value = False
+        self.is_scheduled = False
+
+        # Counters
+        self.number_posted = 0
+        self.number_delivered = 0
+        self.number_overwritten = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        return
+
+    ################################################################################
+    def post(self, value : Any ) -> None:
+        """
+        LatestValueMailbox: replaces the pending value, and schedules a delivery
+        if one is not already waiting
+
+        Parameters
+        ----------
+        value : Any
+            The new value (it should not be changed after it is posted)
+        """
+        with self.lock:
+            self.number_posted += 1
+            if self.has_value:
+                self.number_overwritten += 1
+            self.value = value
+            self.post_time = time.monotonic()
+            self.has_value = True
+            if self.is_scheduled:
+                return
+            self.is_scheduled = True
+        self.schedule( self.deliver )
+        return
+
+    ################################################################################
+    def deliver(self) -> None:
+        """
+        LatestValueMailbox: passes the pending value to the consumer (called by
+        the schedule function). A value posted while the consumer is running is
+        scheduled again, so it is never lost.
+        """
+        with self.lock:
+            self.is_scheduled = False
+            if not self.has_value:
+                return
+            value = self.value
+            self.last_lag = time.monotonic() - self.post_time
+            self.max_lag = max( self.max_lag, self.last_lag )
+            self.value = None
+            self.has_value = False
+            self.number_delivered += 1
+        self.consumer( value )
+        return
+
+    ################################################################################
+    def get_counters(self) -> dict:
+        """
+        LatestValueMailbox: gets the number of values posted, delivered and
+        overwritten, and the lag of the delivered values in seconds
+        """
+        with self.lock:
+            return {
+                'posted'      : self.number_posted,
+                'delivered'   : self.number_delivered,
+                'overwritten' : self.number_overwritten,
+                'last_lag'    : self.last_lag,
+                'max_lag'     : self.max_lag,
+            }
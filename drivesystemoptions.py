@@ -391,6 +391,14 @@ OPTION_BEAM_BLOCKER_REFERENCE_POINT_ID                           = Option( 'Beam
 OPTION_TUNING_FRAME_IS_TRITIUM_TUNING_FRAME                      = Option( 'TuningFrameIsTritiumFrame', False, validator=bool_validator() )
 OPTION_BEAM_BLOCKER_TO_TROLLEY_AXIS_SOFT_LIMIT                   = Option( 'BeamBlockerTrolleyAxisSoftLimit', None, validator=numeric_validator(int) )
 OPTION_TARGET_LADDER_THICKNESS                                   = Option( 'TargetLadderThickness', 10.0, validator=numeric_validator(float) )
+OPTION_SCAN_RESULTS_DIRECTORY                                    = Option( 'ScanResultsDirectory', SOURCE_DIRECTORY + "/scan_results", validator=str_validator() )
+OPTION_COMMAND_RATE_LIMIT                                        = Option( 'CommandRateLimit', 0.0, validator=numeric_validator(float, min_val=0.0) )
+OPTION_COMMAND_BURST                                             = Option( 'CommandBurst', 10, validator=numeric_validator(int, min_val=1) )
+OPTION_AXIS_COMMAND_RATE_LIMIT                                   = Option( 'AxisCommandRateLimit', 0.0, validator=numeric_validator(float, min_val=0.0) )
+OPTION_AXIS_COMMAND_BURST                                        = Option( 'AxisCommandBurst', 5, validator=numeric_validator(int, min_val=1) )
+OPTION_DUTY_CYCLE_ENVIRONMENT                                    = Option( 'DutyCycleEnvironment', 'vacuum', validator=str_validator() )
+OPTION_DUTY_CYCLE_FORCES                                         = Option( 'DutyCycleForces', [], validator=numeric_csv_list_validator(float) )
+OPTION_MAX_FRAME_RATE                                            = Option( 'MaxFrameRate', 10.0, validator=numeric_validator(float, min_val=0.1) )
 
 OPTION_TROLLEY_AXIS_NUMBER                                       = Option( 'TrolleyAxisNumber', 1, validator=numeric_validator(int, min_val=1, max_val=7) )
 OPTION_ARRAY_AXIS_NUMBER                                         = Option( 'ArrayAxisNumber', 2, validator=numeric_validator(int, min_val=1, max_val=7) )
@@ -464,6 +472,7 @@ certainly responsible for any remaining bugs.
     parser.add_argument('-d','--dark-mode',action='store_true',default=False, help='puts GUI in dark mode')
     parser.add_argument('--no-gui', action='store_true', default=False, help='will just push the encoder positions to Grafana')
     parser.add_argument('--options-file', nargs=1, type=str, help='specify the options file used to control the script', metavar='file', default=DEFAULT_OPTIONS_FILE)
+    parser.add_argument('--profile-startup', action='store_true', default=False, help='print how long each import and step of starting up took (and the memory used)') # Read from sys.argv by DriveSystem.py, before the options can be imported
     args = parser.parse_args()
 
     # Now change things based on values
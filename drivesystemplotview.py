@@ -4,12 +4,26 @@ Drive System Plot View
 
 This is the base class for the side view and head-on view used to visualise what is
 happening inside the ISS magnet when the motors move
+
+Only the artists that move are redrawn when the positions change (blitting). The
+moving artists given by each view are made "animated", so a full draw of the
+figure leaves them out and can be kept as a background. Each frame then restores
+the background and draws the moving artists on top. The background is drawn
+again when the canvas is resized, or when the view says it has changed (e.g.
+something has been shown or hidden).
+
+Nothing is redrawn at all if nothing the view shows has changed: update_positions
+compares what the view depends on (see get_state) with what it showed last time,
+and draw_canvas does nothing unless something has changed since it last drew.
 """
 
 from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
+from matplotlib.figure import Figure
 import wx
 from abc import ABC, abstractmethod
+from typing import Optional
 
 import drivesystemoptions as dsopts
 from drivesystemlib import *
@@ -21,36 +35,49 @@ class PlotView(ABC):
     functionality of a "view" class, which is then updated by derived classes
     """
     ################################################################################
-    def __init__(self, panel : wx.Window, figure_size_inches : tuple):
+    def __init__(self, panel : Optional[wx.Window], figure_size_inches : tuple):
         """
         PlotView: initialises view in a general way
 
         Parameters
         ----------
         panel : wx.Window
-            The parent window that owns the PlotView object
+            The parent window that owns the PlotView object. If None, the view is
+            drawn offscreen on an Agg canvas (no wx.App is needed), e.g. for
+            benchmarking the rendering
         figure_size_inches : tuple
             The size of the figure on the canvas in inches in the form (width,height)
         """
         self.panel = panel
+        self.background = None    # Everything that does not move, copied from the canvas after a full draw
+        self.moving_artists = []  # Artists redrawn on top of the background every frame
+        self.drawn_state = None   # What the view depended on when it was last updated (see get_state)
+        self.last_positions = [0]*NUMBER_OF_MOTOR_AXES # The positions last given to update_positions
+        self.is_dirty = True      # Whether the canvas needs to be drawn
 
-        # Define the figure
-        self.fig = plt.figure()
+        # Define the figure (not through pyplot when offscreen, so no window is made)
+        self.fig = plt.figure() if self.panel is not None else Figure()
         self.fig.set_dpi(plot_view_dpi)
         self.fig.set_size_inches(*figure_size_inches)
         plt.rcParams.update({'font.size': 12})
 
         # Define a canvas
-        self.canvas = FigureCanvas(self.panel, wx.ID_ANY, self.fig)
+        if self.panel is not None:
+            self.canvas = FigureCanvas(self.panel, wx.ID_ANY, self.fig)
+        else:
+            self.canvas = FigureCanvasAgg(self.fig)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.canvas.mpl_connect('resize_event', self.invalidate_background)
 
         # Axis design
         self.set_axis_limits()
-        self.ax = plt.axes(xlim=(self.xmin, self.xmax), ylim=(self.ymin,self.ymax))
+        self.ax = self.fig.add_subplot(xlim=(self.xmin, self.xmax), ylim=(self.ymin,self.ymax))
         self.set_axis_options()
 
         # Draw objects (initially)!
         self.define_constants()
         self.draw_objects([0]*NUMBER_OF_MOTOR_AXES)
+        self.update_moving_artists()
 
     ################################################################################
     @abstractmethod
@@ -93,22 +120,113 @@ class PlotView(ABC):
         """
         pass
     ################################################################################
-    def update_positions(self, pos : list):
+    def get_moving_artists(self) -> list:
+        """
+        PlotView: Override to give the artists that change when the positions do,
+        in the order they should be drawn. These are redrawn every frame on top of
+        everything else, which is only drawn when the background is invalidated.
+        If there are none, the whole canvas is drawn every frame.
+        """
+        return []
+    ################################################################################
+    def update_moving_artists(self):
+        """
+        PlotView: Gets the moving artists from the view and makes them animated
+        (so they are left out of the background). The background is drawn again if
+        there are new ones, as they may already be in it.
+        """
+        moving_artists = sorted( self.get_moving_artists(), key=lambda artist : artist.get_zorder() )
+        for artist in moving_artists:
+            if not artist.get_animated():
+                artist.set_animated(True)
+                self.invalidate_background()
+        self.moving_artists = moving_artists
+    ################################################################################
+    def invalidate_background(self, event = None):
+        """
+        PlotView: Makes the next draw_canvas draw everything, e.g. after something
+        that does not move has been changed, shown or hidden.
+
+        Parameters
+        ----------
+        event : matplotlib.backend_bases.Event
+            The event that caused it (if called by matplotlib)
+        """
+        self.background = None
+        self.is_dirty = True
+    ################################################################################
+    def on_draw(self, event):
+        """
+        PlotView: Called by matplotlib after every full draw of the canvas (which
+        leaves out the moving artists). Keeps a copy as the background, then draws
+        the moving artists on top.
+
+        Parameters
+        ----------
+        event : matplotlib.backend_bases.DrawEvent
+            The draw event
+        """
+        if len(self.moving_artists) == 0:
+            return
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self.moving_artists:
+            self.fig.draw_artist(artist)
+    ################################################################################
+    def get_state(self, pos : list) -> tuple:
         """
-        PlotView: Removes and draws objects.
+        PlotView: Override to give everything the drawing depends on that can
+        change, e.g. the positions of the axes the view shows. The view is only
+        updated when this changes. By default it is all of the positions.
 
         Parameters
         ----------
         pos : list
             The positions of all of the motor axes
         """
+        return tuple( int(x) for x in pos )
+    ################################################################################
+    def update_positions(self, pos : list) -> bool:
+        """
+        PlotView: Removes and draws objects, if anything the view depends on has
+        changed since the last update.
+
+        Parameters
+        ----------
+        pos : list
+            The positions of all of the motor axes
+
+        Returns
+        -------
+        is_changed : bool
+            True if the objects were updated
+        """
+        self.last_positions = pos
+        state = self.get_state(pos)
+        if state == self.drawn_state:
+            return False
         self.remove_objects()
         self.draw_objects(pos)
+        self.update_moving_artists()
+        self.drawn_state = state
+        self.is_dirty = True
+        return True
     ################################################################################
     def draw_canvas(self):
         """
-        PlotView: Allows external users to redraw the canvas.
-        """
-        self.canvas.draw()
-        self.panel.Refresh()
-        self.panel.Update()
+        PlotView: Allows external users to redraw the canvas. Nothing is drawn
+        unless something has changed, and only the moving artists are drawn if
+        there is a background to draw them on.
+        """
+        if not self.is_dirty:
+            return
+        self.is_dirty = False
+        if self.background is None or len(self.moving_artists) == 0:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            for artist in self.moving_artists:
+                self.fig.draw_artist(artist)
+            self.canvas.blit(self.fig.bbox)
+        if self.panel is not None:
+            self.panel.Refresh()
+            self.panel.Update()
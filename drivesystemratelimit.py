@@ -0,0 +1,231 @@
+"""
+DriveSystem Rate Limit
+======================
+
+Token-bucket rate limiting for the commands sent to the motor box, so that the
+Mclennan controller is never sent more commands than it can handle. There is
+one bucket for the whole serial port and one for each axis. A command has to
+take a token from the port bucket and from the bucket of its axis, and waits
+(before the serial port lock is taken) until both have one. Aborts and stops
+are never delayed. Counters record how many commands were throttled and for
+how long, so the limits can be tuned up to the safe limit of the controller.
+"""
+
+import threading
+from typing import Optional
+
+import drivesystemclock as dsclock
+import drivesystemoptions as dsopts
+
+################################################################################
+# CONSTANTS
+BYPASS_COMMANDS = ['ab', 'st'] # Abort and stop are never delayed
+
+################################################################################
+################################################################################
+################################################################################
+class TokenBucket:
+    """
+    A token bucket that refills at a constant rate up to a maximum number of
+    tokens (the burst size). Tokens can be reserved before they are available,
+    in which case the caller is told how long to wait.
+    """
+    ################################################################################
+    def __init__(self, rate : float, capacity : float ) -> None:
+        """
+        TokenBucket: creates a full bucket
+
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second
+        capacity : float
+            The maximum number of tokens (i.e. the size of a burst)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_update = dsclock.get_clock().monotonic()
+        self.lock = threading.Lock()
+        return
+
+    ################################################################################
+    def reserve(self, number_of_tokens : int = 1 ) -> float:
+        """
+        TokenBucket: takes tokens from the bucket, going into debt if there are
+        not enough
+
+        Parameters
+        ----------
+        number_of_tokens : int
+            The number of tokens to take
+
+        Returns
+        -------
+        delay : float
+            How long to wait in seconds before the tokens are actually available
+        """
+        with self.lock:
+            now = dsclock.get_clock().monotonic()
+            self.tokens = min( self.capacity, self.tokens + ( now - self.last_update )*self.rate )
+            self.last_update = now
+            self.tokens -= number_of_tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens/self.rate
+
+
+################################################################################
+################################################################################
+################################################################################
+class CommandRateLimiter:
+    """
+    Limits the commands sent over the serial port, with one TokenBucket for the
+    port and one per axis. A rate of 0 means there is no limit.
+    """
+    ################################################################################
+    def __init__(self, port_rate : float = 0.0, port_burst : int = 1, axis_rate : float = 0.0, axis_burst : int = 1 ) -> None:
+        """
+        CommandRateLimiter: sets up the buckets
+
+        Parameters
+        ----------
+        port_rate : float
+            Commands per second allowed over the whole port (0 for no limit)
+        port_burst : int
+            Commands that can be sent at once over the port before the limit applies
+        axis_rate : float
+            Commands per second allowed on each axis (0 for no limit)
+        axis_burst : int
+            Commands that can be sent at once to an axis before the limit applies
+        """
+        self.port_bucket = TokenBucket( port_rate, port_burst ) if port_rate > 0 else None
+        self.axis_rate = axis_rate
+        self.axis_burst = axis_burst
+        self.axis_buckets = {}
+        self.counter_lock = threading.Lock()
+        self.reset_counters()
+        return
+
+    ################################################################################
+    @classmethod
+    def from_options(cls) -> 'CommandRateLimiter':
+        """
+        CommandRateLimiter: creates a limiter from the CommandRateLimit,
+        CommandBurst, AxisCommandRateLimit and AxisCommandBurst options
+        """
+        return cls(
+            dsopts.OPTION_COMMAND_RATE_LIMIT.get_value(),
+            dsopts.OPTION_COMMAND_BURST.get_value(),
+            dsopts.OPTION_AXIS_COMMAND_RATE_LIMIT.get_value(),
+            dsopts.OPTION_AXIS_COMMAND_BURST.get_value()
+        )
+
+    ################################################################################
+    def reset_counters(self) -> None:
+        """
+        CommandRateLimiter: sets all the counters to zero
+        """
+        with self.counter_lock:
+            self.number_of_commands = 0
+            self.number_bypassed = 0
+            self.number_throttled = 0
+            self.total_delay = 0.0
+            self.max_delay = 0.0
+            self.number_throttled_per_axis = {}
+        return
+
+    ################################################################################
+    def get_axis_bucket(self, axis : int ) -> Optional[TokenBucket]:
+        """
+        CommandRateLimiter: gets the bucket for an axis, creating it if needed
+        """
+        if self.axis_rate <= 0 or axis is None:
+            return None
+        with self.counter_lock:
+            if axis not in self.axis_buckets:
+                self.axis_buckets[axis] = TokenBucket( self.axis_rate, self.axis_burst )
+            return self.axis_buckets[axis]
+
+    ################################################################################
+    def acquire(self, decon_cmd_list : list ) -> float:
+        """
+        CommandRateLimiter: blocks until the commands are allowed to be sent. This
+        should be called before the serial port lock is taken, so that waiting
+        commands do not hold up aborts.
+
+        Parameters
+        ----------
+        decon_cmd_list : list
+            List of (axis, cmd, num) from DriveSystem.deconstruct_command_from_str
+            for the commands that are about to be sent together
+
+        Returns
+        -------
+        delay : float
+            The time spent waiting in seconds
+        """
+        limited = [ (axis, cmd) for axis, cmd, num in decon_cmd_list if cmd not in BYPASS_COMMANDS ]
+        number_bypassed = len(decon_cmd_list) - len(limited)
+
+        delay = 0.0
+        if len(limited) > 0 and self.port_bucket is not None:
+            delay = self.port_bucket.reserve( len(limited) )
+
+        throttled_axes = []
+        for axis in set( [ axis for axis, cmd in limited ] ):
+            bucket = self.get_axis_bucket(axis)
+            if bucket is not None:
+                axis_delay = bucket.reserve( len( [ x for x, cmd in limited if x == axis ] ) )
+                if axis_delay > 0:
+                    throttled_axes.append(axis)
+                delay = max( delay, axis_delay )
+
+        with self.counter_lock:
+            self.number_of_commands += len(decon_cmd_list)
+            self.number_bypassed += number_bypassed
+            if delay > 0:
+                self.number_throttled += len(limited)
+                self.total_delay += delay
+                self.max_delay = max( self.max_delay, delay )
+                for axis in throttled_axes:
+                    self.number_throttled_per_axis[axis] = self.number_throttled_per_axis.get( axis, 0 ) + 1
+
+        if delay > 0:
+            dsclock.get_clock().sleep(delay)
+        return delay
+
+    ################################################################################
+    def get_counters(self) -> dict:
+        """
+        CommandRateLimiter: gets a copy of the counters
+
+        Returns
+        -------
+        counters : dict
+            number_of_commands, number_bypassed, number_throttled, total_delay,
+            max_delay and number_throttled_per_axis
+        """
+        with self.counter_lock:
+            return {
+                'number_of_commands' : self.number_of_commands,
+                'number_bypassed' : self.number_bypassed,
+                'number_throttled' : self.number_throttled,
+                'total_delay' : self.total_delay,
+                'max_delay' : self.max_delay,
+                'number_throttled_per_axis' : dict( self.number_throttled_per_axis ),
+            }
+
+    ################################################################################
+    def print_counters(self) -> None:
+        """
+        CommandRateLimiter: prints the counters to the console
+        """
+        counters = self.get_counters()
+        print(f"Commands sent            : {counters['number_of_commands']}")
+        print(f"Commands bypassing limit : {counters['number_bypassed']}")
+        print(f"Commands throttled       : {counters['number_throttled']}")
+        print(f"Total/max delay          : {counters['total_delay']:.3f} s / {counters['max_delay']:.3f} s")
+        for axis in sorted( counters['number_throttled_per_axis'].keys() ):
+            print(f"  Axis {axis} throttled       : {counters['number_throttled_per_axis'][axis]}")
+        return
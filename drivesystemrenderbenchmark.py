@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+DriveSystem Render Benchmark
+============================
+
+Builds the DriveView and BeamView of the GUI on offscreen Agg canvases and feeds
+them synthetic streams of encoder positions, drawing each frame as
+PosVisPanel.update_positions does, so that changes to the rendering can be
+measured without the beamline or a display. wxPython must still be installed
+(the views live in the GUI module), but no window or wx.App is created.
+
+The position streams are
+  parked : nothing moves, as for most of an experiment
+  tour   : the target ladder visits each element in turn (changing the element in
+           the beam) while the trolley and array move back and forth
+  random : every axis takes a random walk
+
+For each, the frames per second and the time per frame (split into updating and
+drawing each view) are reported, along with the memory, number of artists and
+number of Python objects at the start and end, to spot leaks over thousands of
+frames. A shorter run with every artist timed splits the drawing time by the
+type of artist (time in the artist itself, not in the artists it contains).
+The results are written to a JSON file, and a previous file can be given to
+compare against.
+"""
+
+__version__ = 1.0
+
+import argparse as ap
+import collections
+import contextlib
+import datetime
+import gc
+import io
+import json
+import platform
+import time
+
+import numpy as np
+
+import drivesystemoptions as dsopts
+import MotorBoxSim
+from drivesystembenchmark import get_git_commit, get_rss_in_mb, print_results, summarise_times
+
+################################################################################
+# CONSTANTS
+STREAMS = [ 'parked', 'tour', 'random' ]
+DEFAULT_OUTPUT_FILE = "render_benchmark_results.json"
+TOUR_FRAMES_PER_ELEMENT = 20  # Frames taken to move the target ladder from one element to the next
+CARRIAGE_AMPLITUDE_IN_MM = 50 # How far the trolley and array move back and forth in the tour
+RANDOM_STEP_IN_MM = 0.5       # Size of each step of the random walk
+
+################################################################################
+################################################################################
+################################################################################
+class ArtistTimer:
+    """
+    Times how long each artist in a figure takes to draw by wrapping their draw
+    methods. The time in each artist excludes the time spent drawing the artists
+    it contains, so the times add up to the time to draw the whole figure.
+    """
+    ################################################################################
+    def __init__(self) -> None:
+        """
+        ArtistTimer: starts with no times
+        """
+        self.times = collections.defaultdict(float)
+        self.stack = [] # Time spent in the children of each artist being drawn
+        return
+
+    ################################################################################
+    def instrument(self, figure, prefix : str ) -> None:
+        """
+        ArtistTimer: wraps the draw method of every artist in the figure that is
+        not already wrapped. This must be called before each frame, as some views
+        create new artists when they are updated.
+
+        Parameters
+        ----------
+        figure : matplotlib.figure.Figure
+            The figure containing the artists
+        prefix : str
+            Added to the type of each artist to name it (e.g. the name of the view)
+        """
+        for artist in figure.findobj():
+            if getattr( artist, '_is_timed_by_benchmark', False ):
+                continue
+            artist.draw = self.wrap( artist.draw, f"{prefix}.{type(artist).__name__}" )
+            artist._is_timed_by_benchmark = True
+        return
+
+    ################################################################################
+    def wrap(self, draw, name : str ):
+        """
+        ArtistTimer: wraps a draw method so that its time is added to name
+        """
+        def timed_draw( *args, **kwargs ):
+            start = time.perf_counter()
+            self.stack.append(0.0)
+            try:
+                return draw( *args, **kwargs )
+            finally:
+                elapsed = time.perf_counter() - start
+                time_in_children = self.stack.pop()
+                self.times[name] += elapsed - time_in_children
+                if len(self.stack) > 0:
+                    self.stack[-1] += elapsed
+        return timed_draw
+
+    ################################################################################
+    def get_times_per_frame(self, number_of_frames : int ) -> dict:
+        """
+        ArtistTimer: gets the average time per frame spent drawing each type of
+        artist in ms, slowest first
+        """
+        return { name : 1000.0*t/number_of_frames for name, t in sorted( self.times.items(), key=lambda x : -x[1] ) }
+
+
+################################################################################
+################################################################################
+################################################################################
+class RenderBenchmark:
+    """
+    Creates the DriveView and BeamView offscreen and draws frames of synthetic
+    positions through them
+    """
+    ################################################################################
+    def __init__(self, seed : int = 1, verbose : bool = False ) -> None:
+        """
+        RenderBenchmark: reads the options and creates the views, along with a
+        DriveSystem on a simulated port (the BeamView asks it for the element in
+        the beam)
+
+        Parameters
+        ----------
+        seed : int
+            Seed for the random streams
+        verbose : bool
+            Print everything the views print while they are drawn
+        """
+        self.verbose = verbose
+        self.rng = np.random.default_rng(seed)
+        self.results = {}
+
+        # Imported here as they read the options when imported
+        import drivesystemdetectoridmapping as dsdidmap
+        import drivesystemgui as dsgui
+        import drivesystemguimotorinfo as dsgmi
+        import drivesystemlib as dslib
+        import drivesystemmotorinfo as dsmi
+        self.dslib = dslib
+        self.dsmi = dsmi
+
+        dsopts.CMD_LINE_ARG_SERIAL_PORT.set_value( MotorBoxSim.SIM_URL_PREFIX )
+        if not dslib.read_encoder_positions_of_elements( dsopts.OPTION_2D_LADDER_ENCODER_POSITION_MAP_PATH.get_value() ):
+            raise ValueError("Could not read the encoder positions of the elements")
+        dsmi.init_motor_properties()
+        if not dsmi.set_axis_mapping():
+            raise ValueError("Could not set the axis mapping")
+        dsgmi.store_graphics_info_about_motors()
+
+        with self.quiet():
+            self.drive_system = dslib.DriveSystem()
+            self.views = { 'DriveView' : dsgui.DriveView(None), 'BeamView' : dsgui.BeamView(None) }
+
+        # Elements on the target ladder that the tour visits
+        id_map = dsdidmap.IDMap.get_instance()
+        self.ladder_elements = [ x for x in dsopts.AXIS_POSITION_DICT.keys() if x in id_map.ID_LIST_LADDER or dsdidmap.TargetID.is_valid(x) ]
+        return
+
+    ################################################################################
+    def quiet(self):
+        """
+        RenderBenchmark: hides what the views print (unless verbose)
+        """
+        return contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout( io.StringIO() )
+
+    ################################################################################
+    def get_parked_positions(self) -> np.ndarray:
+        """
+        RenderBenchmark: gets positions with the target ladder and beam blocker at
+        their reference points and the carriages at their measured positions
+        """
+        pos = np.zeros( self.dslib.NUMBER_OF_MOTOR_AXES, dtype=int )
+        axis = lambda name : self.dsmi.MOTOR_AXIS_DICT[name].axis_number - 1
+        pos[axis('TaC')] = int( dsopts.OPTION_ENCODER_AXIS_ONE.get_value() or 0 )
+        pos[axis('ArC')] = int( dsopts.OPTION_ENCODER_AXIS_TWO.get_value() or 0 )
+        reference = dsopts.AXIS_POSITION_DICT.get( dsopts.OPTION_TARGET_LADDER_REFERENCE_POINT_ID.get_value() )
+        if reference is not None:
+            pos[axis('TLH')], pos[axis('TLV')] = reference
+        reference = dsopts.AXIS_POSITION_DICT.get( dsopts.OPTION_BEAM_BLOCKER_REFERENCE_POINT_ID.get_value() )
+        if reference is not None:
+            pos[axis('BBH')], pos[axis('BBV')] = reference
+        return pos
+
+    ################################################################################
+    def make_stream(self, stream : str, number_of_frames : int ) -> tuple[np.ndarray, list]:
+        """
+        RenderBenchmark: makes the positions (and element in the beam) for each
+        frame of a stream
+
+        Parameters
+        ----------
+        stream : str
+            One of STREAMS
+        number_of_frames : int
+            The number of frames
+
+        Returns
+        -------
+        positions : np.ndarray
+            The positions of every axis for each frame, shape (frames, axes)
+        elements : list
+            The element in the beam for each frame
+        """
+        parked = self.get_parked_positions()
+        positions = np.tile( parked, ( number_of_frames, 1 ) )
+        elements = [ dsopts.OPTION_TARGET_LADDER_REFERENCE_POINT_ID.get_value() ]*number_of_frames
+        tlh = self.dsmi.MOTOR_AXIS_DICT['TLH'].axis_number - 1
+        tlv = self.dsmi.MOTOR_AXIS_DICT['TLV'].axis_number - 1
+
+        if stream == 'tour' and len(self.ladder_elements) > 0:
+            frames = np.arange(number_of_frames)
+            stops = np.array( [ dsopts.AXIS_POSITION_DICT[x] for x in self.ladder_elements ] )
+            index = ( frames // TOUR_FRAMES_PER_ELEMENT ) % len(stops)
+            fraction = ( frames % TOUR_FRAMES_PER_ELEMENT )/TOUR_FRAMES_PER_ELEMENT
+            target_ladder = stops[index - 1] + ( stops[index] - stops[index - 1] )*fraction[:,None]
+            positions[:,tlh] = target_ladder[:,0]
+            positions[:,tlv] = target_ladder[:,1]
+            carriage = CARRIAGE_AMPLITUDE_IN_MM*self.dslib.MM_TO_STEP*np.sin( 2*np.pi*frames/( 5*TOUR_FRAMES_PER_ELEMENT ) )
+            for name in ['TaC', 'ArC']:
+                positions[:, self.dsmi.MOTOR_AXIS_DICT[name].axis_number - 1] += carriage.astype(int)
+            elements = [ self.ladder_elements[i] for i in index ]
+
+        elif stream == 'random':
+            steps = self.rng.normal( 0, RANDOM_STEP_IN_MM*self.dslib.MM_TO_STEP, positions.shape )
+            positions += np.cumsum( steps, axis=0 ).astype(int)
+
+        return positions, elements
+
+    ################################################################################
+    def draw_frame(self, pos : np.ndarray, element : str, frame_times : dict ) -> None:
+        """
+        RenderBenchmark: draws a frame as PosVisPanel.update_positions does,
+        timing each part
+
+        Parameters
+        ----------
+        pos : np.ndarray
+            The positions of every axis
+        element : str
+            The element in the beam
+        frame_times : dict
+            Lists of times to add the times of each part to
+        """
+        self.drive_system.selected_in_beam_element = element
+        pos = list(pos)
+        for name, view in self.views.items():
+            t = time.perf_counter()
+            view.update_positions(pos)
+            frame_times[f"{name}.update"].append( time.perf_counter() - t )
+        for name, view in self.views.items():
+            t = time.perf_counter()
+            view.draw_canvas()
+            frame_times[f"{name}.draw"].append( time.perf_counter() - t )
+        return
+
+    ################################################################################
+    def count_artists(self) -> int:
+        """
+        RenderBenchmark: counts the artists in all of the views
+        """
+        return sum( len( view.fig.findobj() ) for view in self.views.values() )
+
+    ################################################################################
+    def run_stream(self, stream : str, number_of_frames : int, number_of_timed_frames : int ) -> dict:
+        """
+        RenderBenchmark: draws a stream of frames and measures the rendering
+
+        Parameters
+        ----------
+        stream : str
+            One of STREAMS
+        number_of_frames : int
+            The number of frames to draw
+        number_of_timed_frames : int
+            The number of frames to draw afterwards with every artist timed (0 to
+            skip)
+
+        Returns
+        -------
+        metrics : dict
+            The metrics of the stream
+        """
+        positions, elements = self.make_stream( stream, number_of_frames )
+        frame_times = collections.defaultdict(list)
+        total_times = []
+
+        with self.quiet():
+            self.draw_frame( positions[0], elements[0], collections.defaultdict(list) ) # Warm up
+            gc.collect()
+            rss_start = get_rss_in_mb()
+            artists_start = self.count_artists()
+            objects_start = len( gc.get_objects() )
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+
+            for pos, element in zip( positions, elements ):
+                t = time.perf_counter()
+                self.draw_frame( pos, element, frame_times )
+                total_times.append( time.perf_counter() - t )
+
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            gc.collect()
+            rss_end = get_rss_in_mb()
+            artists_end = self.count_artists()
+            objects_end = len( gc.get_objects() )
+
+            # Split the drawing by artist on a separate run, as timing every artist slows it down
+            timer = ArtistTimer()
+            for pos, element in zip( positions[:number_of_timed_frames], elements[:number_of_timed_frames] ):
+                for name, view in self.views.items():
+                    timer.instrument( view.fig, name )
+                self.draw_frame( pos, element, collections.defaultdict(list) )
+
+        metrics = {
+            'frames' : number_of_frames,
+            'fps' : number_of_frames/wall_time,
+            'frame_time' : summarise_times(total_times),
+            'parts' : { name : summarise_times(times) for name, times in frame_times.items() },
+            'cpu_percent' : 100.0*cpu_time/wall_time,
+            'memory' : {
+                'rss_start_mb' : rss_start,
+                'rss_end_mb' : rss_end,
+                'rss_growth_mb_per_1000_frames' : 1000.0*( rss_end - rss_start )/number_of_frames,
+                'artists_start' : artists_start,
+                'artists_end' : artists_end,
+                'objects_start' : objects_start,
+                'objects_end' : objects_end,
+            },
+        }
+        if number_of_timed_frames > 0:
+            metrics['artist_ms_per_frame'] = timer.get_times_per_frame( min( number_of_timed_frames, number_of_frames ) )
+        self.results[stream] = metrics
+        return metrics
+
+
+################################################################################
+################################################################################
+################################################################################
+def parse_command_line_arguments() -> ap.Namespace:
+    """
+    Reads the command-line arguments
+    """
+    parser = ap.ArgumentParser(prog='drivesystemrenderbenchmark.py', description='Draws synthetic positions through the DriveView and BeamView offscreen and measures the rendering')
+    parser.add_argument('--version', action='version', version=f'%(prog)s version {__version__}')
+    parser.add_argument('--streams', type=str, default=",".join(STREAMS), help=f'comma-separated position streams to draw (default {",".join(STREAMS)})', metavar='list')
+    parser.add_argument('--frames', type=int, default=2000, help='number of frames to draw for each stream', metavar='n')
+    parser.add_argument('--artist-frames', type=int, default=200, help='number of frames to draw with every artist timed (0 to skip)', metavar='n')
+    parser.add_argument('--options-file', type=str, default=dsopts.DEFAULT_OPTIONS_FILE, help='the options file used by the GUI', metavar='file')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the random stream')
+    parser.add_argument('--compare', type=str, default=None, help='results file from a previous run to compare against', metavar='file')
+    parser.add_argument('-o', '--output', type=str, default=DEFAULT_OUTPUT_FILE, help=f'file to write the results to (default {DEFAULT_OUTPUT_FILE})', metavar='file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print everything the views print')
+    args = parser.parse_args()
+
+    args.streams = [ x.strip() for x in args.streams.split(',') if x.strip() != "" ]
+    for stream in args.streams:
+        if stream not in STREAMS:
+            parser.error(f"unknown stream {stream} - should be one of {', '.join(STREAMS)}")
+    if args.frames < 1:
+        parser.error("--frames must be at least 1")
+    return args
+
+################################################################################
+def main():
+    """
+    Draws the streams given on the command line and writes the results
+    """
+    args = parse_command_line_arguments()
+
+    previous = None
+    if args.compare is not None:
+        try:
+            with open( args.compare, 'r' ) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            print(f"Could not read previous results from {args.compare}")
+
+    dsopts.CMD_LINE_ARG_OPTIONS_FILE_PATH.set_value(args.options_file)
+    dsopts.read_options_from_file()
+
+    benchmark = RenderBenchmark( args.seed, args.verbose )
+    for stream in args.streams:
+        print(f"Drawing {stream}...")
+        benchmark.run_stream( stream, args.frames, args.artist_frames )
+
+    results = {
+        'benchmark_version' : __version__,
+        'commit' : get_git_commit(),
+        'time' : datetime.datetime.now().isoformat( ' ', 'seconds' ),
+        'python' : platform.python_version(),
+        'settings' : { 'frames' : args.frames, 'artist_frames' : args.artist_frames, 'options_file' : args.options_file, 'seed' : args.seed },
+        'workloads' : benchmark.results,
+    }
+    with open( args.output, 'w' ) as f:
+        json.dump( results, f, indent=2 )
+
+    print_results( results, previous )
+    print(f"Results written to {args.output}")
+    return
+
+if __name__ == '__main__':
+    main()
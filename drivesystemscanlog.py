@@ -0,0 +1,319 @@
+"""
+DriveSystem Scan Log
+====================
+
+Writes the results of a scan to disk while the scan is running, so that nothing
+is lost if the scan is aborted. Each file is a CSV file with a commented header
+containing information about the scan, followed by one row per axis for each
+point visited. When the scan is finished, the CSV file is also converted to a
+NumPy .npz file for quick loading offline.
+
+Columns
+-------
+record
+    'point' for a point visited in a step scan, 'sample' for an encoder reading
+    taken while an axis is moving
+point_index
+    The number of the point (or sample) in the scan, starting from 0
+axis
+    The axis number
+commanded_encoder
+    The encoder position the axis was sent to
+measured_encoder
+    The encoder position read from the motor box once the axis was seen at the
+    point (or when sampled), empty if it could not be read
+arrival_monotonic, arrival_wall
+    The time of that reading from the monotonic and wall clocks respectively (see
+    drivesystemclock.py). The axis reached the point no later than this (by up
+    to the time between polls of the positions)
+departure_monotonic, departure_wall
+    The time of the reading when the scan left the point (empty for samples)
+retries
+    The number of times the move command had to be re-issued
+departure_encoder
+    The encoder position read when the scan left the point, showing any drift
+    while waiting there (empty for samples)
+"""
+
+import datetime
+import os
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+import drivesystemclock as dsclock
+import drivesystemoptions as dsopts
+
+################################################################################
+# CONSTANTS
+COLUMNS = [
+    'record', 'point_index', 'axis', 'commanded_encoder', 'measured_encoder',
+    'arrival_monotonic', 'arrival_wall', 'departure_monotonic', 'departure_wall', 'retries',
+    'departure_encoder'
+]
+RECORD_POINT = 'point'
+RECORD_SAMPLE = 'sample'
+FSYNC_INTERVAL = 1.0 # [s]
+
+################################################################################
+def timestamp() -> Tuple[float, float]:
+    """
+    Returns the current time from the monotonic and wall clocks
+
+    Returns
+    -------
+    monotonic : float
+        Clock.monotonic() of the shared clock in seconds
+    wall : float
+        Clock.time() of the shared clock in seconds since the epoch
+    """
+    clock = dsclock.get_clock()
+    return clock.monotonic(), clock.time()
+
+################################################################################
+################################################################################
+################################################################################
+class ScanResultWriter:
+    """
+    Streams the results of a scan to a CSV file. Every row is flushed as soon as
+    it is written, and the file is synchronised with the disk at most once every
+    FSYNC_INTERVAL seconds.
+    """
+    ################################################################################
+    def __init__(self, scan_type : str, metadata : dict, directory : Optional[str] = None ) -> None:
+        """
+        ScanResultWriter: opens a new result file and writes the header
+
+        Parameters
+        ----------
+        scan_type : str
+            Short name for the scan, used at the start of the file name
+        metadata : dict
+            Information about the scan written to the header as '# key: value'
+        directory : str
+            The directory for the file. Defaults to the ScanResultsDirectory option
+        """
+        if directory == None:
+            directory = dsopts.OPTION_SCAN_RESULTS_DIRECTORY.get_value()
+        os.makedirs( directory, exist_ok=True )
+
+        # Never overwrite another scan started in the same second - add _2, _3... instead
+        now = datetime.datetime.now()
+        name = f"{scan_type}_{now.strftime('%Y%m%d-%H%M%S')}"
+        number = 1
+        while True:
+            self.path = os.path.join( directory, f"{name}.csv" if number == 1 else f"{name}_{number}.csv" )
+            try:
+                self.file = open( self.path, 'x' )
+                break
+            except FileExistsError:
+                number += 1
+        self.number_of_rows = 0
+        self.last_fsync = time.monotonic()
+
+        # Write header
+        self.file.write( f"# scan_type: {scan_type}\n" )
+        self.file.write( f"# started: {now.isoformat()}\n" )
+        for key, value in metadata.items():
+            self.file.write( f"# {key}: {value}\n" )
+        self.file.write( ",".join(COLUMNS) + "\n" )
+        self.flush()
+
+        print(f"Writing scan results to {self.path}")
+        return
+
+    ################################################################################
+    def write_point(self, point_index : int, axis : int, commanded_encoder : int, measured_encoder : Optional[int], arrival : Tuple[float,float], departure : Tuple[float,float], retries : int, departure_encoder : Optional[int] = None ) -> None:
+        """
+        ScanResultWriter: writes a row for a point visited by one axis
+
+        Parameters
+        ----------
+        point_index : int
+            The number of the point in the scan
+        axis : int
+            The axis number
+        commanded_encoder : int
+            The encoder position the axis was sent to
+        measured_encoder : int
+            The encoder position read on arrival (None if it could not be read)
+        arrival : tuple
+            (monotonic, wall) time of the reading on arrival from timestamp()
+        departure : tuple
+            (monotonic, wall) time of the reading on departure from timestamp()
+        retries : int
+            The number of times the move command was re-issued
+        departure_encoder : int
+            The encoder position read on departure (None if it was not read)
+        """
+        self.write_row( [
+            RECORD_POINT, point_index, axis, int(commanded_encoder), "" if measured_encoder is None else int(measured_encoder),
+            f"{arrival[0]:.6f}", f"{arrival[1]:.6f}", f"{departure[0]:.6f}", f"{departure[1]:.6f}", retries,
+            "" if departure_encoder is None else int(departure_encoder)
+        ] )
+        return
+
+    ################################################################################
+    def write_sample(self, sample_index : int, axis : int, commanded_encoder : int, measured_encoder : int, sample_time : Tuple[float,float] ) -> None:
+        """
+        ScanResultWriter: writes a row for an encoder position sampled while the
+        axis is moving
+
+        Parameters
+        ----------
+        sample_index : int
+            The number of the sample in the scan
+        axis : int
+            The axis number
+        commanded_encoder : int
+            The encoder position the axis is moving towards
+        measured_encoder : int
+            The encoder position that was read
+        sample_time : tuple
+            (monotonic, wall) time of the reading from timestamp()
+        """
+        self.write_row( [
+            RECORD_SAMPLE, sample_index, axis, int(commanded_encoder), int(measured_encoder),
+            f"{sample_time[0]:.6f}", f"{sample_time[1]:.6f}", "", "", "", ""
+        ] )
+        return
+
+    ################################################################################
+    def write_row(self, row : list) -> None:
+        """
+        ScanResultWriter: writes a row and pushes it to disk
+        """
+        if self.file is None:
+            return
+        self.file.write( ",".join( [ str(x) for x in row ] ) + "\n" )
+        self.number_of_rows += 1
+        self.flush()
+        return
+
+    ################################################################################
+    def flush(self) -> None:
+        """
+        ScanResultWriter: flushes the file, synchronising it with the disk if it
+        has not been done recently
+        """
+        self.file.flush()
+        now = time.monotonic()
+        if now - self.last_fsync > FSYNC_INTERVAL:
+            os.fsync( self.file.fileno() )
+            self.last_fsync = now
+        return
+
+    ################################################################################
+    def close(self, write_npz : bool = True) -> None:
+        """
+        ScanResultWriter: closes the file and optionally writes a copy as .npz
+
+        Parameters
+        ----------
+        write_npz : bool, default : True
+            Convert the CSV file to a .npz file with the same name
+        """
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync( self.file.fileno() )
+        self.file.close()
+        self.file = None
+
+        if write_npz and self.number_of_rows > 0:
+            npz_path = convert_csv_to_npz( self.path )
+            print(f"Scan results written to {self.path} and {npz_path}")
+        else:
+            print(f"Scan results written to {self.path}")
+        return
+
+
+################################################################################
+################################################################################
+################################################################################
+def read_header( path : str ) -> dict:
+    """
+    Reads the commented header of a scan result file
+
+    Parameters
+    ----------
+    path : str
+        The path to the CSV file
+
+    Returns
+    -------
+    metadata : dict
+        Dictionary of key -> value (as strings)
+    """
+    metadata = {}
+    with open( path, 'r' ) as file:
+        for line in file:
+            if not line.startswith('#'):
+                break
+            if ':' in line:
+                key, value = line[1:].split(':', 1)
+                metadata[key.strip()] = value.strip()
+    return metadata
+
+################################################################################
+def read_columns( path : str ) -> dict:
+    """
+    Reads the rows of a scan result CSV file into one array per column, named
+    by the header row of the file (older files may not have every column in
+    COLUMNS). The record type is kept as a string, everything else is a float
+    with empty cells (e.g. departure times for samples) set to NaN
+
+    Parameters
+    ----------
+    path : str
+        The path to the CSV file
+
+    Returns
+    -------
+    columns : dict
+        Dictionary of column name -> np.ndarray
+    """
+    names = COLUMNS
+    rows = []
+    with open( path, 'r' ) as file:
+        for line in file:
+            if line.startswith('#'):
+                continue
+            if line.startswith(COLUMNS[0]):
+                names = line.rstrip('\n').split(',')
+                continue
+            rows.append( line.rstrip('\n').split(',') )
+
+    columns = { names[0] : np.array( [ row[0] for row in rows ], dtype=str ) }
+    for i, name in enumerate( names[1:], start=1 ):
+        columns[name] = np.array( [ float(row[i]) if row[i] != '' else np.nan for row in rows ], dtype=float )
+    return columns
+
+################################################################################
+def convert_csv_to_npz( path : str ) -> str:
+    """
+    Converts a scan result CSV file to a .npz file containing one array per
+    column, plus the header as 'metadata_keys' and 'metadata_values'
+
+    Parameters
+    ----------
+    path : str
+        The path to the CSV file
+
+    Returns
+    -------
+    npz_path : str
+        The path to the .npz file
+    """
+    metadata = read_header(path)
+    columns = read_columns(path)
+
+    npz_path = os.path.splitext(path)[0] + '.npz'
+    np.savez(
+        npz_path,
+        metadata_keys=np.array( list( metadata.keys() ) ),
+        metadata_values=np.array( list( metadata.values() ) ),
+        **columns
+    )
+    return npz_path
@@ -0,0 +1,346 @@
+"""
+DriveSystem Scan Path
+=====================
+
+Functions for choosing the order in which the points of a 2-D scan over the
+target ladder (axes TLH/TLV) are visited. All points are given in encoder steps
+as an (N,2) array of [horizontal, vertical] positions - the same convention as
+the id_dist_map.txt file. The motors on the two axes move simultaneously, so the
+time taken to travel between two points is set by the slower of the two axes
+(i.e. a Chebyshev metric weighted by the slew speed of each axis). This module
+does not talk to the motor box, so it can be used anywhere.
+"""
+
+import numpy as np
+from typing import Callable, Dict, Tuple
+
+################################################################################
+# CONSTANTS
+# The maximum speed of a motor in the motor box is 2000 encoders/s (10 mm/s)
+DEFAULT_SLEW_SPEED = 2000.0 # [steps/s]
+
+# Time spent sending the commands for a single move (one 'ma' per axis, each of
+# which waits SerialInterface.sleep_time for a response)
+DEFAULT_MOVE_OVERHEAD = 0.2 # [s]
+
+# 2-opt is O(N^2) per pass - don't bother beyond this many points
+TWO_OPT_MAX_POINTS = 2500
+TWO_OPT_MAX_PASSES = 20
+
+################################################################################
+################################################################################
+################################################################################
+def raster_grid( h_positions : np.ndarray, v_positions : np.ndarray ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds the points of a rectangular raster in row-major order, where a row has
+    constant vertical position
+
+    Parameters
+    ----------
+    h_positions : np.ndarray
+        The horizontal encoder positions of the columns
+    v_positions : np.ndarray
+        The vertical encoder positions of the rows
+
+    Returns
+    -------
+    points : np.ndarray
+        (N,2) array of [horizontal, vertical] encoder positions
+    shape : tuple
+        The number of (rows, columns) in the raster
+    """
+    hh, vv = np.meshgrid( np.asarray(h_positions), np.asarray(v_positions) )
+    points = np.column_stack( ( hh.ravel(), vv.ravel() ) ).astype(int)
+    return points, hh.shape
+
+################################################################################
+def row_major_order( shape : Tuple[int,int] ) -> np.ndarray:
+    """
+    Naive ordering of a raster: every row is scanned in the same direction, so
+    there is a flyback at the end of each row
+
+    Parameters
+    ----------
+    shape : tuple
+        The number of (rows, columns) in the raster
+
+    Returns
+    -------
+    order : np.ndarray
+        Indices into the points returned by raster_grid()
+    """
+    return np.arange( shape[0]*shape[1] )
+
+################################################################################
+def serpentine_order( shape : Tuple[int,int], column_wise : bool = False ) -> np.ndarray:
+    """
+    Boustrophedon ordering of a raster: every other row (or column) is scanned
+    in the reverse direction so that there is no flyback
+
+    Parameters
+    ----------
+    shape : tuple
+        The number of (rows, columns) in the raster
+    column_wise : bool, default : False
+        Snake along the columns (vertical lines) instead of the rows
+
+    Returns
+    -------
+    order : np.ndarray
+        Indices into the points returned by raster_grid()
+    """
+    index = np.arange( shape[0]*shape[1] ).reshape(shape)
+    if column_wise:
+        index = index.T
+    index = index.copy()
+    index[1::2] = index[1::2, ::-1]
+    return index.ravel()
+
+################################################################################
+def travel_time_matrix( points_a : np.ndarray, points_b : np.ndarray, slew_speeds : Tuple[float,float] ) -> np.ndarray:
+    """
+    Calculates the time taken to travel between every point in points_a and
+    every point in points_b, assuming both axes move at the same time
+
+    Parameters
+    ----------
+    points_a : np.ndarray
+        (N,2) array of encoder positions
+    points_b : np.ndarray
+        (M,2) array of encoder positions
+    slew_speeds : tuple
+        The speed of the horizontal and vertical axes in steps/s
+
+    Returns
+    -------
+    times : np.ndarray
+        (N,M) array of travel times in seconds
+    """
+    speeds = np.asarray( slew_speeds, dtype=float )
+    a = np.asarray( points_a, dtype=float )/speeds
+    b = np.asarray( points_b, dtype=float )/speeds
+    return np.max( np.abs( a[:,None,:] - b[None,:,:] ), axis=2 )
+
+################################################################################
+def segment_travel_times( path : np.ndarray, slew_speeds : Tuple[float,float] ) -> np.ndarray:
+    """
+    Calculates the time taken to travel along each segment of a path
+
+    Parameters
+    ----------
+    path : np.ndarray
+        (N,2) array of encoder positions in the order they are visited
+    slew_speeds : tuple
+        The speed of the horizontal and vertical axes in steps/s
+
+    Returns
+    -------
+    times : np.ndarray
+        (N-1) array of travel times in seconds
+    """
+    steps = np.abs( np.diff( np.asarray(path, dtype=float), axis=0 ) )
+    return np.max( steps/np.asarray( slew_speeds, dtype=float ), axis=1 )
+
+################################################################################
+def estimate_scan_time( points : np.ndarray, order : np.ndarray, start : np.ndarray, slew_speeds : Tuple[float,float] = (DEFAULT_SLEW_SPEED, DEFAULT_SLEW_SPEED), dwell_time : float = 0.0, move_overhead : float = DEFAULT_MOVE_OVERHEAD ) -> Tuple[float, float]:
+    """
+    Estimates how long a scan will take for a given ordering of the points
+
+    Parameters
+    ----------
+    points : np.ndarray
+        (N,2) array of encoder positions
+    order : np.ndarray
+        The order in which to visit the points
+    start : np.ndarray
+        The [horizontal, vertical] encoder position before the scan begins
+    slew_speeds : tuple
+        The speed of the horizontal and vertical axes in steps/s
+    dwell_time : float
+        The time spent waiting at each point in seconds
+    move_overhead : float
+        The time spent sending commands for each move in seconds
+
+    Returns
+    -------
+    total_time : float
+        The estimated time for the whole scan in seconds
+    travel_time : float
+        The part of total_time spent moving between points in seconds
+    """
+    path = np.vstack( ( np.asarray(start).reshape(1,2), np.asarray(points)[order] ) )
+    travel_time = float( np.sum( segment_travel_times( path, slew_speeds ) ) )
+    total_time = travel_time + len(order)*( dwell_time + move_overhead )
+    return total_time, travel_time
+
+################################################################################
+def nearest_neighbour_order( points : np.ndarray, start : np.ndarray, slew_speeds : Tuple[float,float] = (DEFAULT_SLEW_SPEED, DEFAULT_SLEW_SPEED) ) -> np.ndarray:
+    """
+    Greedy ordering for an arbitrary set of points: always travel to the closest
+    point (in time) that has not yet been visited
+
+    Parameters
+    ----------
+    points : np.ndarray
+        (N,2) array of encoder positions
+    start : np.ndarray
+        The [horizontal, vertical] encoder position before the scan begins
+    slew_speeds : tuple
+        The speed of the horizontal and vertical axes in steps/s
+
+    Returns
+    -------
+    order : np.ndarray
+        Indices into points in the order they should be visited
+    """
+    scaled = np.asarray( points, dtype=float )/np.asarray( slew_speeds, dtype=float )
+    current = np.asarray( start, dtype=float )/np.asarray( slew_speeds, dtype=float )
+    visited = np.zeros( len(scaled), dtype=bool )
+    order = np.empty( len(scaled), dtype=int )
+
+    for i in range(0,len(scaled)):
+        times = np.max( np.abs( scaled - current ), axis=1 )
+        times[visited] = np.inf
+        nearest = int( np.argmin(times) )
+        order[i] = nearest
+        visited[nearest] = True
+        current = scaled[nearest]
+
+    return order
+
+################################################################################
+def two_opt( points : np.ndarray, order : np.ndarray, start : np.ndarray, slew_speeds : Tuple[float,float] = (DEFAULT_SLEW_SPEED, DEFAULT_SLEW_SPEED), max_passes : int = TWO_OPT_MAX_PASSES ) -> np.ndarray:
+    """
+    Improves an ordering with the 2-opt heuristic, which reverses sections of
+    the path whenever that shortens it. The path is open and always begins at
+    the start position. The search over the second edge is vectorised.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        (N,2) array of encoder positions
+    order : np.ndarray
+        The initial order in which to visit the points
+    start : np.ndarray
+        The [horizontal, vertical] encoder position before the scan begins
+    slew_speeds : tuple
+        The speed of the horizontal and vertical axes in steps/s
+    max_passes : int
+        The maximum number of passes over the path
+
+    Returns
+    -------
+    order : np.ndarray
+        The improved ordering
+    """
+    order = np.array( order, dtype=int )
+    n = len(order)
+    if n < 3 or n > TWO_OPT_MAX_POINTS:
+        return order
+
+    speeds = np.asarray( slew_speeds, dtype=float )
+    scaled = np.asarray( points, dtype=float )/speeds
+    start_scaled = np.asarray( start, dtype=float ).reshape(1,2)/speeds
+
+    for _ in range(0,max_passes):
+        improved = False
+        for i in range(0,n-1):
+            # Path including the start position - node k of the path is path[k]
+            path = np.vstack( ( start_scaled, scaled[order] ) )
+
+            # Edge (a,b) is the edge entering order[i]
+            a = path[i]
+            b = path[i+1]
+            c = path[i+2:n+1]                   # candidate ends of the reversed section
+            e = path[i+3:n+1]                   # the nodes following those ends
+            d_ab = np.max( np.abs( a - b ) )
+            d_ac = np.max( np.abs( a - c ), axis=1 )
+            d_ce = np.zeros( len(c) )
+            d_be = np.zeros( len(c) )
+            d_ce[:-1] = np.max( np.abs( c[:-1] - e ), axis=1 )
+            d_be[:-1] = np.max( np.abs( b - e ), axis=1 )
+
+            gain = d_ab + d_ce - d_ac - d_be
+            j = int( np.argmax(gain) )
+            if gain[j] > 1e-9:
+                # Reverse order[i..i+1+j]
+                order[i:i+j+2] = order[i:i+j+2][::-1]
+                improved = True
+
+        if not improved:
+            break
+
+    return order
+
+################################################################################
+def candidate_orderings( points : np.ndarray, shape : Tuple[int,int], start : np.ndarray, slew_speeds : Tuple[float,float] = (DEFAULT_SLEW_SPEED, DEFAULT_SLEW_SPEED) ) -> Dict[str, np.ndarray]:
+    """
+    Generates the orderings that are compared before a raster scan starts
+
+    Parameters
+    ----------
+    points : np.ndarray
+        (N,2) array of encoder positions from raster_grid()
+    shape : tuple
+        The number of (rows, columns) in the raster
+    start : np.ndarray
+        The [horizontal, vertical] encoder position before the scan begins
+    slew_speeds : tuple
+        The speed of the horizontal and vertical axes in steps/s
+
+    Returns
+    -------
+    orderings : dict[str, np.ndarray]
+        Dictionary of name -> order
+    """
+    nearest = nearest_neighbour_order( points, start, slew_speeds )
+    return {
+        'row'               : row_major_order( shape ),
+        'serpentine'        : serpentine_order( shape ),
+        'serpentine_column' : serpentine_order( shape, column_wise=True ),
+        'nearest'           : two_opt( points, nearest, start, slew_speeds ),
+    }
+
+################################################################################
+def choose_ordering( points : np.ndarray, orderings : Dict[str, np.ndarray], start : np.ndarray, slew_speeds : Tuple[float,float] = (DEFAULT_SLEW_SPEED, DEFAULT_SLEW_SPEED), dwell_time : float = 0.0, move_overhead : float = DEFAULT_MOVE_OVERHEAD, print_func : Callable[[str],None] = print ) -> Tuple[str, np.ndarray, float]:
+    """
+    Estimates the time for each candidate ordering, prints a comparison and
+    returns the quickest
+
+    Parameters
+    ----------
+    points : np.ndarray
+        (N,2) array of encoder positions
+    orderings : dict[str, np.ndarray]
+        Dictionary of name -> order to be compared
+    start : np.ndarray
+        The [horizontal, vertical] encoder position before the scan begins
+    slew_speeds : tuple
+        The speed of the horizontal and vertical axes in steps/s
+    dwell_time : float
+        The time spent waiting at each point in seconds
+    move_overhead : float
+        The time spent sending commands for each move in seconds
+    print_func : Callable[[str],None]
+        Function used to report the comparison (None to stay quiet)
+
+    Returns
+    -------
+    name : str
+        The name of the quickest ordering
+    order : np.ndarray
+        The quickest ordering
+    total_time : float
+        The estimated time of the quickest ordering in seconds
+    """
+    best_name = None
+    best_time = np.inf
+    for name, order in orderings.items():
+        total_time, travel_time = estimate_scan_time( points, order, start, slew_speeds, dwell_time, move_overhead )
+        if print_func is not None:
+            print_func( f'  {name:<18} : {total_time:8.1f} s ({travel_time:7.1f} s moving)' )
+        if total_time < best_time:
+            best_name = name
+            best_time = total_time
+
+    return best_name, orderings[best_name], best_time
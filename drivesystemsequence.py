@@ -0,0 +1,453 @@
+"""
+DriveSystem Sequence
+====================
+
+Runs sequence files, which are lists of commands for the motor box that can be
+repeated without typing them in by hand. One statement is written per line, and
+anything after a '#' is a comment:
+
+    move <axis> <encoder>                   # move absolute
+    moverel <axis> <steps>                  # move relative
+    group <axis>=<encoder> <axis>=<encoder> # move several axes together
+    send <command>                          # send any command e.g. send 3rs
+    wait [<axis> ...] [timeout <seconds>]   # wait for axes to reach their targets
+                                            # (all axes moved so far if none given)
+    dwell <seconds>                         # do nothing for a while
+    loop <n>                                # repeat everything up to the matching
+    end                                     # end n times (loops can be nested)
+
+The file is compiled before anything is sent: loops are unrolled, consecutive
+commands are collected into batches that are sent in one go with
+DriveSystem.execute_several_commands, and every command is checked against the
+disabled and paused axes and the geometry of the drive system. Nothing is sent
+if any problem is found.
+"""
+
+import re
+from typing import Callable, Optional
+
+import numpy as np
+
+import drivesystemclock as dsclock
+import drivesystemlib as dslib
+
+################################################################################
+# CONSTANTS
+DEFAULT_WAIT_TIMEOUT = 60.0 # [s]
+WAIT_POLL_INTERVAL = 0.2 # [s]
+PATTERN_GROUP_TARGET = re.compile(r'^(\d+)=(-?\d+)$')
+
+################################################################################
+################################################################################
+################################################################################
+class SequenceStep:
+    """
+    One step of a compiled sequence: a batch of commands, a wait or a dwell.
+
+    Attributes
+    ----------
+    kind : str
+        'batch', 'wait' or 'dwell'
+    line_numbers : list[int]
+        The lines in the file that the step came from
+    commands : list[str]
+        The commands sent in a batch (formatted for the motor box)
+    axes : list[int]
+        The axes to wait for (None means all axes moved so far)
+    seconds : float
+        The timeout of a wait or the length of a dwell
+    """
+    ################################################################################
+    def __init__(self, kind : str, line_numbers : list[int], commands : Optional[list[str]] = None, axes : Optional[list[int]] = None, seconds : float = 0.0 ) -> None:
+        self.kind = kind
+        self.line_numbers = line_numbers
+        self.commands = commands if commands is not None else []
+        self.axes = axes
+        self.seconds = seconds
+        return
+
+    ################################################################################
+    def __str__(self) -> str:
+        lines = f"line{'s' if len(self.line_numbers) > 1 else ''} {', '.join( [ str(x) for x in self.line_numbers ] )}"
+        if self.kind == 'batch':
+            return f"send {', '.join( [ repr(x.strip()) for x in self.commands ] )} ({lines})"
+        if self.kind == 'wait':
+            return f"wait for axes {'(all moved)' if self.axes is None else self.axes} ({lines})"
+        return f"dwell {self.seconds} s ({lines})"
+
+
+################################################################################
+################################################################################
+################################################################################
+def parse_sequence_lines( lines : list[str] ) -> Optional[list[tuple]]:
+    """
+    Parses the lines of a sequence file and unrolls any loops
+
+    Parameters
+    ----------
+    lines : list[str]
+        The lines of the file
+
+    Returns
+    -------
+    statements : list[tuple]
+        A list of (line number, keyword, arguments) in the order they will run,
+        or None if the file contains errors
+    """
+    # Stack of lists of statements - a new list is started by each loop
+    stack = [ [] ]
+    loop_counts = []
+    is_ok = True
+
+    for line_number, line in enumerate( lines, start=1 ):
+        words = line.split('#')[0].split()
+        if len(words) == 0:
+            continue
+        keyword = words[0].lower()
+        args = words[1:]
+
+        if keyword == 'loop':
+            if len(args) != 1 or not args[0].isdigit():
+                print(f"SEQUENCE ERROR: line {line_number}: loop needs a number of repeats -> [{line.strip()}]")
+                is_ok = False
+                continue
+            stack.append([])
+            loop_counts.append( int(args[0]) )
+
+        elif keyword == 'end':
+            if len(loop_counts) == 0:
+                print(f"SEQUENCE ERROR: line {line_number}: end without loop")
+                is_ok = False
+                continue
+            body = stack.pop()
+            stack[-1].extend( body*loop_counts.pop() )
+
+        elif keyword in ['move', 'moverel', 'group', 'send', 'wait', 'dwell']:
+            stack[-1].append( (line_number, keyword, args) )
+
+        else:
+            print(f"SEQUENCE ERROR: line {line_number}: unknown statement {repr(keyword)}")
+            is_ok = False
+
+    if len(loop_counts) > 0:
+        print(f"SEQUENCE ERROR: {len(loop_counts)} loop{'s' if len(loop_counts) > 1 else ''} without end")
+        is_ok = False
+
+    if not is_ok:
+        return None
+    return stack[0]
+
+################################################################################
+def compile_statement( drive_system : 'dslib.DriveSystem', line_number : int, keyword : str, args : list[str] ) -> Optional[object]:
+    """
+    Turns one statement into either a list of commands for the motor box or a
+    wait/dwell step
+
+    Parameters
+    ----------
+    drive_system : DriveSystem
+        Used to format and check commands
+    line_number : int
+        The line in the file
+    keyword : str
+        The statement
+    args : list[str]
+        The arguments after the statement
+
+    Returns
+    -------
+    compiled : list[str] | SequenceStep
+        The commands (for moves and send) or the step (for wait and dwell), or
+        None if there is an error
+    """
+    try:
+        if keyword == 'move' or keyword == 'moverel':
+            if len(args) != 2:
+                raise ValueError(f'{keyword} needs an axis and a number')
+            return [ drive_system.construct_command( int(args[0]), 'ma' if keyword == 'move' else 'mr', int(args[1]) ) ]
+
+        if keyword == 'group':
+            if len(args) == 0:
+                raise ValueError('group needs at least one axis=encoder')
+            commands = []
+            for arg in args:
+                pattern = PATTERN_GROUP_TARGET.match(arg)
+                if pattern is None:
+                    raise ValueError(f'{repr(arg)} is not of the form axis=encoder')
+                commands.append( drive_system.construct_command( int(pattern.group(1)), 'ma', int(pattern.group(2)) ) )
+            return commands
+
+        if keyword == 'send':
+            if len(args) != 1:
+                raise ValueError('send needs one command with no spaces')
+            return [ drive_system.construct_command_from_str( args[0] ) ]
+
+        if keyword == 'wait':
+            timeout = DEFAULT_WAIT_TIMEOUT
+            if 'timeout' in [ x.lower() for x in args ]:
+                index = [ x.lower() for x in args ].index('timeout')
+                timeout = float( args[index+1] )
+                args = args[:index] + args[index+2:]
+            axes = [ int(x) for x in args ] if len(args) > 0 else None
+            return SequenceStep( 'wait', [line_number], axes=axes, seconds=timeout )
+
+        if keyword == 'dwell':
+            if len(args) != 1:
+                raise ValueError('dwell needs a number of seconds')
+            return SequenceStep( 'dwell', [line_number], seconds=float(args[0]) )
+
+    except (ValueError, IndexError) as e:
+        print(f"SEQUENCE ERROR: line {line_number}: {e}")
+        return None
+
+    return None
+
+################################################################################
+def check_command( drive_system : 'dslib.DriveSystem', line_number : int, command : str ) -> bool:
+    """
+    Checks a command is well-formed and is not sent to a disabled or paused
+    axis
+
+    Parameters
+    ----------
+    drive_system : DriveSystem
+        The DriveSystem that will send the command
+    line_number : int
+        The line in the file
+    command : str
+        The formatted command
+
+    Returns
+    -------
+    is_ok : bool
+        True if the command can be sent
+    """
+    axis, cmd, num = drive_system.deconstruct_command_from_str( command )
+    if axis is None or cmd is None or axis < 1 or axis > dslib.NUMBER_OF_MOTOR_AXES:
+        print(f"SEQUENCE ERROR: line {line_number}: {repr(command)} is not a valid command")
+        return False
+    if axis in drive_system.disabled_axes and cmd not in dslib.DriveSystem.COMMANDS_ALWAYS_PERMITTED:
+        print(f"SEQUENCE ERROR: line {line_number}: {repr(command)} cannot be used as axis {axis} is disabled")
+        return False
+    if axis in drive_system.paused_axes and cmd in drive_system.movement_commands:
+        print(f"SEQUENCE ERROR: line {line_number}: {repr(command)} cannot be used as axis {axis} is paused")
+        return False
+    return True
+
+################################################################################
+def compile_sequence( drive_system : 'dslib.DriveSystem', lines : list[str] ) -> Optional[list[SequenceStep]]:
+    """
+    Compiles the lines of a sequence file into batches of commands, waits and
+    dwells, and checks everything before it is run. The positions after each
+    batch are predicted from the current positions and checked together
+    against the geometry of the drive system.
+
+    Parameters
+    ----------
+    drive_system : DriveSystem
+        The DriveSystem that will run the sequence
+    lines : list[str]
+        The lines of the file
+
+    Returns
+    -------
+    steps : list[SequenceStep]
+        The compiled sequence, or None if there are any errors
+    """
+    statements = parse_sequence_lines( lines )
+    if statements is None:
+        return None
+
+    steps = []
+    is_ok = True
+    for line_number, keyword, args in statements:
+        compiled = compile_statement( drive_system, line_number, keyword, args )
+        if compiled is None:
+            is_ok = False
+        elif isinstance( compiled, SequenceStep ):
+            steps.append( compiled )
+        else:
+            for command in compiled:
+                is_ok &= check_command( drive_system, line_number, command )
+
+            # Add to the previous batch if there is one
+            if len(steps) > 0 and steps[-1].kind == 'batch':
+                steps[-1].commands.extend( compiled )
+                if line_number not in steps[-1].line_numbers:
+                    steps[-1].line_numbers.append( line_number )
+            else:
+                steps.append( SequenceStep( 'batch', [line_number], commands=list(compiled) ) )
+
+    if not is_ok:
+        return None
+
+    # Predict where everything will be after each batch and check the whole path at once
+    predicted = [ np.array( drive_system.positions, dtype=float ) ]
+    batch_steps = []
+    for step in steps:
+        if step.kind != 'batch':
+            continue
+        position = predicted[-1].copy()
+        for command in step.commands:
+            axis, cmd, num = drive_system.deconstruct_command_from_str( command )
+            if cmd == 'ma':
+                position[axis-1] = num
+            elif cmd == 'mr':
+                position[axis-1] += num
+        predicted.append( position )
+        batch_steps.append( step )
+
+    index = drive_system.geometry.check_path( np.array( predicted ) )
+    if index > 0:
+        print(f"SEQUENCE ERROR: {batch_steps[index-1]} would bring parts too close together")
+        return None
+    elif index == 0:
+        print("SEQUENCE WARNING: the drive system is already closer to a limit than allowed")
+
+    return steps
+
+################################################################################
+def compile_sequence_file( drive_system : 'dslib.DriveSystem', path : str ) -> Optional[list[SequenceStep]]:
+    """
+    Reads and compiles a sequence file (see compile_sequence)
+    """
+    try:
+        with open( path, 'r' ) as file:
+            lines = file.readlines()
+    except (FileNotFoundError, IsADirectoryError):
+        print(f"Cannot open sequence file {repr(path)}")
+        return None
+    return compile_sequence( drive_system, lines )
+
+
+################################################################################
+################################################################################
+################################################################################
+class SequenceRunner:
+    """
+    Runs a compiled sequence on a DriveSystem, reporting progress as it goes.
+    """
+    ################################################################################
+    def __init__(self, drive_system : 'dslib.DriveSystem', steps : list[SequenceStep], progress_callback : Optional[Callable[[int, int, SequenceStep], None]] = None ) -> None:
+        """
+        SequenceRunner: stores the sequence
+
+        Parameters
+        ----------
+        drive_system : DriveSystem
+            The DriveSystem that sends the commands
+        steps : list[SequenceStep]
+            The compiled sequence
+        progress_callback : Callable[[int, int, SequenceStep], None]
+            Called with (step number, number of steps, step) before each step
+        """
+        self.drive_system = drive_system
+        self.steps = steps
+        self.progress_callback = progress_callback
+        self.stop_event = dsclock.Event()
+        self.targets = {} # Axis -> encoder position it was last sent to
+        return
+
+    ################################################################################
+    def run(self) -> bool:
+        """
+        SequenceRunner: runs every step in turn
+
+        Returns
+        -------
+        is_complete : bool
+            True if every step was run
+        """
+        clock = dsclock.get_clock()
+        t0 = clock.monotonic()
+        for i, step in enumerate(self.steps):
+            if self.stop_event.is_set():
+                print("SEQUENCE STOPPED")
+                return False
+
+            print(f"SEQUENCE [{i+1}/{len(self.steps)}]: {step}")
+            if self.progress_callback is not None:
+                self.progress_callback( i, len(self.steps), step )
+
+            if step.kind == 'batch':
+                self.run_batch( step )
+            elif step.kind == 'wait':
+                if not self.run_wait( step ):
+                    return False
+            elif step.kind == 'dwell':
+                clock.wait( self.stop_event, step.seconds )
+
+        print(f"SEQUENCE COMPLETE in {clock.monotonic() - t0:.1f} s")
+        return True
+
+    ################################################################################
+    def run_batch(self, step : SequenceStep ) -> None:
+        """
+        SequenceRunner: sends a batch of commands and remembers where each axis
+        has been sent
+        """
+        for command in step.commands:
+            axis, cmd, num = self.drive_system.deconstruct_command_from_str( command )
+            if cmd == 'ma':
+                self.targets[axis] = num
+            elif cmd == 'mr':
+                self.targets[axis] = self.targets.get( axis, self.drive_system.positions[axis-1] ) + num
+        self.drive_system.execute_several_commands( step.commands, True, True )
+        return
+
+    ################################################################################
+    def run_wait(self, step : SequenceStep ) -> bool:
+        """
+        SequenceRunner: waits for axes to reach the positions they were sent to
+
+        Returns
+        -------
+        is_complete : bool
+            True if every axis arrived before the timeout
+        """
+        axes = list( self.targets.keys() ) if step.axes is None else step.axes
+        targets = { axis : self.targets[axis] for axis in axes if axis in self.targets }
+        clock = dsclock.get_clock()
+        t0 = clock.monotonic()
+        while any( self.drive_system.positions[axis-1] != encoder for axis, encoder in targets.items() ):
+            if clock.monotonic() - t0 > step.seconds:
+                remaining = [ axis for axis, encoder in targets.items() if self.drive_system.positions[axis-1] != encoder ]
+                print(f"SEQUENCE FAILED: axes {remaining} did not reach their targets within {step.seconds} s")
+                return False
+            if clock.wait( self.stop_event, WAIT_POLL_INTERVAL ):
+                print("SEQUENCE STOPPED")
+                return False
+        return True
+
+    ################################################################################
+    def kill(self) -> None:
+        """
+        SequenceRunner: stops the sequence before the next step
+        """
+        self.stop_event.set()
+        return
+
+
+################################################################################
+def run_sequence_file( drive_system : 'dslib.DriveSystem', path : str ) -> bool:
+    """
+    Compiles and runs a sequence file, blocking until it is complete
+
+    Parameters
+    ----------
+    drive_system : DriveSystem
+        The DriveSystem that sends the commands
+    path : str
+        The path to the sequence file
+
+    Returns
+    -------
+    is_complete : bool
+        True if the sequence compiled and every step was run
+    """
+    steps = compile_sequence_file( drive_system, path )
+    if steps is None:
+        print(f"Sequence file {repr(path)} not run")
+        return False
+    print(f"Compiled {repr(path)} into {len(steps)} steps")
+    return SequenceRunner( drive_system, steps ).run()
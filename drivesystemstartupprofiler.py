@@ -0,0 +1,186 @@
+"""
+DriveSystem Startup Profiler
+============================
+
+Measures where the time (and memory) goes when DriveSystem.py starts, for
+--profile-startup. Every module imported for the first time is timed by
+wrapping __import__, keeping the time spent in the module itself separate from
+the time spent importing the modules it imports, and the steps of starting up
+(reading the options, creating the DriveSystem, building the GUI...) are timed
+with stage(). The report lists the slowest of each once everything is running.
+
+Only the standard library is used here, as this has to be imported before
+everything else.
+"""
+
+import builtins
+import contextlib
+import sys
+import threading
+import time
+from typing import Optional
+
+try:
+    import resource # Only on Unix
+except ImportError:
+    resource = None
+
+################################################################################
+# CONSTANTS
+NUMBER_OF_MODULES_TO_PRINT = 25
+
+################################################################################
+def get_peak_memory_in_mb() -> Optional[float]:
+    """
+    Gets the peak memory used by the process in MB (None if it cannot be found)
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    return maxrss/1024/1024 if sys.platform == 'darwin' else maxrss/1024 # bytes on macOS, kB on Linux
+
+
+################################################################################
+################################################################################
+################################################################################
+class StartupProfiler:
+    """
+    Times the imports and stages of starting up. Nothing is recorded until
+    start() is called, so stage() can be left in the code at no cost.
+    """
+    instance = None
+
+    ################################################################################
+    def __init__(self) -> None:
+        """
+        StartupProfiler: creates the profiler (not started)
+        """
+        self.is_running = False
+        self.start_time = None
+        self.original_import = None
+        self.imports = {}    # Module name -> [cumulative time, self time, self peak memory increase]
+        self.local = threading.local() # Each thread has a stack of [time, memory] of the imports made by each import in progress
+        self.stages = []     # (name, time, peak memory increase)
+        StartupProfiler.instance = self
+        return
+
+    ################################################################################
+    @classmethod
+    def get_instance(cls) -> 'StartupProfiler':
+        """
+        StartupProfiler: returns the single instance of the class
+        """
+        if cls.instance is None:
+            cls()
+        return cls.instance
+
+    ################################################################################
+    def start(self) -> None:
+        """
+        StartupProfiler: starts timing imports (call before anything else is
+        imported)
+        """
+        if self.is_running:
+            return
+        self.is_running = True
+        self.start_time = time.perf_counter()
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.timed_import
+        return
+
+    ################################################################################
+    def stop(self) -> None:
+        """
+        StartupProfiler: stops timing imports
+        """
+        if not self.is_running:
+            return
+        builtins.__import__ = self.original_import
+        self.is_running = False
+        return
+
+    ################################################################################
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0 ):
+        """
+        StartupProfiler: replaces __import__, timing modules imported for the first
+        time
+        """
+        if level != 0 or name in sys.modules:
+            return self.original_import( name, globals, locals, fromlist, level )
+
+        if not hasattr( self.local, 'stack' ):
+            self.local.stack = []
+        stack = self.local.stack
+        memory_before = get_peak_memory_in_mb()
+        start = time.perf_counter()
+        stack.append( [0.0, 0.0] )
+        try:
+            return self.original_import( name, globals, locals, fromlist, level )
+        finally:
+            elapsed = time.perf_counter() - start
+            memory = get_peak_memory_in_mb() - memory_before if memory_before is not None else 0.0
+            time_in_children, memory_in_children = stack.pop()
+            if len(stack) > 0:
+                stack[-1][0] += elapsed
+                stack[-1][1] += memory
+            if name not in self.imports:
+                self.imports[name] = [ elapsed, elapsed - time_in_children, memory - memory_in_children ]
+
+    ################################################################################
+    @contextlib.contextmanager
+    def stage(self, name : str ):
+        """
+        StartupProfiler: times a stage of starting up (does nothing unless the
+        profiler has been started)
+
+        Parameters
+        ----------
+        name : str
+            What the stage does
+        """
+        if not self.is_running:
+            yield
+            return
+        memory_before = get_peak_memory_in_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            memory_after = get_peak_memory_in_mb()
+            memory = memory_after - memory_before if memory_before is not None else None
+            self.stages.append( ( name, time.perf_counter() - start, memory ) )
+
+    ################################################################################
+    def print_report(self) -> None:
+        """
+        StartupProfiler: stops the profiler and prints the stages and the slowest
+        imports
+        """
+        if not self.is_running:
+            return
+        self.stop()
+        total_time = time.perf_counter() - self.start_time
+        format_memory = lambda x : f"{x:8.1f} MB" if x is not None else "       ? MB"
+
+        print("================================================================================")
+        print(f"STARTUP PROFILE: {total_time:.3f} s, peak memory {format_memory( get_peak_memory_in_mb() ).strip()}")
+        print("Stages:")
+        for name, t, memory in self.stages:
+            print(f"  {name:<50} {t:8.3f} s {format_memory(memory)}")
+
+        # Group the modules by their top-level package, as that is what can be made lazy
+        packages = {}
+        for name, ( cumulative_time, self_time, memory ) in self.imports.items():
+            package = name.split('.')[0]
+            if package not in packages:
+                packages[package] = [ 0.0, 0.0, 0.0 ]
+            packages[package][1] += self_time
+            packages[package][2] += memory
+            packages[package][0] = max( packages[package][0], cumulative_time ) # The first module imported from a package includes the rest
+
+        print(f"Slowest imports ({len(self.imports)} modules in total) - cumulative includes the modules each imports:")
+        print(f"  {'module':<50} {'self':>10} {'cumulative':>12} {'memory':>11}")
+        for package, ( cumulative_time, self_time, memory ) in sorted( packages.items(), key=lambda x : -x[1][1] )[:NUMBER_OF_MODULES_TO_PRINT]:
+            print(f"  {package:<50} {self_time:8.3f} s {cumulative_time:10.3f} s {format_memory( memory if resource is not None else None )}")
+        print("================================================================================")
+        return
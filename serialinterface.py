@@ -8,9 +8,22 @@ both the DriveSystem class and the MotorBoxSim class.
 """
 import abc
 import serial
-import threading
-import time
-from typing import Union, List
+from typing import Any, Callable, Union, List
+
+import drivesystemclock as dsclock
+
+URL_HANDLERS = {} # Port alias prefix -> function( portalias, timeout ) that opens it instead of pyserial
+
+################################################################################
+def register_url_handler( prefix : str, open_port : Callable[[str, float], Any] ) -> None:
+    """
+    Registers a function that opens the ports whose alias starts with a prefix,
+    instead of pyserial (e.g. MotorBoxSim registers sim:// for a simulated motor
+    box in the same process). It is called with the port alias and the timeout,
+    and must return an object that behaves like a serial.Serial.
+    """
+    URL_HANDLERS[prefix] = open_port
+    return
 
 # Serial interface class
 class SerialInterface:
@@ -25,7 +38,7 @@ class SerialInterface:
         Says if the single instance has been initialised
     serial_port : serial.Serial
         The serial object used for communication
-    lock : threading.Lock
+    lock : dsclock.Lock
         A lock placed on the serial port so that multiple communications cannot happen simultaneously
     baudrate : str (of an integer)
         Something to do with serial ports
@@ -74,18 +87,23 @@ class SerialInterface:
             return
         
         SerialInterface.instance = self
-        self.lock = threading.Lock()
+        self.lock = dsclock.Lock() # Held while waiting on the clock for replies
         self.portalias = portalias
 
         # Port option lists
         self.set_defaults()
-        self.serial_port = serial.Serial(
-            self.portalias, 
-            baudrate=self.baudrate, 
-            bytesize=self.nbits, 
-            parity=self.parity, 
-            timeout=self.timeout
-        )
+        open_port = next( ( handler for prefix, handler in URL_HANDLERS.items() if self.portalias.startswith(prefix) ), None )
+        if open_port is not None:
+            self.serial_port = open_port( self.portalias, self.timeout )
+        else:
+            # serial_for_url also takes URLs such as socket://host:port
+            self.serial_port = serial.serial_for_url(
+                self.portalias, 
+                baudrate=self.baudrate, 
+                bytesize=self.nbits, 
+                parity=self.parity, 
+                timeout=self.timeout
+            )
 
         if self.serial_port.is_open == False:
             self.connect_to_port()
@@ -225,7 +243,7 @@ class SerialInterface:
             if print_in_cmd:
                 print( 'WRITE: ', repr(in_cmd) )
             self.write(in_cmd)
-            time.sleep(self.sleep_time)
+            dsclock.get_clock().sleep(self.sleep_time)
             return self.read()
         else:
             return ""
@@ -330,6 +348,45 @@ class SerialInterface:
         self.lock.release()
         return output_list
     
+    ################################################################################
+    def serial_port_write_read_pipelined( self, in_cmd_list : list[str], print_in_cmd = True ) -> list:
+        """
+        SerialInterface: Acquires the lock, writes all of the commands to the 
+        serial port back-to-back, waits once, and then reads one line back per
+        command. Unlike serial_port_write_read_batch, the commands are not 
+        separated by sleep_time, so they all arrive within a few milliseconds of
+        each other and nothing else can be sent in between them.
+
+        Parameters
+        ----------
+        in_cmd_list : list[str]
+            List of strings for things to write to the serial port
+        print_in_cmd : bool
+            Determines whether the input to the serial port is printed to the 
+            console
+
+        Returns
+        -------
+        output_list: list[str]
+            The list of responses from the serial port (in the order they were
+            sent)
+        """
+        output_list = []
+        self.lock.acquire()
+        try:
+            if self.serial_port.is_open:
+                for in_cmd in in_cmd_list:
+                    if print_in_cmd:
+                        print( 'WRITE: ', repr(in_cmd) )
+                    self.write(in_cmd)
+                dsclock.get_clock().sleep(self.sleep_time)
+                output_list = [ self.read() for in_cmd in in_cmd_list ]
+            else:
+                output_list = [""]*len(in_cmd_list)
+        finally:
+            self.lock.release()
+        return output_list
+    
     ################################################################################
     def serial_port_read_write_no_lock( self, print_output = True ):
         """
@@ -348,7 +405,7 @@ class SerialInterface:
                 if print_output and output[i] != "" and output[i] != None:
                     print('WRITE: ', repr(output[i]))
                 self.write(output[i])
-                time.sleep(self.sleep_time)
+                dsclock.get_clock().sleep(self.sleep_time)
         else:
             if print_output and output != "" and output != None:
                 print( 'WRITE: ', repr(output) )